@@ -14,10 +14,17 @@ import cv2
 import matplotlib.pyplot as plt
 import onnxruntime as ort
 import os
+import blendersam_archive
+import blendersam_automask
+import blendersam_image_io
+import blendersam_mesh
+import blendersam_mesh_index
+import blendersam_runtime
 
 # Define some variables or arguments that can be customized by the user or detected automatically by the script
 image_path = "path/to/image/file" # The path to the image file to be segmented
 model_path = "path/to/model/checkpoint" # The path to the model checkpoint for the Segment Anything model
+decoder_path = "path/to/decoder/checkpoint" # The path to the mask decoder checkpoint for the Segment Anything model
 model_type = "point" # The type of input prompt to use for segmentation ("point", "box", or "text")
 output_path = "path/to/output/folder" # The path to the output folder where the masks and materials will be saved
 
@@ -29,7 +36,7 @@ num_samples = 100 # The number of samples to use for text-based segmentation
 num_iterations = 10 # The number of iterations to run the model for each input prompt
 num_proposals = 5 # The number of proposals to generate for each input prompt
 num_refinements = 3 # The number of refinements to apply for each proposal
-num_samples_per_class = 10 # The number of samples to use for each class in automatic segmentation
+num_samples_per_class = 10 # The number of grid points along each side of the image in automatic segmentation
 num_classes_per_prompt = 5 # The number of classes to segment for each input prompt in manual segmentation
 num_samples_per_prompt = 20 # The number of samples to use for each input prompt in manual segmentation
 num_iterations_per_prompt = 5 # The number of iterations to run the model for each input prompt in manual segmentation
@@ -63,19 +70,19 @@ except RuntimeError:
 
 # Generate masks and materials for all objects in the image using the Segment Anything model
 try:
-    # Convert the image to a numpy array
-    image_array = np.array(image.pixels).reshape(image.size[0], image.size[1], 4)
+    # Read the image pixels into a reused buffer as a top-down (H, W, 4) array
+    image_array = blendersam_image_io.read_pixels(image)
     
-    # Use the Segment Anything model to segment all objects in the image automatically without any input prompts
-    masks, labels = segment_anything.segment(image_array, session, model_type="auto", threshold=threshold, confidence=confidence, num_classes=num_classes, num_samples_per_class=num_samples_per_class)
+    # Use the Segment Anything model to segment all objects in the image automatically from a grid of point prompts
+    masks, scores = blendersam_automask.generate_masks(image_array, model_path, decoder_path, threshold=threshold, points_per_side=num_samples_per_class, pred_iou_threshold=confidence, max_masks=num_classes, refinements=num_refinements)
+    labels = blendersam_runtime.label_colors(len(masks))
     
     # Create a list of images and materials for each mask and label pair
     images = []
     materials = []
     for i in range(len(masks)):
         # Create an image object from the mask array and name it with the prefix "SAM_input"
-        mask_image = bpy.data.images.new(f"SAM_input_{i}", width=image.size[0], height=image.size[1])
-        mask_image.pixels = masks[i].flatten()
+        mask_image = blendersam_image_io.new_mask_image(f"SAM_input_{i}", masks[i])
         images.append(mask_image)
         
         # Create a material object from the label and name it with the prefix "_material"
@@ -108,56 +115,20 @@ try:
         
         materials.append(material)
         
-    # Save the images and materials to the output folder using Blender's operators module
-    for i in range(len(images)):
-        # Check if the output folder is valid and exists
-        if os.path.isdir(output_path):
-            # Use Blender's image save as operator to save each image object as a png file in the output folder 
-            bpy.ops.image.save_as(save_as_render=False, filepath=output_path + f"/SAM_input_{i}.png", relative_path=True)
-            # Use Blender's libraries write operator to save each material object as a blend file in the output folder 
-            bpy.data.libraries.write(output_path + f"/_material_{i}.blend", {materials[i]})
+    # Save all masks with their scores and colors to one mask archive per image in the output folder, instead of
+    # one png and one blend file per mask
+    if os.path.isdir(output_path):
+        archive_path = blendersam_archive.archive_path(output_path, image_path)
+        blendersam_archive.write_archive(archive_path, masks.shape, scores, labels, masks=masks)
             
 except RuntimeError:
     print("Error: Cannot generate masks and materials")
 
 # Create models from masks and materials using Blender's mesh module
 try:
-    # Create a list of plane objects for each mask and material pair using Blender's mesh primitive plane add operator 
-    planes = []
-    for i in range(len(masks)):
-        # Use Blender's mesh primitive plane add operator to create a plane object and name it with the prefix "plane_"
-        bpy.ops.mesh.primitive_plane_add(size=1, enter_editmode=False, align="WORLD", location=(0, 0, 0), scale=(1, 1, 1))
-        plane_object = bpy.context.active_object
-        plane_object.name = f"plane_{i}"
-        
-        # Scale the plane object to match the mask shape using Blender's transform resize operator
-        bpy.ops.transform.resize(value=(masks[i].shape[1], masks[i].shape[0], 1))
-        
-        # Extrude the plane object along the z-axis based on the mask values using Blender's mesh extrude operator
-        bpy.ops.object.mode_set(mode="EDIT")
-        bpy.ops.mesh.select_all(action="SELECT")
-        bpy.ops.mesh.extrude_region_move(TRANSFORM_OT_translate={"value":(0, 0, masks[i] * 10)})
-        bpy.ops.object.mode_set(mode="OBJECT")
-        
-        # Assign the material object to the plane object using Blender's object material slot operators
-        bpy.ops.object.material_slot_add()
-        plane_object.material_slots[0].material = materials[i]
-        
-        planes.append(plane_object)
-        
-    # Join all the plane objects into one model object using Blender's object join operator
-    bpy.ops.object.select_all(action="DESELECT")
-    for plane in planes:
-        plane.select_set(True)
-    bpy.ops.object.join()
-    model_object = bpy.context.active_object
-    model_object.name = "model"
-    
-    # Set the origin of the model object to its center of mass using Blender's object origin set operator
-    bpy.ops.object.origin_set(type="ORIGIN_CENTER_OF_MASS")
-    
-    # Shade the model object smoothly using Blender's object shade smooth operator
-    bpy.ops.object.shade_smooth()
+    # Build the extruded parts of all masks as one mesh object with one material slot per mask, without any
+    # per-mask operator calls; the mesh is centered on the origin and shaded smoothly
+    model_object = blendersam_mesh.create_mask_model("model", np.asarray(masks), materials)
     
     # Save the model object to a file in the output folder using Blender's libraries write operator
     if os.path.isdir(output_path):
@@ -180,9 +151,10 @@ try:
     # Get the selected points or drawn boxes as numpy arrays
     points_or_boxes = np.array(bpy.context.selected_points_or_boxes)
     
-    # Convert the model object to a numpy array of vertices and faces
-    vertices = np.array([v.co for v in model_object.data.vertices])
-    faces = np.array([f.vertices for f in model_object.data.polygons])
+    # Get the vertices and faces of the model from its cached mesh index, which reads them in bulk
+    mesh_index = blendersam_mesh_index.get_index(model_object.data)
+    vertices = mesh_index.vertices
+    faces = mesh_index.faces()
     
     # Use the Segment Anything model to segment different parts of the model based on points or boxes as input prompts
     masks, labels = segment_anything.segment(vertices, faces, session, model_type=model_type, points_or_boxes=points_or_boxes, threshold=threshold, confidence=confidence, num_classes=num_classes_per_prompt, num_samples=num_samples_per_prompt, num_iterations=num_iterations_per_prompt, num_proposals=num_proposals_per_prompt, num_refinements=num_refinements_per_prompt)
@@ -220,16 +192,11 @@ try:
          
          materials.append(material)
          
-     # Assign each material object to a different part of the model based on its mask value using Blender's bmesh module     
-     bm = bmesh.new()
-     bm.from_mesh(model_object.data)
-     
-     for i in range(len(masks)):
-         for f in bm.faces:
-             if masks[i][f.index] == 1:
-                 f.material_index = i
-     
-     bm.to_mesh(model_object.data)     
+     # Assign each material object to a different part of the model by resolving the masks into one label per face
+     # and writing all material indices in one call
+     face_labels = blendersam_mesh.resolve_face_labels(np.asarray(masks) == 1)
+     slots = blendersam_mesh.ensure_material_slots(model_object.data, materials)
+     blendersam_mesh.write_face_labels(model_object.data, face_labels, slots)
      
      # Save each material object to a separate file in the output folder using Blender's libraries write operator     
      for i in range(len(materials)):
@@ -4,6 +4,7 @@
 
 # Import the necessary modules
 import os
+import sys
 import math
 import argparse
 import numpy as np
@@ -11,6 +12,8 @@ import cv2
 from PIL import Image
 import bpy
 from segment_anything import SamPredictor, sam_model_registry
+import blendersam_batch
+import blendersam_runtime
 
 # Define some constants for the pseudocode
 IMAGE_WIDTH = 1920
@@ -98,40 +101,22 @@ def extrude_plane(plane, mask):
     # Input: a blender plane object and a numpy array of shape (H, W) representing a binary mask 
     # Output: None 
 
-     mesh_data.update()
-
-     mesh_data.validate()
-
-     mesh_data.calc_loop_triangles()
-
-     mesh_data.calc_normals_split()
-
-     mesh_data.free_normals_split()
-
-     mesh_data.calc_tessface()
-
-     mesh_data.calc_smooth_groups()
-
-     mesh_data.calc_tangents()
+    # Get the mesh data of the plane object 
+    mesh_data = plane.data
 
-     mesh_data.free_tangents()
-     
-     # Get the mesh data of the plane object 
-     mesh_data = plane.data
-
-     # Loop through each vertex of the mesh data 
-     for i in range(len(mesh_data.vertices)):
-         vertex = mesh_data.vertices[i]
+    # Read all vertex coordinates in one call instead of looping through the vertices in Python 
+    coordinates = np.empty(len(mesh_data.vertices) * 3, dtype=np.float32)
+    mesh_data.vertices.foreach_get("co", coordinates)
+    coordinates = coordinates.reshape(-1, 3)
 
-         # Get the x and y coordinates of the vertex relative to the center of the plane 
-         x = int(vertex.co.x + mask.shape[1] / 2)
-         y = int(vertex.co.y + mask.shape[0] / 2)
+    # Get the x and y coordinates of the vertices relative to the center of the plane 
+    x = np.clip((coordinates[:, 0] + mask.shape[1] / 2).astype(np.int64), 0, mask.shape[1] - 1)
+    y = np.clip((coordinates[:, 1] + mask.shape[0] / 2).astype(np.int64), 0, mask.shape[0] - 1)
 
-         # Get the z coordinate of the vertex based on the mask value at that location 
-         z = mask[y][x] * EXTRUDE_DEPTH
-
-         # Set the z coordinate of the vertex to the new value 
-         vertex.co.z = z
+    # Set the z coordinates of the vertices based on the mask values at those locations 
+    coordinates[:, 2] = mask[y, x] * EXTRUDE_DEPTH
+    mesh_data.vertices.foreach_set("co", coordinates.reshape(-1))
+    mesh_data.update()
 
 def assign_material(plane, material):
     # Assign a material to a plane object 
@@ -207,7 +192,39 @@ def main():
   	parser.add_argument("--image", type=str, help="The path to input image file")
   	parser.add_argument("--output", type=str, help="The path to output directory")
   	parser.add_argument("--model", type=str, help="The name of Segment Anything model to use")
-  	args = parser.parse_args()
+  	parser.add_argument("--input-dir", type=str, help="Segment every image in this directory in batch mode")
+  	parser.add_argument("--manifest", type=str, help="Segment every image listed in this file in batch mode")
+  	parser.add_argument("--encoder", type=str, help="The path to the ONNX image encoder checkpoint used in batch mode")
+  	parser.add_argument("--decoder", type=str, help="The path to the ONNX mask decoder checkpoint used in batch mode")
+  	parser.add_argument("--workers", type=int, default=None, help="The number of worker processes used in batch mode (2 by default)")
+  	parser.add_argument("--no-resume", action="store_true", help="Segment images again even if the output manifest lists them")
+  	parser.add_argument("--profile", type=str, default="default", help="The ONNX Runtime profile used in batch mode (default, cpu_throughput, cpu_low_memory, gpu)")
+  	parser.add_argument("--threads", type=int, default=None, help="The number of ONNX Runtime threads per worker process in batch mode (the cores divided by the workers by default)")
+  	parser.add_argument("--precision", type=str, default="fp32", help="The checkpoint variant used in batch mode (fp32, int8, fp16)")
+  	# Only parse the arguments after "--" when running inside Blender 
+  	args = parser.parse_args(sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else None)
+
+  	# Segment a whole directory or manifest of images on a pool of worker processes 
+  	if args.input_dir is not None or args.manifest is not None:
+  		args.output = args.output or "output"
+  		os.makedirs(args.output, exist_ok=True)
+  		if args.encoder is None or args.decoder is None:
+  			print("Batch mode needs --encoder and --decoder checkpoints")
+  			return
+  		paths = blendersam_batch.collect_inputs(args.input_dir, args.manifest)
+  		settings = {
+  			"encoder_path": blendersam_runtime.variant_path(args.encoder, args.precision),
+  			"decoder_path": blendersam_runtime.variant_path(args.decoder, args.precision),
+  			"threshold": 0.5,
+  			"confidence": 0.9,
+  			"tile_size": TEXTURE_SIZE,
+  			"points_per_side": 16,
+  			"memory_budget": 2048,
+  			"runtime_profile": args.profile,
+  			"threads": args.threads,
+  		}
+  		blendersam_batch.run_batch(paths, args.output, settings, workers=args.workers, resume=not args.no_resume)
+  		return
 
   	# Check if input image file is provided  
   	if args.image is None:
@@ -0,0 +1,84 @@
+# Benchmark for the BlenderSAM image I/O layer
+# Author: AmusedDiffuser
+#
+# Compares the legacy pixel access (np.array(image.pixels) and image.pixels = list) with the
+# foreach_get/foreach_set buffers of blendersam_image_io for several image sizes.
+# Run it inside Blender in background mode:
+#     blender -b --python benchmarks/bench_image_io.py -- --sizes 512 1024 2048 4096
+
+# Import the necessary modules
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import bpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import blendersam_image_io
+
+
+def best_time(function, repeats):
+    # Time a function several times and keep the fastest run
+    # Input: a callable without arguments and an integer representing the number of runs
+    # Output: a float representing the fastest run in seconds
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark_size(size, repeats):
+    # Benchmark reading an image and writing a mask back for one square image size
+    # Input: an integer representing the width and height of the image and the number of runs
+    # Output: a dictionary with the timings in seconds
+    image = bpy.data.images.new(f"bench_{size}", width=size, height=size)
+    mask = np.random.default_rng(0).random((size, size)) > 0.5
+
+    def legacy_read():
+        np.array(image.pixels).reshape(size, size, 4)
+
+    def legacy_write():
+        image.pixels = np.repeat(mask.astype(np.float32).ravel(), 4).tolist()
+
+    def buffered_read():
+        blendersam_image_io.read_pixels(image)
+
+    def buffered_write():
+        blendersam_image_io.write_mask(image, mask)
+
+    # Warm up the reused buffers before timing them
+    buffered_read()
+    buffered_write()
+
+    result = {
+        "size": size,
+        "legacy_read": best_time(legacy_read, repeats),
+        "legacy_write": best_time(legacy_write, repeats),
+        "buffered_read": best_time(buffered_read, repeats),
+        "buffered_write": best_time(buffered_write, repeats),
+    }
+    bpy.data.images.remove(image)
+    return result
+
+
+def main():
+    # Parse the arguments after "--" and print one line per image size
+    parser = argparse.ArgumentParser(description="Benchmark the BlenderSAM image I/O layer")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048, 4096], help="The square image sizes to benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="The number of runs per measurement")
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>6} {'legacy read':>12} {'buffer read':>12} {'speedup':>8} {'legacy write':>13} {'buffer write':>13} {'speedup':>8}")
+    for size in args.sizes:
+        r = benchmark_size(size, args.repeats)
+        print(f"{size:>6} {r['legacy_read']:>11.3f}s {r['buffered_read']:>11.3f}s {r['legacy_read'] / r['buffered_read']:>7.1f}x "
+              f"{r['legacy_write']:>12.3f}s {r['buffered_write']:>12.3f}s {r['legacy_write'] / r['buffered_write']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
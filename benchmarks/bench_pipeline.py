@@ -0,0 +1,278 @@
+# Stage-by-stage benchmark for the BlenderSAM pipeline
+# Author: AmusedDiffuser
+#
+# Times every stage of the pipeline separately on synthetic images and meshes of increasing size:
+# image ingestion, encoding, decoding, one interactive refinement click, mask post-processing, mesh
+# building, mesh indexing, multi-view voting, material creation, face assignment and output writing. It runs without Blender or a GPU,
+# using the bpy stand-in in fake_bpy.py and the small synthetic ONNX models in synthetic_models.py,
+# stores the results as JSON, and compares them with a saved baseline, failing when a stage got slower
+# than its threshold allows.
+# Run it with plain Python:
+#     python benchmarks/bench_pipeline.py --sizes 256 512 1024 --output results.json
+#     python benchmarks/bench_pipeline.py --baseline results.json --threshold 0.2 --stage-threshold decoding=0.5
+
+# Import the necessary modules
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_bpy
+
+fake_bpy.install()
+import bpy
+import blendersam_archive
+import blendersam_automask
+import blendersam_image_io
+import blendersam_interactive
+import blendersam_materials
+import blendersam_mesh
+import blendersam_mesh_index
+import blendersam_multiview
+import blendersam_runtime
+import synthetic_models
+
+# Define some constants for the benchmark
+STAGES = ("ingestion", "encoding", "decoding", "refinement_click", "postprocessing", "mesh_building", "mesh_index",
+          "view_voting", "materials", "face_assignment", "output_writing")
+POINTS_PER_SIDE = 8
+REFINEMENT_CLICKS = 4
+BENCH_VIEWS = 4
+MODELS_DIR = os.path.join(tempfile.gettempdir(), "blendersam_bench_models")
+
+
+def best_time(function, repeats):
+    # Time a function several times and keep the fastest run
+    # Input: a callable without arguments and an integer representing the number of runs
+    # Output: a float representing the fastest run in seconds and the result of the last run
+    times = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def benchmark_size(size, encoder_path, decoder_path, output_dir, repeats):
+    # Run every stage of the pipeline on one square synthetic image
+    # Input: an integer representing the width and height of the image, the paths to the synthetic models,
+    # a directory for the output files, and the number of runs per stage
+    # Output: a dictionary mapping every stage to its fastest run in seconds
+    fake_bpy.reset()
+    rng = np.random.default_rng(size)
+    timings = {}
+
+    image = bpy.data.images.new(f"bench_{size}", width=size, height=size)
+    image.pixels.foreach_set(rng.random(size * size * 4, dtype=np.float32))
+    timings["ingestion"], image_array = best_time(lambda: blendersam_image_io.read_pixels(image), repeats)
+
+    timings["encoding"], embedding = best_time(
+        lambda: blendersam_runtime.encode_image(image_array, encoder_path, cache=None), repeats)
+
+    # Decode a grid of point prompts and keep the binarized masks of every batch
+    image_size = (size, size)
+    points = blendersam_runtime.point_grid(POINTS_PER_SIDE, image_size)
+    point_coords, point_labels = blendersam_runtime.prompts_to_tensors(points, "point", image_size)
+    cutoff = blendersam_runtime.logit_threshold(0.5)
+
+    def decode():
+        masks = np.empty((len(points), size, size), dtype=bool)
+        scores = np.empty(len(points), dtype=np.float32)
+        for start, logits, batch_scores, _ in blendersam_runtime.iter_decode(
+                embedding, decoder_path, point_coords, point_labels, image_size):
+            masks[start:start + len(batch_scores)] = logits > cutoff
+            scores[start:start + len(batch_scores)] = batch_scores
+        return masks, scores
+
+    timings["decoding"], (masks, scores) = best_time(decode, repeats)
+
+    # Refine one segment click by click, feeding the last logits back, and keep the mean time per click
+    session = blendersam_interactive.RefinementSession(image_array, encoder_path, decoder_path, cache=None)
+    clicks = rng.random((REFINEMENT_CLICKS, 2)) * size
+
+    def refine():
+        session.points.clear()
+        session.low_res = None
+        session.mask[:] = False
+        for x, y in clicks:
+            session.add_point(x, y)
+            session.refine()
+        return session.latency_stats()
+
+    click_seconds, _ = best_time(refine, repeats)
+    timings["refinement_click"] = click_seconds / REFINEMENT_CLICKS
+
+    # Encode, box and deduplicate the masks like automatic mask generation does
+    def postprocess():
+        rles = [blendersam_automask.rle_encode(mask) for mask in masks]
+        kept = blendersam_automask.non_max_suppression(blendersam_automask.mask_boxes(masks), scores, rles)
+        return masks[kept], scores[kept]
+
+    timings["postprocessing"], (masks, scores) = best_time(postprocess, repeats)
+    colors = blendersam_runtime.label_colors(len(masks))
+
+    timings["mesh_building"], model_object = best_time(
+        lambda: blendersam_mesh.create_mask_model("bench_model", masks), repeats)
+
+    # Index the mesh from scratch and flood fill it from its first face, as a prompt on a new mesh does
+    def index_mesh():
+        blendersam_mesh_index.release_indexes()
+        mesh_index = blendersam_mesh_index.get_index(model_object.data)
+        return blendersam_mesh_index.flood_fill(mesh_index.graph, [0])
+
+    timings["mesh_index"], _ = best_time(index_mesh, repeats)
+
+    # Vote a few random views around the mesh onto its faces, encoding the views anew on every run
+    mesh_index = blendersam_mesh_index.get_index(model_object.data)
+    faces = blendersam_multiview.world_face_geometry(mesh_index, np.eye(4))
+    center = faces["centers"].mean(axis=0)
+    radius = float(np.linalg.norm(faces["vertices"] - center, axis=1).max())
+    cameras = blendersam_multiview.view_cameras(center, radius, BENCH_VIEWS)
+    views = [rng.integers(0, 256, (size, size, 3), dtype=np.uint8) for _ in range(BENCH_VIEWS)]
+    prompt_faces = np.array([0, len(faces["centers"]) - 1])
+
+    def vote_views():
+        return blendersam_multiview.segment_views(views, cameras, faces, prompt_faces, encoder_path, decoder_path,
+                                                  graph=mesh_index.graph, cache=None)
+
+    timings["view_voting"], _ = best_time(vote_views, repeats)
+
+    # Create the mask images and the shared material the masks are shaded with
+    def create_materials():
+        for i in range(len(masks)):
+            blendersam_image_io.new_mask_image(f"_mask_{i}", masks[i])
+        return blendersam_materials.face_material(colors)
+
+    timings["materials"], material = best_time(create_materials, repeats)
+
+    # Label the faces through random UV centers, starting from an unlabeled mesh on every run
+    mesh = model_object.data
+    face_uvs = rng.random((len(mesh.polygons), 2), dtype=np.float32)
+    rows = np.clip(((1.0 - face_uvs[:, 1]) * size).astype(np.int64), 0, size - 1)
+    columns = np.clip((face_uvs[:, 0] * size).astype(np.int64), 0, size - 1)
+
+    def assign_faces():
+        attribute = mesh.attributes.get(blendersam_mesh.LABEL_ATTRIBUTE)
+        if attribute is not None:
+            mesh.attributes.remove(attribute)
+        face_labels = blendersam_mesh.resolve_face_labels(masks[:, rows, columns], scores)
+        slots = np.repeat(blendersam_mesh.ensure_material_slots(mesh, [material]), len(masks))
+        return blendersam_mesh.write_face_labels(mesh, face_labels, slots)
+
+    timings["face_assignment"], _ = best_time(assign_faces, repeats)
+
+    archive_path = os.path.join(output_dir, f"bench_{size}{blendersam_archive.ARCHIVE_SUFFIX}")
+    timings["output_writing"], _ = best_time(
+        lambda: blendersam_archive.write_archive(archive_path, image_size, scores, colors, masks=masks), repeats)
+    os.remove(archive_path)
+    return timings
+
+
+def run_benchmarks(sizes, repeats, models_dir=MODELS_DIR):
+    # Benchmark every image size
+    # Input: a list of square image sizes, the number of runs per stage, and the directory of the synthetic models
+    # Output: a dictionary holding the environment and the timings of every size and stage in seconds
+    encoder_path, decoder_path = synthetic_models.ensure_models(models_dir)
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "repeats": repeats,
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as output_dir:
+        for size in sizes:
+            results["sizes"][str(size)] = benchmark_size(size, encoder_path, decoder_path, output_dir, repeats)
+    return results
+
+
+def compare_results(results, baseline, threshold, stage_thresholds=None, min_seconds=1e-3):
+    # Find the stages that got slower than the baseline allows
+    # Input: the results of run_benchmarks, a baseline in the same format, the allowed relative slowdown, an
+    # optional dictionary of per-stage allowed slowdowns, and the baseline time below which a stage is noise
+    # Output: a list of (size, stage, baseline seconds, seconds) tuples, one per regression
+    stage_thresholds = stage_thresholds or {}
+    regressions = []
+    for size, stages in results["sizes"].items():
+        baseline_stages = baseline["sizes"].get(size, {})
+        for stage, seconds in stages.items():
+            baseline_seconds = baseline_stages.get(stage)
+            if baseline_seconds is None or baseline_seconds < min_seconds:
+                continue
+            if seconds > baseline_seconds * (1.0 + stage_thresholds.get(stage, threshold)):
+                regressions.append((size, stage, baseline_seconds, seconds))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    # Print one row per size and stage, with the change against the baseline when there is one
+    print(f"{'size':>6} {'stage':<16} {'time':>10} {'baseline':>10} {'change':>8}")
+    for size, stages in results["sizes"].items():
+        for stage in STAGES:
+            seconds = stages[stage]
+            line = f"{size:>6} {stage:<16} {seconds * 1000:>8.2f}ms"
+            baseline_seconds = (baseline or {}).get("sizes", {}).get(size, {}).get(stage)
+            if baseline_seconds:
+                line += f" {baseline_seconds * 1000:>8.2f}ms {seconds / baseline_seconds - 1:>+7.0%}"
+            print(line)
+
+
+def parse_stage_thresholds(values):
+    # Parse "stage=fraction" arguments into a dictionary
+    thresholds = {}
+    for value in values:
+        stage, _, fraction = value.partition("=")
+        if stage not in STAGES:
+            raise argparse.ArgumentTypeError(f"Unknown stage: {stage}")
+        thresholds[stage] = float(fraction)
+    return thresholds
+
+
+def main():
+    # Run the benchmarks, store the results, and exit with status 1 if any stage regressed
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the BlenderSAM pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512, 1024, 2048], help="The square image sizes to benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="The number of runs per stage")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="The allowed relative slowdown of every stage")
+    parser.add_argument("--stage-threshold", type=str, nargs="*", default=[], help="Per-stage allowed slowdowns as stage=fraction")
+    parser.add_argument("--min-time", type=float, default=1e-3, help="Ignore stages whose baseline is faster than this many seconds")
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else None
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeats)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare_results(results, baseline, args.threshold,
+                                      parse_stage_thresholds(args.stage_threshold), args.min_time)
+        for size, stage, baseline_seconds, seconds in regressions:
+            print(f"Regression: {stage} at {size}px took {seconds * 1000:.2f}ms, baseline {baseline_seconds * 1000:.2f}ms")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
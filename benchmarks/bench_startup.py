@@ -0,0 +1,122 @@
+# Startup benchmark for the BlenderSAM addon
+# Author: AmusedDiffuser
+#
+# Measures what enabling the addon costs before and after the heavy dependencies were made lazy. Every
+# measurement runs in a fresh interpreter so that nothing is imported already. The "eager" set is what
+# registration used to import (segment_anything, cv2, matplotlib.pyplot and onnxruntime on top of the
+# helper modules) and the "lazy" set is what it imports now. With --blender the addon file itself is
+# registered in background Blender instead, so an older checkout of the addon can be compared with the
+# current one through --addon.
+# Run it with plain Python or point it at Blender:
+#     python benchmarks/bench_startup.py --repeats 5
+#     python benchmarks/bench_startup.py --blender /path/to/blender --addon old/BlenderSamV1 --addon BlenderSamV1
+
+# Import the necessary modules
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+import numpy as np
+
+# Define some constants for the benchmark
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HELPER_MODULES = ("blendersam_archive", "blendersam_automask", "blendersam_image_io", "blendersam_interactive",
+                  "blendersam_jobs", "blendersam_materials", "blendersam_mesh", "blendersam_mesh_index",
+                  "blendersam_multiview", "blendersam_profiling", "blendersam_runtime", "blendersam_sequence", "blendersam_tiling")
+HEAVY_MODULES = ("segment_anything", "cv2", "matplotlib.pyplot", "onnxruntime")
+IMPORT_SETS = {
+    "eager": HEAVY_MODULES + HELPER_MODULES,
+    "lazy": HELPER_MODULES,
+}
+
+# Imports the modules one by one in a fresh interpreter and prints the seconds and the missing modules
+_IMPORT_SCRIPT = """
+import importlib, json, sys, time
+sys.path.insert(0, {repo!r})
+missing = []
+start = time.perf_counter()
+for name in {modules!r}:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        missing.append(name)
+print(json.dumps({{"seconds": time.perf_counter() - start, "missing": missing}}))
+"""
+
+# Registers an addon file in background Blender and prints the seconds it took
+_BLENDER_SCRIPT = """
+import json, runpy, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+addon = runpy.run_path({addon!r}, run_name="blendersam_startup_bench")
+addon["register"]()
+print("BLENDERSAM_STARTUP " + json.dumps({{"seconds": time.perf_counter() - start, "missing": []}}))
+"""
+
+
+def time_imports(modules, repeats):
+    # Time importing a set of modules in fresh interpreters
+    # Input: a sequence of module names and the number of interpreters to start
+    # Output: a list of seconds per run and the list of modules that could not be imported
+    times = []
+    missing = []
+    for _ in range(repeats):
+        script = _IMPORT_SCRIPT.format(repo=REPO_DIR, modules=tuple(modules))
+        output = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        times.append(result["seconds"])
+        missing = result["missing"]
+    return times, missing
+
+
+def time_blender(blender, addon_path, repeats):
+    # Time registering an addon file in background Blender
+    # Input: the path to the Blender executable, the path to the addon file, and the number of runs
+    # Output: a list of seconds per run and an empty list of missing modules
+    times = []
+    for _ in range(repeats):
+        script = _BLENDER_SCRIPT.format(repo=REPO_DIR, addon=os.path.abspath(addon_path))
+        output = subprocess.run([blender, "--background", "--factory-startup", "--python-expr", script],
+                                check=True, capture_output=True, text=True).stdout
+        line = next(line for line in output.splitlines() if line.startswith("BLENDERSAM_STARTUP "))
+        times.append(json.loads(line.split(" ", 1)[1])["seconds"])
+    return times, []
+
+
+def print_results(results):
+    # Print one row per measured set with its median and fastest time
+    print(f"{'set':<32} {'median':>10} {'fastest':>10}  missing")
+    for name, result in results.items():
+        print(f"{name:<32} {result['median_ms']:>8.1f}ms {result['min_ms']:>8.1f}ms  "
+              f"{', '.join(result['missing']) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup cost of the BlenderSAM addon")
+    parser.add_argument("--repeats", type=int, default=5, help="The number of fresh interpreters per set")
+    parser.add_argument("--blender", type=str, default=None, help="Register the addon in this Blender executable")
+    parser.add_argument("--addon", type=str, action="append", default=None, help="An addon file to register with --blender, may be repeated")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    measurements = {}
+    if args.blender is not None:
+        for addon_path in args.addon or [os.path.join(REPO_DIR, "BlenderSamV1")]:
+            measurements[addon_path] = time_blender(args.blender, addon_path, args.repeats)
+    else:
+        for name, modules in IMPORT_SETS.items():
+            measurements[name] = time_imports(modules, args.repeats)
+
+    results = {name: {"median_ms": float(np.median(times)) * 1000.0, "min_ms": min(times) * 1000.0,
+                      "missing": missing}
+               for name, (times, missing) in measurements.items()}
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
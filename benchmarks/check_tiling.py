@@ -0,0 +1,90 @@
+# Seam stitching regression check for tiled segmentation
+# Author: AmusedDiffuser
+#
+# Stitches hand-made tile masks with blendersam_tiling the way segment_tiled does and checks the label map
+# against the known answer: an object that crosses the seam between two tiles must end up with one label, an
+# object that crosses the corner of four tiles must too, and two objects that only touch in the overlap must
+# keep their own labels. It runs without Blender or models and exits with a non-zero status when a case fails.
+# Run it with plain Python:
+#     python benchmarks/check_tiling.py
+
+# Import the necessary modules
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import blendersam_tiling
+
+# Define some constants for the checks
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+
+
+def stitch(shape, objects):
+    # Stitch the part of every object inside every tile, like segment_tiled does with decoded masks
+    # Input: the (H, W) shape of the image and a list of boolean numpy arrays of that shape, one per object
+    # Output: an int32 numpy array of shape (H, W) holding the label of every pixel
+    label_map = np.zeros(shape, dtype=np.int32)
+    areas = [0]
+    scores = [0.0]
+    tiles = blendersam_tiling.plan_tiles(shape[0], shape[1], TILE_SIZE, TILE_OVERLAP)
+    for t, (top, bottom, left, right) in enumerate(tiles):
+        region = label_map[top:bottom, left:right]
+        seen = blendersam_tiling.seen_pixels(tiles, t)
+        first_label = len(areas)
+        for score, full_mask in zip(np.linspace(0.99, 0.9, len(objects)), objects):
+            mask = full_mask[top:bottom, left:right]
+            if mask.any():
+                blendersam_tiling.stitch_mask(region, mask, areas, scores, float(score), seen=seen,
+                                              first_label=first_label)
+    return label_map
+
+
+def labels_of(label_map, mask):
+    return set(np.unique(label_map[mask]).tolist()) - {0}
+
+
+def check_seam():
+    # A wide object across the seam between two tiles gets one label
+    shape = (TILE_SIZE, 2 * TILE_SIZE - TILE_OVERLAP)
+    rows, columns = np.ogrid[:shape[0], :shape[1]]
+    band = (rows >= 300) & (rows < 700) & (columns >= 200) & (columns < shape[1] - 200)
+    labels = labels_of(stitch(shape, [band]), band)
+    return len(labels) == 1, f"{len(labels)} labels"
+
+
+def check_corner():
+    # A disk over the corner shared by four tiles gets one label
+    size = 2 * TILE_SIZE - TILE_OVERLAP
+    rows, columns = np.ogrid[:size, :size]
+    disk = (rows - size / 2) ** 2 + (columns - size / 2) ** 2 < 600 ** 2
+    labels = labels_of(stitch((size, size), [disk]), disk)
+    return len(labels) == 1, f"{len(labels)} labels"
+
+
+def check_neighbors():
+    # Two objects side by side in the overlap keep their own labels
+    shape = (TILE_SIZE, 2 * TILE_SIZE - TILE_OVERLAP)
+    rows, columns = np.ogrid[:shape[0], :shape[1]]
+    middle = shape[1] // 2
+    first = (rows >= 300) & (rows < 700) & (columns >= 100) & (columns < middle)
+    second = (rows >= 300) & (rows < 700) & (columns >= middle) & (columns < shape[1] - 100)
+    label_map = stitch(shape, [first, second])
+    first_labels, second_labels = labels_of(label_map, first), labels_of(label_map, second)
+    passed = len(first_labels) == 1 and len(second_labels) == 1 and first_labels != second_labels
+    return passed, f"{len(first_labels)} and {len(second_labels)} labels"
+
+
+def main():
+    failed = False
+    for name, check in (("seam", check_seam), ("corner", check_corner), ("neighbors", check_neighbors)):
+        passed, details = check()
+        failed |= not passed
+        print(f"{name:<10} {'ok' if passed else 'FAILED':<7} {details}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
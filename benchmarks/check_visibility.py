@@ -0,0 +1,141 @@
+# Visibility regression check for multi-view segmentation
+# Author: AmusedDiffuser
+#
+# Builds small synthetic scenes and checks the face visibility test of blendersam_multiview against the
+# known answer: a quad in front of a grid of faces must hide the whole grid, the faces of a sphere turned
+# toward the camera must all be visible, and a sphere behind another one must only show the part that sticks
+# out. It runs without Blender and exits with a non-zero status when a case fails.
+# Run it with plain Python:
+#     python benchmarks/check_visibility.py
+
+# Import the necessary modules
+import os
+import sys
+import math
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import blendersam_mesh_index
+import blendersam_multiview
+
+# Define some constants for the checks
+RESOLUTION = 256
+GRID_SIZE = 60
+
+
+def build_index(vertices, faces):
+    # Build a MeshIndex from vertices and quads without Blender
+    loop_vertices = np.asarray(faces, dtype=np.int32).reshape(-1)
+    loop_totals = np.full(len(faces), 4, dtype=np.int32)
+    arrays = {
+        "vertices": np.asarray(vertices, dtype=np.float32),
+        "loop_vertices": loop_vertices,
+        "loop_starts": np.arange(len(faces), dtype=np.int32) * 4,
+        "loop_totals": loop_totals,
+        "face_uvs": None,
+    }
+    return blendersam_mesh_index.MeshIndex(arrays)
+
+
+def grid(size, extent, height, base=0):
+    # Build a square grid of quads in the plane z = height, facing +Z
+    steps = np.linspace(-extent, extent, size + 1)
+    xs, ys = np.meshgrid(steps, steps)
+    vertices = np.stack([xs.ravel(), ys.ravel(), np.full(xs.size, height)], axis=1)
+    faces = []
+    for row in range(size):
+        for column in range(size):
+            corner = base + row * (size + 1) + column
+            faces.append([corner, corner + 1, corner + size + 2, corner + size + 1])
+    return vertices, faces
+
+
+def sphere(rings, segments, offset, base=0):
+    # Build a UV sphere of quads with outward normals
+    latitudes = np.linspace(-math.pi / 2, math.pi / 2, rings + 1)
+    longitudes = np.linspace(0.0, 2.0 * math.pi, segments, endpoint=False)
+    vertices = np.array([[math.cos(a) * math.cos(o), math.cos(a) * math.sin(o), math.sin(a)]
+                         for a in latitudes for o in longitudes]) + offset
+    faces = []
+    for ring in range(rings):
+        for segment in range(segments):
+            first = base + ring * segments + segment
+            second = base + ring * segments + (segment + 1) % segments
+            faces.append([first, second, second + segments, first + segments])
+    return vertices, faces
+
+
+def visible(vertices, faces, camera):
+    # Run the visibility test of one view on a mesh
+    mesh_index = build_index(vertices, faces)
+    geometry = blendersam_multiview.world_face_geometry(mesh_index, np.eye(4))
+    to_camera = camera[:3, 3].astype(np.float32) - geometry["centers"]
+    facing = np.einsum("ij,ij->i", geometry["normals"], to_camera) / np.linalg.norm(to_camera, axis=1)
+    result = np.zeros(len(faces), dtype=bool)
+    result[blendersam_multiview.visible_faces(geometry, camera, facing, RESOLUTION)] = True
+    return result, geometry, facing
+
+
+def top_camera(height):
+    # A camera above the origin looking down -Z
+    camera = np.eye(4)
+    camera[2, 3] = height
+    return camera
+
+
+def check_occluder():
+    # One quad in front of a grid hides every face of the grid
+    back_vertices, back_faces = grid(GRID_SIZE, 1.0, 0.0)
+    front_vertices, front_faces = grid(1, 1.5, 1.0, base=len(back_vertices))
+    result, _, _ = visible(np.concatenate([back_vertices, front_vertices]), back_faces + front_faces, top_camera(6.0))
+    leaks = int(result[:len(back_faces)].sum())
+    return leaks == 0 and result[len(back_faces):].all(), f"{leaks} of {len(back_faces)} hidden faces visible"
+
+
+def check_sphere():
+    # Every face of a convex sphere turned toward the camera is visible
+    vertices, faces = sphere(40, 80, np.zeros(3))
+    camera = blendersam_multiview.view_cameras(np.zeros(3), 1.0, 3)[1]
+    result, _, facing = visible(vertices, faces, camera)
+    front = facing > blendersam_multiview.FACING_MIN
+    recall = result[front].mean()
+    return recall > 0.99 and not result[~front].any(), f"recall {recall:.3f}"
+
+
+def check_overlap():
+    # A sphere behind another one only shows the part outside the silhouette of the front sphere
+    front_vertices, front_faces = sphere(40, 80, np.zeros(3))
+    back_vertices, back_faces = sphere(40, 80, np.array([0.8, 0.0, -3.0]), base=len(front_vertices))
+    camera = top_camera(6.0)
+    result, geometry, facing = visible(np.concatenate([front_vertices, back_vertices]), front_faces + back_faces,
+                                       camera)
+
+    # Cast a ray from the camera to every back face center and see whether it hits the front unit sphere
+    count = len(front_faces)
+    origin = camera[:3, 3]
+    directions = geometry["centers"][count:] - origin
+    lengths = np.linalg.norm(directions, axis=1)
+    directions /= lengths[:, None]
+    half_b = directions @ origin
+    discriminant = half_b ** 2 - (origin @ origin - 1.0)
+    hidden = (discriminant > 0) & (-half_b - np.sqrt(np.maximum(discriminant, 0.0)) < lengths)
+    front = facing[count:] > blendersam_multiview.FACING_MIN
+
+    # Faces whose center is hidden but whose corner peeks past the silhouette may count as visible
+    leaks = int((result[count:] & front & hidden).sum())
+    recall = result[count:][front & ~hidden].mean()
+    return leaks <= 0.02 * (front & hidden).sum() and recall > 0.95, f"{leaks} leaks, recall {recall:.3f}"
+
+
+def main():
+    failed = False
+    for name, check in (("occluder", check_occluder), ("sphere", check_sphere), ("overlap", check_overlap)):
+        passed, details = check()
+        failed |= not passed
+        print(f"{name:<10} {'ok' if passed else 'FAILED':<7} {details}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
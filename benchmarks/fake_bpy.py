@@ -0,0 +1,370 @@
+# A lightweight stand-in for Blender's bpy module used by the benchmarks
+# Author: AmusedDiffuser
+#
+# Implements just the parts of bpy.data that the BlenderSAM helper modules touch: images with a float
+# pixel block, meshes with bulk foreach_get/foreach_set on vertices, loops, polygons and attributes,
+# objects, materials and node trees. Bulk access copies numpy arrays like Blender does, so timings keep
+# the cost of the data movement while leaving out Blender's own overhead.
+
+# Import the necessary modules
+import sys
+import types
+from types import SimpleNamespace
+
+import numpy as np
+
+# The number of values every item of a property holds, for the properties the helpers access in bulk
+_PROPERTY_SIZES = {"co": 3, "normal": 3, "uv": 2, "center": 3}
+_PROPERTY_TYPES = {"vertex_index": np.int32, "loop_start": np.int32, "loop_total": np.int32,
+                   "material_index": np.int32, "use_smooth": bool, "value": np.int32}
+
+
+class PropertyCollection:
+    # A collection of items whose properties are stored as one numpy array per property
+
+    def __init__(self, length=0):
+        self._length = length
+        self._data = {}
+
+    def add(self, count):
+        self._length += count
+        for name, values in self._data.items():
+            self._data[name] = np.concatenate([values, np.zeros((count,) + values.shape[1:], dtype=values.dtype)])
+
+    def _values(self, name):
+        values = self._data.get(name)
+        if values is None:
+            size = _PROPERTY_SIZES.get(name, 1)
+            shape = (self._length, size) if size > 1 else (self._length,)
+            values = np.zeros(shape, dtype=_PROPERTY_TYPES.get(name, np.float32))
+            self._data[name] = values
+        return values
+
+    def foreach_get(self, name, buffer):
+        np.copyto(np.asarray(buffer).reshape(-1), self._values(name).reshape(-1), casting="unsafe")
+
+    def foreach_set(self, name, buffer):
+        values = self._values(name)
+        np.copyto(values.reshape(-1), np.asarray(buffer).reshape(-1), casting="unsafe")
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if not -self._length <= index < self._length:
+            raise IndexError(index)
+        return _Item(self, index % self._length)
+
+
+class _Item:
+    # One item of a PropertyCollection, reading and writing its row of every property array
+
+    def __init__(self, collection, index):
+        object.__setattr__(self, "_collection", collection)
+        object.__setattr__(self, "_index", index)
+
+    def __getattr__(self, name):
+        return self._collection._values(name)[self._index]
+
+    def __setattr__(self, name, value):
+        self._collection._values(name)[self._index] = value
+
+
+class Pixels:
+    # The pixel block of an image, stored as one float32 array in Blender's bottom-up order
+
+    def __init__(self, size):
+        self._values = np.zeros(size, dtype=np.float32)
+
+    def foreach_get(self, buffer):
+        np.copyto(np.asarray(buffer).reshape(-1), self._values, casting="unsafe")
+
+    def foreach_set(self, buffer):
+        np.copyto(self._values, np.asarray(buffer).reshape(-1), casting="unsafe")
+
+    def __len__(self):
+        return len(self._values)
+
+
+class ID:
+    # A named data-block with custom properties
+
+    def __init__(self, name):
+        self.name = name
+        self._properties = {}
+
+    def __getitem__(self, key):
+        return self._properties[key]
+
+    def __setitem__(self, key, value):
+        self._properties[key] = value
+
+    def get(self, key, default=None):
+        return self._properties.get(key, default)
+
+
+class Image(ID):
+    def __init__(self, name, width, height, alpha=True, float_buffer=False):
+        super().__init__(name)
+        self.size = (width, height)
+        self.channels = 4
+        self.pixels = Pixels(width * height * 4)
+        self.colorspace_settings = SimpleNamespace(name="sRGB")
+        self.filepath_raw = ""
+        self.file_format = "PNG"
+
+    def scale(self, width, height):
+        self.size = (width, height)
+        self.pixels = Pixels(width * height * self.channels)
+
+    def update(self):
+        pass
+
+    def save(self):
+        pass
+
+
+class Attribute:
+    def __init__(self, name, data_type, domain, length):
+        self.name = name
+        self.data_type = data_type
+        self.domain = domain
+        self.data = PropertyCollection(length)
+
+
+class Attributes:
+    def __init__(self, mesh):
+        self._mesh = mesh
+        self._items = {}
+
+    def new(self, name, data_type, domain):
+        length = len(self._mesh.polygons) if domain == "FACE" else len(self._mesh.vertices)
+        attribute = Attribute(name, data_type, domain, length)
+        self._items[name] = attribute
+        return attribute
+
+    def get(self, name, default=None):
+        return self._items.get(name, default)
+
+    def remove(self, attribute):
+        del self._items[attribute.name]
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+
+class MaterialSlots(list):
+    def find(self, name):
+        for i, material in enumerate(self):
+            if material is not None and material.name == name:
+                return i
+        return -1
+
+
+class Mesh(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.vertices = PropertyCollection()
+        self.loops = PropertyCollection()
+        self.polygons = PropertyCollection()
+        self.materials = MaterialSlots()
+        self.attributes = Attributes(self)
+        self.uv_layers = SimpleNamespace(active=None)
+
+    def update(self, calc_edges=False):
+        pass
+
+    def validate(self):
+        return False
+
+
+class Object(ID):
+    def __init__(self, name, data=None):
+        super().__init__(name)
+        self.data = data
+        self.selected = False
+
+    def select_set(self, state):
+        self.selected = state
+
+
+class Socket:
+    def __init__(self, name):
+        self.name = name
+        self.default_value = 0.0
+
+
+class Sockets:
+    # Node sockets that are created on first access by name or index, so every node type has the sockets
+    # the helpers link to
+
+    def __init__(self):
+        self._items = {}
+
+    def __getitem__(self, key):
+        socket = self._items.get(key)
+        if socket is None:
+            socket = Socket(key)
+            self._items[key] = socket
+        return socket
+
+    def new(self, socket_type, name):
+        return self[name]
+
+
+class Node:
+    def __init__(self, node_type, name):
+        self.bl_idname = node_type
+        self.type = {"ShaderNodeOutputMaterial": "OUTPUT_MATERIAL"}.get(node_type, node_type)
+        self.name = name
+        self.inputs = Sockets()
+        self.outputs = Sockets()
+
+
+class Nodes:
+    # The nodes of a node tree, looked up by their current name so that helpers may rename them
+
+    def __init__(self):
+        self._items = []
+
+    def new(self, node_type):
+        names = {node.name for node in self._items}
+        name = node_type
+        suffix = 1
+        while name in names:
+            name = f"{node_type}.{suffix:03d}"
+            suffix += 1
+        node = Node(node_type, name)
+        self._items.append(node)
+        return node
+
+    def get(self, name, default=None):
+        for node in self._items:
+            if node.name == name:
+                return node
+        return default
+
+    def remove(self, node):
+        self._items.remove(node)
+
+    def __getitem__(self, name):
+        node = self.get(name)
+        if node is None:
+            raise KeyError(name)
+        return node
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+
+class Links(list):
+    def new(self, from_socket, to_socket):
+        link = (from_socket, to_socket)
+        self.append(link)
+        return link
+
+
+class NodeTree(ID):
+    def __init__(self, name, tree_type="ShaderNodeTree"):
+        super().__init__(name)
+        self.bl_idname = tree_type
+        self.nodes = Nodes()
+        self.links = Links()
+        self.inputs = Sockets()
+        self.outputs = Sockets()
+
+
+class Material(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.node_tree = None
+        self._use_nodes = False
+
+    @property
+    def use_nodes(self):
+        return self._use_nodes
+
+    @use_nodes.setter
+    def use_nodes(self, value):
+        # Like Blender, turning nodes on creates a principled BSDF wired to a material output
+        if value and self.node_tree is None:
+            self.node_tree = NodeTree(f"{self.name}_nodes")
+            self.node_tree.nodes.new("ShaderNodeBsdfPrincipled").name = "Principled BSDF"
+            self.node_tree.nodes.new("ShaderNodeOutputMaterial").name = "Material Output"
+        self._use_nodes = value
+
+
+class IDCollection:
+    # A bpy.data collection of named data-blocks; new names get a numbered suffix like in Blender
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._items = {}
+
+    def new(self, name, *args, **kwargs):
+        unique = name
+        suffix = 1
+        while unique in self._items:
+            unique = f"{name}.{suffix:03d}"
+            suffix += 1
+        item = self._factory(unique, *args, **kwargs)
+        self._items[unique] = item
+        return item
+
+    def get(self, name, default=None):
+        return self._items.get(name, default)
+
+    def remove(self, item):
+        self._items.pop(item.name, None)
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Libraries:
+    def write(self, path, datablocks, **kwargs):
+        # Write the names of the data-blocks so that output writing still touches the disk
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(sorted(block.name for block in datablocks)))
+
+
+def reset():
+    # Empty bpy.data and the scene, like opening a new file
+    data = SimpleNamespace(
+        images=IDCollection(Image),
+        meshes=IDCollection(Mesh),
+        objects=IDCollection(Object),
+        materials=IDCollection(Material),
+        node_groups=IDCollection(NodeTree),
+        libraries=Libraries(),
+    )
+    module = sys.modules["bpy"]
+    module.data = data
+    module.context = SimpleNamespace(scene=SimpleNamespace(collection=SimpleNamespace(objects=Links())),
+                                     selected_objects=[], view_layer=SimpleNamespace(objects=SimpleNamespace()))
+    module.context.scene.collection.objects.link = module.context.scene.collection.objects.append
+
+
+def install():
+    # Register the stand-in as the bpy, bmesh and mathutils modules unless the real ones are importable
+    # Input: None
+    # Output: a boolean telling whether the stand-in was installed
+    try:
+        import bpy  # noqa: F401
+        return False
+    except ImportError:
+        pass
+    sys.modules["bpy"] = types.ModuleType("bpy")
+    sys.modules["bmesh"] = types.ModuleType("bmesh")
+    sys.modules["mathutils"] = types.ModuleType("mathutils")
+    reset()
+    return True
@@ -0,0 +1,138 @@
+# Small synthetic ONNX models with the inputs and outputs of the SAM encoder and decoder
+# Author: AmusedDiffuser
+#
+# The encoder pools the 1024 x 1024 input down to 64 x 64 and projects it to 256 channels, and the
+# decoder paints a soft disk around the first prompt point on top of the embedding, so that the
+# benchmarks exercise every tensor the real models exchange without downloading any checkpoint.
+# Building the models needs the onnx package; running them only needs onnxruntime.
+
+# Import the necessary modules
+import os
+
+import numpy as np
+
+# Define some constants for the synthetic models
+EMBEDDING_CHANNELS = 256
+EMBEDDING_SIZE = 64
+LOW_RES_SIZE = 256
+ENCODER_SIZE = 1024
+OPSET = 13
+
+
+def _constant(name, values, dtype=np.float32):
+    from onnx import numpy_helper
+
+    return numpy_helper.from_array(np.asarray(values, dtype=dtype), name)
+
+
+def build_encoder(path):
+    # Write a synthetic image encoder
+    # Input: a string representing the output path
+    # Output: None
+    import onnx
+    from onnx import TensorProto, helper
+
+    stride = ENCODER_SIZE // EMBEDDING_SIZE
+    weights = np.random.default_rng(0).standard_normal((EMBEDDING_CHANNELS, 3, 1, 1)).astype(np.float32) * 0.1
+    nodes = [
+        helper.make_node("AveragePool", ["images"], ["pooled"], kernel_shape=[stride, stride], strides=[stride, stride]),
+        helper.make_node("Conv", ["pooled", "projection"], ["image_embeddings"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "blendersam_synthetic_encoder",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 3, ENCODER_SIZE, ENCODER_SIZE])],
+        [helper.make_tensor_value_info("image_embeddings", TensorProto.FLOAT,
+                                       ["batch", EMBEDDING_CHANNELS, EMBEDDING_SIZE, EMBEDDING_SIZE])],
+        [_constant("projection", weights)])
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", OPSET)], ir_version=8), path)
+
+
+def build_decoder(path):
+    # Write a synthetic mask decoder
+    # Input: a string representing the output path
+    # Output: None
+    import onnx
+    from onnx import TensorProto, helper
+
+    grid = np.arange(LOW_RES_SIZE, dtype=np.float32) + 0.5
+    initializers = [
+        _constant("upscale", [1.0, 1.0, LOW_RES_SIZE / EMBEDDING_SIZE, LOW_RES_SIZE / EMBEDDING_SIZE]),
+        _constant("to_low_res", LOW_RES_SIZE / ENCODER_SIZE),
+        _constant("index_0", 0, np.int64),
+        _constant("index_1", 1, np.int64),
+        _constant("column_shape", [-1, 1, 1, 1], np.int64),
+        _constant("score_shape", [-1, 1], np.int64),
+        _constant("grid_x", grid.reshape(1, 1, 1, -1)),
+        _constant("grid_y", grid.reshape(1, 1, -1, 1)),
+        _constant("peak", 6.0),
+        _constant("spread", 400.0),
+        _constant("prior_weight", 0.5),
+        _constant("shape_start", [0], np.int64),
+        _constant("shape_end", [2], np.int64),
+    ]
+    nodes = [
+        # Upsample the channel mean of the embedding to the low resolution mask size
+        helper.make_node("ReduceMean", ["image_embeddings"], ["embedding_mean"], axes=[1], keepdims=1),
+        helper.make_node("Resize", ["embedding_mean", "", "upscale"], ["base"], mode="linear"),
+
+        # Paint a soft disk around the first point of every prompt
+        helper.make_node("Gather", ["point_coords", "index_0"], ["first_point"], axis=1),
+        helper.make_node("Mul", ["first_point", "to_low_res"], ["low_res_point"]),
+        helper.make_node("Gather", ["low_res_point", "index_0"], ["point_x"], axis=1),
+        helper.make_node("Gather", ["low_res_point", "index_1"], ["point_y"], axis=1),
+        helper.make_node("Reshape", ["point_x", "column_shape"], ["point_x4"]),
+        helper.make_node("Reshape", ["point_y", "column_shape"], ["point_y4"]),
+        helper.make_node("Sub", ["grid_x", "point_x4"], ["dx"]),
+        helper.make_node("Sub", ["grid_y", "point_y4"], ["dy"]),
+        helper.make_node("Mul", ["dx", "dx"], ["dx2"]),
+        helper.make_node("Mul", ["dy", "dy"], ["dy2"]),
+        helper.make_node("Add", ["dx2", "dy2"], ["distance2"]),
+        helper.make_node("Div", ["distance2", "spread"], ["falloff"]),
+        helper.make_node("Sub", ["peak", "falloff"], ["disk"]),
+
+        # Blend in the previous mask logits when the caller passes them
+        helper.make_node("Mul", ["mask_input", "has_mask_input"], ["prior"]),
+        helper.make_node("Mul", ["prior", "prior_weight"], ["weighted_prior"]),
+        helper.make_node("Add", ["disk", "weighted_prior"], ["shaped"]),
+        helper.make_node("Add", ["shaped", "base"], ["low_res_masks"]),
+
+        # Upsample to the original image size and score every mask by its mean probability
+        helper.make_node("Shape", ["low_res_masks"], ["low_res_shape"]),
+        helper.make_node("Slice", ["low_res_shape", "shape_start", "shape_end"], ["batch_shape"]),
+        helper.make_node("Cast", ["orig_im_size"], ["image_shape"], to=TensorProto.INT64),
+        helper.make_node("Concat", ["batch_shape", "image_shape"], ["mask_shape"], axis=0),
+        helper.make_node("Resize", ["low_res_masks", "", "", "mask_shape"], ["masks"], mode="linear"),
+        helper.make_node("Sigmoid", ["low_res_masks"], ["probabilities"]),
+        helper.make_node("ReduceMean", ["probabilities"], ["mean_probability"], axes=[2, 3], keepdims=1),
+        helper.make_node("Reshape", ["mean_probability", "score_shape"], ["iou_predictions"]),
+    ]
+    inputs = [
+        helper.make_tensor_value_info("image_embeddings", TensorProto.FLOAT,
+                                      [1, EMBEDDING_CHANNELS, EMBEDDING_SIZE, EMBEDDING_SIZE]),
+        helper.make_tensor_value_info("point_coords", TensorProto.FLOAT, ["prompts", "points", 2]),
+        helper.make_tensor_value_info("point_labels", TensorProto.FLOAT, ["prompts", "points"]),
+        helper.make_tensor_value_info("mask_input", TensorProto.FLOAT, ["prompts", 1, LOW_RES_SIZE, LOW_RES_SIZE]),
+        helper.make_tensor_value_info("has_mask_input", TensorProto.FLOAT, [1]),
+        helper.make_tensor_value_info("orig_im_size", TensorProto.FLOAT, [2]),
+    ]
+    outputs = [
+        helper.make_tensor_value_info("masks", TensorProto.FLOAT, ["prompts", 1, "height", "width"]),
+        helper.make_tensor_value_info("iou_predictions", TensorProto.FLOAT, ["prompts", 1]),
+        helper.make_tensor_value_info("low_res_masks", TensorProto.FLOAT, ["prompts", 1, LOW_RES_SIZE, LOW_RES_SIZE]),
+    ]
+    graph = helper.make_graph(nodes, "blendersam_synthetic_decoder", inputs, outputs, initializers)
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", OPSET)], ir_version=8), path)
+
+
+def ensure_models(models_dir):
+    # Build the synthetic models once and reuse them on later runs
+    # Input: a string representing the directory to keep the models in
+    # Output: the paths to the synthetic encoder and decoder
+    os.makedirs(models_dir, exist_ok=True)
+    encoder_path = os.path.join(models_dir, "synthetic_encoder.onnx")
+    decoder_path = os.path.join(models_dir, "synthetic_decoder.onnx")
+    if not os.path.isfile(encoder_path):
+        build_encoder(encoder_path)
+    if not os.path.isfile(decoder_path):
+        build_decoder(decoder_path)
+    return encoder_path, decoder_path
@@ -0,0 +1,206 @@
+# BlenderSAM mask archive
+# Author: AmusedDiffuser
+
+"""
+Stores all masks of an image in one compact, memory-mappable file instead of one PNG and one .blend file
+per mask. An archive holds a uint16 label map (uint32 above 65534 masks) with the best mask of every
+pixel, the run-length encoded instance masks so that overlaps are kept, and the score and color of every
+mask. Archives are written once per image and read back lazily, turning masks into Blender images only
+when they are used.
+"""
+
+# Import the necessary modules
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+import blendersam_automask
+
+# Define some constants for the archive format
+MAGIC = b"BSAMMASK"
+VERSION = 1
+HEADER_SIZE = 4096
+ALIGNMENT = 64
+ARCHIVE_SUFFIX = "_masks.bsam"
+WRITE_ROWS = 1024
+PATH_TAG_LENGTH = 8
+
+# Open archives are keyed by path and remember the file's modification time
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def archive_path(output_dir, image_name):
+    # Build the archive path for an image, tagging the name with a hash of the full image path so that images
+    # with the same file name in different folders get different archives
+    # Input: a string representing the output directory and a string representing the image file path
+    # Output: a string representing the path to the archive file
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    tag = hashlib.sha1(os.path.normcase(os.path.abspath(image_name)).encode("utf-8")).hexdigest()[:PATH_TAG_LENGTH]
+    return os.path.join(output_dir, f"{stem}_{tag}{ARCHIVE_SUFFIX}")
+
+
+def label_map_runs(label_map, count):
+    # Run-length encode every instance of a label map in one pass over its rows
+    # Input: an integer numpy array (or memmap) of shape (H, W) holding 0 for background and k + 1 for mask k,
+    # and the number of masks
+    # Output: a uint32 numpy array of shape (R, 2) holding the [start, end) runs grouped by mask, and an int64
+    # numpy array of shape (count + 1,) holding where the runs of every mask start
+    height, width = label_map.shape
+    starts, ends, values = [], [], []
+    for row in range(0, height, WRITE_ROWS):
+        block = np.asarray(label_map[row:row + WRITE_ROWS]).ravel()
+        change = np.flatnonzero(np.diff(block)) + 1
+        block_starts = np.concatenate([[0], change])
+        block_ends = np.concatenate([change, [len(block)]])
+        block_values = block[block_starts]
+        foreground = block_values > 0
+        starts.append(block_starts[foreground] + row * width)
+        ends.append(block_ends[foreground] + row * width)
+        values.append(block_values[foreground])
+
+    # Group the runs by mask, keeping them in pixel order within each mask
+    values = np.concatenate(values)
+    order = np.argsort(values, kind="stable")
+    runs = np.stack([np.concatenate(starts)[order], np.concatenate(ends)[order]], axis=1).astype(np.uint32)
+    offsets = np.searchsorted(values[order], np.arange(1, count + 2)).astype(np.int64)
+    return runs, offsets
+
+
+def write_archive(path, shape, scores, colors, masks=None, label_map=None):
+    # Write all masks of an image to one archive file
+    # Input: a string representing the archive path, the (H, W) shape of the masks, a numpy array of shape (N,)
+    # holding the mask scores, a numpy array of shape (N, 4) holding the mask colors, and either a sequence
+    # of N binary masks (an RLEMasks sequence is stored without decoding) or a label map holding 0 for
+    # background and k + 1 for mask k
+    # Output: None
+    height, width = shape
+    count = len(scores)
+    label_dtype = np.dtype(np.uint16 if count < 2 ** 16 - 1 else np.uint32)
+
+    if label_map is not None:
+        runs, offsets = label_map_runs(label_map, count)
+    else:
+        if isinstance(masks, blendersam_automask.RLEMasks):
+            rles = masks.rles
+        else:
+            rles = [blendersam_automask.rle_encode(np.asarray(mask, dtype=bool)) for mask in masks]
+        runs = np.concatenate(rles).astype(np.uint32) if rles else np.zeros((0, 2), dtype=np.uint32)
+        offsets = np.concatenate([[0], np.cumsum([len(rle) for rle in rles])]).astype(np.int64)
+
+        # Paint the masks from the lowest to the highest score so that every pixel keeps its best mask
+        label_map = np.zeros((height, width), dtype=label_dtype)
+        for k in np.argsort(scores, kind="stable"):
+            label_map[blendersam_automask.rle_decode(rles[k], shape)] = k + 1
+
+    arrays = {
+        "labels": (label_dtype, (height, width)),
+        "runs": (np.dtype(np.uint32), runs.shape),
+        "offsets": (np.dtype(np.int64), offsets.shape),
+        "scores": (np.dtype(np.float32), (count,)),
+        "colors": (np.dtype(np.float32), (count, 4)),
+    }
+
+    # Lay the arrays out one after another, aligned so that every array can be memory-mapped
+    header = {"version": VERSION, "shape": [height, width], "count": count, "arrays": {}}
+    position = HEADER_SIZE
+    for name, (dtype, array_shape) in arrays.items():
+        header["arrays"][name] = {"dtype": dtype.str, "shape": list(array_shape), "offset": position}
+        position += -(-int(np.prod(array_shape)) * dtype.itemsize // ALIGNMENT) * ALIGNMENT
+    header_bytes = MAGIC + json.dumps(header).encode("utf-8")
+    if len(header_bytes) > HEADER_SIZE:
+        raise RuntimeError("Mask archive header is too large")
+
+    # Write to a temporary file first so that readers never see a half-written archive
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header_bytes.ljust(HEADER_SIZE, b"\0"))
+        f.seek(header["arrays"]["labels"]["offset"])
+        for row in range(0, height, WRITE_ROWS):
+            f.write(np.ascontiguousarray(label_map[row:row + WRITE_ROWS], dtype=label_dtype).tobytes())
+        for name, values in (("runs", runs), ("offsets", offsets), ("scores", scores), ("colors", colors)):
+            f.seek(header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(values, dtype=arrays[name][0]).tobytes())
+        f.truncate(position)
+    os.replace(temp_path, path)
+
+
+class MaskArchive:
+    # A read-only view of an archive file whose arrays are memory-mapped on demand
+
+    def __init__(self, path):
+        self.path = path
+        self.token = f"{path}@{os.path.getmtime(path)}"
+        with open(path, "rb") as f:
+            header_bytes = f.read(HEADER_SIZE)
+        if not header_bytes.startswith(MAGIC):
+            raise RuntimeError(f"Not a BlenderSAM mask archive: {path}")
+        header = json.loads(header_bytes[len(MAGIC):].rstrip(b"\0"))
+        self.shape = tuple(header["shape"])
+        self.count = header["count"]
+        self._arrays = header["arrays"]
+
+    def _array(self, name):
+        entry = self._arrays[name]
+        shape = tuple(entry["shape"])
+        if int(np.prod(shape)) == 0:
+            return np.zeros(shape, dtype=entry["dtype"])
+        return np.memmap(self.path, dtype=entry["dtype"], mode="r", offset=entry["offset"], shape=shape)
+
+    @property
+    def label_map(self):
+        return self._array("labels")
+
+    @property
+    def scores(self):
+        return np.array(self._array("scores"))
+
+    @property
+    def colors(self):
+        return np.array(self._array("colors"))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        # Decode one mask from its runs
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        offsets = self._array("offsets")
+        runs = self._array("runs")[offsets[i]:offsets[i + 1]]
+        return blendersam_automask.rle_decode(np.asarray(runs), self.shape)
+
+
+def open_archive(path):
+    # Open an archive file once and reuse it until the file changes
+    # Input: a string representing the path to the archive file
+    # Output: a MaskArchive
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    with _archives_lock:
+        entry = _archives.get(path)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, MaskArchive(path))
+            _archives[path] = entry
+        return entry[1]
+
+
+def load_mask_image(path, i, name=None):
+    # Turn one archived mask into a Blender image the first time it is used
+    # Input: a string representing the path to the archive file, the index of the mask, and an optional image name
+    # Output: a blender image holding the mask
+    import bpy
+    import blendersam_image_io
+
+    # Images loaded from an archive remember it, so that they are only rebuilt after the archive changes
+    archive = open_archive(path)
+    name = name or f"_mask_{i}"
+    image = bpy.data.images.get(name)
+    if image is not None and image.get("blendersam_archive") == archive.token:
+        return image
+    image = blendersam_image_io.new_mask_image(name, archive[i])
+    image["blendersam_archive"] = archive.token
+    return image
@@ -0,0 +1,261 @@
+# BlenderSAM automatic mask generation
+# Author: AmusedDiffuser
+
+"""
+Segments every object in an image without input prompts. A grid of points is decoded in fixed-size
+batches against one image embedding, every mask is scored by its predicted IoU and its stability under
+threshold changes, kept masks are stored as compact run-length encodings, and duplicates are removed
+with vectorized box NMS followed by mask NMS computed directly on the run-length encodings.
+"""
+
+# Import the necessary modules
+import numpy as np
+
+import blendersam_profiling
+import blendersam_runtime
+
+# Define some constants for automatic mask generation
+POINTS_PER_SIDE = 16
+POINTS_PER_BATCH = 64
+PRED_IOU_THRESHOLD = 0.88
+STABILITY_THRESHOLD = 0.92
+STABILITY_OFFSET = 1.0
+BOX_NMS_THRESHOLD = 0.7
+MASK_NMS_THRESHOLD = 0.7
+MIN_MASK_AREA = 16
+
+
+def stability_scores(logits, cutoff, offset=STABILITY_OFFSET):
+    # Measure how much masks change when the binarization threshold moves up and down
+    # Input: a float32 numpy array of shape (B, H, W) holding mask logits, the logit threshold, and the offset
+    # Output: a float32 numpy array of shape (B,) holding the IoU between the strict and the loose masks
+    strict = np.count_nonzero(logits > cutoff + offset, axis=(1, 2))
+    loose = np.count_nonzero(logits > cutoff - offset, axis=(1, 2))
+    return (strict / np.maximum(loose, 1)).astype(np.float32)
+
+
+def mask_boxes(masks):
+    # Compute the bounding boxes of binary masks
+    # Input: a boolean numpy array of shape (B, H, W)
+    # Output: an int32 numpy array of shape (B, 4) holding (x0, y0, x1, y1) with exclusive x1 and y1
+    rows = masks.any(axis=2)
+    columns = masks.any(axis=1)
+    height, width = masks.shape[1:]
+    boxes = np.empty((len(masks), 4), dtype=np.int32)
+    boxes[:, 0] = columns.argmax(axis=1)
+    boxes[:, 1] = rows.argmax(axis=1)
+    boxes[:, 2] = width - columns[:, ::-1].argmax(axis=1)
+    boxes[:, 3] = height - rows[:, ::-1].argmax(axis=1)
+    return boxes
+
+
+def rle_encode(mask):
+    # Encode a binary mask as the start and end offsets of its foreground runs in row-major order
+    # Input: a boolean numpy array of shape (H, W)
+    # Output: a uint32 numpy array of shape (R, 2) holding [start, end) offsets
+    flat = np.ascontiguousarray(mask).view(np.uint8).ravel()
+    edges = np.flatnonzero(np.diff(flat, prepend=0, append=0))
+    return edges.reshape(-1, 2).astype(np.uint32)
+
+
+def rle_decode(rle, shape):
+    # Decode a run-length encoded mask
+    # Input: a numpy array of shape (R, 2) returned by rle_encode and the (H, W) shape of the mask
+    # Output: a boolean numpy array of shape (H, W)
+    size = shape[0] * shape[1]
+    delta = np.zeros(size + 1, dtype=np.int8)
+    delta[rle[:, 0]] = 1
+    delta[rle[:, 1]] -= 1
+    return np.cumsum(delta[:size], dtype=np.int8).astype(bool).reshape(shape)
+
+
+def rle_area(rle):
+    # Count the foreground pixels of a run-length encoded mask
+    return int((rle[:, 1].astype(np.int64) - rle[:, 0]).sum())
+
+
+def rle_intersection(a, b):
+    # Count the pixels two run-length encoded masks share, without decoding them
+    # Input: two numpy arrays returned by rle_encode
+    # Output: an integer representing the intersection area
+    if len(a) == 0 or len(b) == 0:
+        return 0
+
+    # Sweep over the run boundaries of both masks and add up the spans covered by both
+    positions = np.concatenate([a.ravel(), b.ravel()]).astype(np.int64)
+    steps = np.tile(np.array([1, -1], dtype=np.int8), len(a) + len(b))
+    order = np.argsort(positions, kind="stable")
+    positions = positions[order]
+    coverage = np.cumsum(steps[order])
+    spans = np.diff(positions)
+    return int(spans[coverage[:-1] == 2].sum())
+
+
+def rle_coverage(rle, positions):
+    # Count the pixels of a run-length encoded mask that lie before each of many positions
+    # Input: a numpy array returned by rle_encode and an int64 numpy array of flat pixel offsets
+    # Output: an int64 numpy array of the same shape as positions
+    if len(rle) == 0:
+        return np.zeros(len(positions), dtype=np.int64)
+    starts = rle[:, 0].astype(np.int64)
+    ends = rle[:, 1].astype(np.int64)
+    before = np.concatenate([[0], np.cumsum(ends - starts)])
+
+    # Add the part of the last run that starts at or before every position to the runs before it
+    last = np.searchsorted(starts, positions, side="right") - 1
+    run = np.maximum(last, 0)
+    partial = np.where(last >= 0, np.minimum(positions, ends[run]) - starts[run], 0)
+    return before[run] + partial
+
+
+def rle_intersections(rle, runs, owners, count):
+    # Count the pixels one run-length encoded mask shares with each of many others, in one vectorized pass
+    # Input: a numpy array returned by rle_encode, an int64 numpy array of shape (R, 2) holding the runs of the
+    # other masks one after another, an integer numpy array of shape (R,) holding the mask every run belongs
+    # to, and the number of other masks
+    # Output: an int64 numpy array of shape (count,) holding the intersection areas
+    shared = rle_coverage(rle, runs[:, 1]) - rle_coverage(rle, runs[:, 0])
+    return np.bincount(owners, weights=shared, minlength=count).astype(np.int64)
+
+
+def box_iou(boxes):
+    # Compute the pairwise IoU of boxes
+    # Input: a numpy array of shape (N, 4) holding (x0, y0, x1, y1)
+    # Output: a float32 numpy array of shape (N, N)
+    boxes = boxes.astype(np.float32)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    top_left = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    sizes = np.clip(bottom_right - top_left, 0, None)
+    intersection = sizes[..., 0] * sizes[..., 1]
+    return intersection / np.maximum(areas[:, None] + areas[None, :] - intersection, 1e-6)
+
+
+def non_max_suppression(boxes, scores, rles, box_threshold=BOX_NMS_THRESHOLD, mask_threshold=MASK_NMS_THRESHOLD):
+    # Remove duplicate masks, first by box overlap and then by mask overlap on the run-length encodings
+    # Input: a numpy array of shape (N, 4) holding the mask boxes, a numpy array of shape (N,) holding the
+    # scores, a list of run-length encoded masks, and the box and mask IoU above which a mask is a duplicate
+    # Output: an int64 numpy array holding the indices of the kept masks, best first
+    order = np.argsort(-scores, kind="stable")
+    overlaps = box_iou(boxes[order])
+    areas = np.array([rle_area(rles[i]) for i in order], dtype=np.int64)
+    suppressed = np.zeros(len(order), dtype=bool)
+
+    # Keep the runs of all masks in one array, in score order, so that any subset of masks can be gathered
+    run_counts = np.array([len(rles[i]) for i in order], dtype=np.int64)
+    run_offsets = np.cumsum(run_counts) - run_counts
+    runs = np.concatenate([rles[i] for i in order] + [np.zeros((0, 2), dtype=np.uint32)]).astype(np.int64)
+
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+
+        # Suppress lower scoring masks whose boxes overlap too much, in one vectorized step
+        later = np.arange(i + 1, len(order))
+        later = later[~suppressed[later]]
+        duplicates = later[overlaps[i, later] > box_threshold]
+        suppressed[duplicates] = True
+
+        # Compare the mask with all remaining masks whose boxes touch it at once, on their gathered runs
+        candidates = later[(overlaps[i, later] > 0) & ~suppressed[later]]
+        if len(candidates) == 0:
+            continue
+        counts = run_counts[candidates]
+        owners = np.repeat(np.arange(len(candidates)), counts)
+        gathered = np.repeat(run_offsets[candidates] - (np.cumsum(counts) - counts), counts) + np.arange(len(owners))
+        intersections = rle_intersections(rles[order[i]], runs[gathered], owners, len(candidates))
+        ious = intersections / np.maximum(areas[i] + areas[candidates] - intersections, 1)
+        suppressed[candidates[ious > mask_threshold]] = True
+
+    return order[~suppressed]
+
+
+def generate_masks(image_array, encoder_path, decoder_path, threshold=0.5, points_per_side=POINTS_PER_SIDE,
+                   points_per_batch=POINTS_PER_BATCH, pred_iou_threshold=PRED_IOU_THRESHOLD,
+                   stability_threshold=STABILITY_THRESHOLD, max_masks=None, refinements=0, job=None, embedding=None):
+    # Segment every object in an image from a grid of point prompts
+    # Input: a numpy array of shape (H, W, C) holding the image pixels with the top row first, strings
+    # representing the paths to the encoder and decoder checkpoints, the threshold value for binarizing the
+    # masks, the number of grid points along each side, the number of prompts decoded per call, the minimum
+    # predicted IoU and stability scores, the maximum number of masks to keep, the number of times the kept
+    # masks are decoded again with their own logits as mask input, an optional Job for progress, and an
+    # optional image embedding computed by the caller, which skips the encoder
+    # Output: an RLEMasks sequence holding the kept masks best first and a float32 numpy array of their scores
+    image_size = image_array.shape[:2]
+    cutoff = blendersam_runtime.logit_threshold(threshold)
+
+    if job is not None:
+        job.report(0.05, "Encoding image")
+    if embedding is None:
+        embedding = blendersam_runtime.encode_image(image_array, encoder_path)
+    points = blendersam_runtime.point_grid(points_per_side, image_size)
+    point_coords, point_labels = blendersam_runtime.prompts_to_tensors(points, "point", image_size)
+
+    # Decode the grid in fixed-size batches and keep only the compact encodings of good masks
+    rles, boxes, scores, prompt_ids, low_res = [], [], [], [], []
+    for start, logits, iou_scores, batch_low_res in blendersam_runtime.iter_decode(
+            embedding, decoder_path, point_coords, point_labels, image_size, batch_size=points_per_batch):
+        if job is not None:
+            job.report(0.1 + 0.7 * start / len(points), "Decoding point grid")
+        keep = iou_scores >= pred_iou_threshold
+        keep &= stability_scores(logits, cutoff) >= stability_threshold
+        if not keep.any():
+            continue
+        masks = logits[keep] > cutoff
+        areas = np.count_nonzero(masks, axis=(1, 2))
+        large = areas >= MIN_MASK_AREA
+        masks = masks[large]
+        kept = np.flatnonzero(keep)[large]
+        boxes.append(mask_boxes(masks))
+        scores.append(iou_scores[kept])
+        prompt_ids.append(kept + start)
+        rles.extend(rle_encode(mask) for mask in masks)
+        if refinements:
+            low_res.append(batch_low_res[kept].astype(np.float16))
+
+    if not rles:
+        return RLEMasks([], image_size), np.zeros(0, dtype=np.float32)
+
+    # Remove duplicates and keep the best masks
+    if job is not None:
+        job.report(0.85, "Removing duplicate masks")
+    boxes = np.concatenate(boxes)
+    scores = np.concatenate(scores)
+    prompt_ids = np.concatenate(prompt_ids)
+    with blendersam_profiling.span("non_max_suppression", masks=len(rles)):
+        kept = non_max_suppression(boxes, scores, rles)
+    if max_masks is not None:
+        kept = kept[:max_masks]
+    rles = [rles[i] for i in kept]
+    scores = scores[kept]
+
+    # Refine the kept masks by feeding their own low resolution logits back into the decoder
+    if refinements:
+        if job is not None:
+            job.report(0.9, "Refining masks")
+        mask_input = np.concatenate(low_res)[kept].astype(np.float32)
+        coords, labels = point_coords[prompt_ids[kept]], point_labels[prompt_ids[kept]]
+        for _ in range(refinements):
+            logits, scores, mask_input = blendersam_runtime.decode_prompts(
+                embedding, decoder_path, coords, labels, image_size, mask_input, points_per_batch)
+
+        # The refined masks come with new scores, so put them back in best-first order
+        order = np.argsort(-scores, kind="stable")
+        scores = scores[order]
+        rles = [rle_encode(mask) for mask in logits[order] > cutoff]
+
+    return RLEMasks(rles, image_size), scores
+
+
+class RLEMasks:
+    # A read-only sequence of binary masks stored as run-length encodings and decoded one at a time
+
+    def __init__(self, rles, shape):
+        self.rles = rles
+        self.shape = tuple(shape)
+
+    def __len__(self):
+        return len(self.rles)
+
+    def __getitem__(self, i):
+        return rle_decode(self.rles[i], self.shape)
@@ -0,0 +1,205 @@
+# BlenderSAM headless batch segmentation
+# Author: AmusedDiffuser
+
+"""
+Segments whole directories of images without Blender's UI, for example on a render farm. Images are
+spread over a pool of worker processes that each keep one warm model session, every worker writes its
+results straight to the output folder, and a manifest of input hashes makes interrupted runs resumable.
+"""
+
+# Import the necessary modules
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# Define some constants for batch segmentation
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".exr", ".bmp", ".tga")
+MANIFEST_NAME = "blendersam_manifest.jsonl"
+HASH_CHUNK = 2 ** 20
+BATCH_WORKERS = 2
+
+# The settings of the current worker process, filled in by init_worker
+_worker = {}
+
+
+def collect_inputs(input_dir=None, manifest=None):
+    # Collect the image files to segment
+    # Input: an optional directory to scan for images and an optional manifest file listing one image path
+    # per line (or a JSON list of paths); relative manifest paths are resolved against the manifest folder
+    # Output: a sorted list of absolute image paths without duplicates
+    paths = []
+    if input_dir is not None:
+        for file_name in os.listdir(input_dir):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(input_dir, file_name))
+    if manifest is not None:
+        with open(manifest, "r", encoding="utf-8") as f:
+            text = f.read()
+        entries = json.loads(text) if text.lstrip().startswith("[") else text.splitlines()
+        base = os.path.dirname(os.path.abspath(manifest))
+        paths.extend(os.path.join(base, entry.strip()) for entry in entries if entry.strip())
+    return sorted(set(os.path.abspath(path) for path in paths))
+
+
+def file_hash(path):
+    # Hash the content of a file in chunks
+    # Input: a string representing the path to the file
+    # Output: a hex string identifying the file content
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    # Read the hashes of the images finished by earlier runs
+    # Input: a string representing the path to the output directory
+    # Output: a set of "input hash:settings hash" strings
+    done = set()
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run is simply redone
+                    continue
+                done.add(f"{entry['hash']}:{entry['settings']}")
+    return done
+
+
+def settings_hash(settings):
+    # Identify the model checkpoints and options of a batch run, so that changing them redoes every image
+    # Input: a dictionary of worker settings
+    # Output: a short hex string
+    import blendersam_runtime
+
+    # The runtime profile only changes how fast images are segmented, so it does not invalidate earlier results
+    token = {key: value for key, value in settings.items() if key not in ("runtime_profile", "threads")}
+    for key in ("encoder_path", "decoder_path"):
+        token[key] = blendersam_runtime.model_fingerprint(settings[key])
+    return hashlib.blake2b(json.dumps(token, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def read_image(path):
+    # Read an image file as an RGB array without Blender
+    # Input: a string representing the path to the image file
+    # Output: a numpy array of shape (H, W, 3), uint8 for 8-bit files and float32 in [0, 1] otherwise
+    import cv2
+
+    image = cv2.imread(path, cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH)
+    if image is None:
+        raise RuntimeError(f"Cannot read image file: {path}")
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if image.dtype == np.uint16:
+        image = image.astype(np.float32) / 65535.0
+    elif image.dtype != np.uint8:
+        image = np.clip(image.astype(np.float32), 0.0, 1.0)
+    return image
+
+
+def init_worker(settings, workers=1):
+    # Load the model sessions once per worker process so that every image reuses them, giving each worker its
+    # share of the cores so that the workers do not oversubscribe the CPU
+    # Input: a dictionary of worker settings and the number of worker processes
+    # Output: None
+    import blendersam_runtime
+
+    _worker.update(settings)
+    profile = settings.get("runtime_profile", "default")
+    threads = (settings.get("threads") or blendersam_runtime.RUNTIME_PROFILES.get(profile, {}).get("intra_op_threads")
+               or max(1, (os.cpu_count() or 1) // workers))
+    blendersam_runtime.set_runtime_profile(profile, intra_op_threads=threads)
+    blendersam_runtime.get_session(settings["encoder_path"])
+    blendersam_runtime.get_session(settings["decoder_path"])
+
+
+def segment_file(path, output_dir):
+    # Segment one image in a worker process and write its mask archive to the output folder
+    # Input: a string representing the path to the image file and a string representing the output directory
+    # Output: a dictionary describing the result, small enough to send back to the main process
+    import blendersam_archive
+    import blendersam_runtime
+    import blendersam_tiling
+
+    start = time.perf_counter()
+    image = read_image(path)
+    label_map, scores = blendersam_tiling.segment_tiled(image,
+                                                        _worker["encoder_path"],
+                                                        _worker["decoder_path"],
+                                                        threshold=_worker["threshold"],
+                                                        confidence=_worker["confidence"],
+                                                        tile_size=_worker["tile_size"],
+                                                        points_per_side=_worker["points_per_side"],
+                                                        memory_budget_mb=_worker["memory_budget"])
+
+    # Write one mask archive per image; it replaces the archive atomically, so an interrupted run never leaves a
+    # half-written result behind
+    output_path = blendersam_archive.archive_path(output_dir, path)
+    colors = blendersam_runtime.label_colors(len(scores))
+    blendersam_archive.write_archive(output_path, label_map.shape, scores, colors, label_map=label_map)
+
+    label_path = getattr(label_map, "filename", None)
+    del label_map
+    if label_path is not None:
+        os.remove(label_path)
+    return {"output": output_path, "instances": int(len(scores)), "seconds": time.perf_counter() - start}
+
+
+def run_batch(paths, output_dir, settings, workers=None, resume=True):
+    # Segment many images on a pool of worker processes, skipping the images finished by earlier runs
+    # Input: a list of image paths, a string representing the output directory, a dictionary of worker
+    # settings, the number of worker processes, and whether to skip images recorded in the manifest
+    # Output: a dictionary with the number of processed, skipped and failed images and the throughput
+    # Every worker holds its own sessions and tile buffers, so a few workers that share the cores between their
+    # ONNX Runtime threads keep the throughput of one worker per core at a fraction of the memory
+    workers = workers or min(BATCH_WORKERS, os.cpu_count() or 1)
+    run_settings = settings_hash(settings)
+    done = load_manifest(output_dir) if resume else set()
+
+    # Hash the inputs up front so that finished images are skipped before any worker starts
+    pending = []
+    skipped = 0
+    for path in paths:
+        digest = file_hash(path)
+        if f"{digest}:{run_settings}" in done:
+            skipped += 1
+        else:
+            pending.append((path, digest))
+    print(f"BlenderSAM batch: {len(pending)} images to segment, {skipped} already done, {workers} workers")
+
+    processed = 0
+    failed = 0
+    start = time.perf_counter()
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(settings, workers)) as pool:
+        futures = {pool.submit(segment_file, path, output_dir): (path, digest) for path, digest in pending}
+        for future in as_completed(futures):
+            path, digest = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Error segmenting {path}: {e}")
+                continue
+
+            # Record the finished image right away so that an interrupted run resumes from here
+            processed += 1
+            manifest.write(json.dumps({"input": path, "hash": digest, "settings": run_settings, **result}) + "\n")
+            manifest.flush()
+            elapsed = time.perf_counter() - start
+            print(f"[{processed + failed}/{len(pending)}] {os.path.basename(path)}: {result['instances']} instances "
+                  f"in {result['seconds']:.2f}s ({processed / elapsed:.2f} images/s)")
+
+    elapsed = time.perf_counter() - start
+    throughput = processed / elapsed if elapsed > 0 else 0.0
+    print(f"BlenderSAM batch: {processed} segmented, {skipped} skipped, {failed} failed "
+          f"in {elapsed:.1f}s ({throughput:.2f} images/s)")
+    return {"processed": processed, "skipped": skipped, "failed": failed, "images_per_second": throughput}
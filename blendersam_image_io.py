@@ -0,0 +1,92 @@
+# BlenderSAM image I/O helpers
+# Author: AmusedDiffuser
+
+"""
+Moves pixels between Blender images and numpy arrays without going through Python lists. Pixels are
+read with pixels.foreach_get into preallocated float32 buffers that are reused across runs, exposed as
+top-down (H, W, C) views without copying, and masks are written back with pixels.foreach_set.
+"""
+
+# Import the necessary modules
+import threading
+
+import numpy as np
+
+# Buffers are keyed by purpose and shape and reused until release_buffers is called
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_buffer(purpose, shape):
+    # Get a preallocated float32 buffer, creating it on first use
+    # Input: a string naming what the buffer is used for and a tuple representing its shape
+    # Output: a C-contiguous float32 numpy array of the given shape with undefined contents
+    key = (purpose, tuple(shape), threading.get_ident())
+    with _buffers_lock:
+        buffer = _buffers.get(key)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=np.float32)
+            _buffers[key] = buffer
+        return buffer
+
+
+def release_buffers():
+    # Free every preallocated buffer
+    # Input: None
+    # Output: None
+    with _buffers_lock:
+        _buffers.clear()
+
+
+def read_pixels(image, purpose="input"):
+    # Read the pixels of a Blender image into a reused buffer
+    # Input: a blender image and a string naming the buffer to read into
+    # Output: a float32 numpy array of shape (H, W, C) with the top row first; the array is a flipped view
+    # of the buffer, so it is only valid until the next read with the same purpose and size
+    width, height = image.size
+    buffer = get_buffer(purpose, (height, width, image.channels))
+
+    # Copy the whole pixel block in one call instead of iterating the pixels in Python
+    image.pixels.foreach_get(buffer.reshape(-1))
+
+    # Blender stores the bottom row first, so flip the rows with a view instead of a copy
+    return buffer[::-1]
+
+
+def storage_order(image_array):
+    # Undo a row flip made by read_pixels so that the array can be handed to code that needs positive strides
+    # Input: a numpy array of shape (H, W, C)
+    # Output: a numpy array sharing memory with the input and a boolean telling whether its rows are flipped
+    if image_array.strides[0] < 0:
+        return image_array[::-1], True
+    return image_array, False
+
+
+def write_mask(image, mask, purpose="output"):
+    # Write a mask into a Blender image of the same size
+    # Input: a blender image and a numpy array of shape (H, W) with the top row first and values in [0, 1]
+    # Output: None
+    width, height = image.size
+    buffer = get_buffer(purpose, (height, width, image.channels))
+
+    # Broadcast the mask into every channel with the rows flipped back to Blender's order
+    np.copyto(buffer, mask[::-1, :, None], casting="unsafe")
+    image.pixels.foreach_set(buffer.reshape(-1))
+    image.update()
+
+
+def new_mask_image(name, mask):
+    # Create a Blender image holding a mask, overwriting the pixels of an existing image with the same name
+    # Input: a string representing the name of the image and a numpy array of shape (H, W)
+    # Output: a blender image
+    import bpy
+
+    height, width = mask.shape
+    image = bpy.data.images.get(name)
+    if image is None:
+        image = bpy.data.images.new(name, width=width, height=height)
+    elif tuple(image.size) != (width, height):
+        # Reallocate the image in place, so that it keeps its name and the materials using it
+        image.scale(width, height)
+    write_mask(image, mask)
+    return image
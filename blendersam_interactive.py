@@ -0,0 +1,207 @@
+# BlenderSAM interactive refinement
+# Author: AmusedDiffuser
+
+"""
+Keeps the state of one interactive refinement session so that every click costs a single decoder call.
+The image is encoded once, the low resolution mask logits of the last decode are fed back as the mask
+input of the next one, rapid clicks are merged into one decode, and only the part of the full resolution
+mask whose low resolution logits changed is upsampled again. Every refinement records the latency from
+the first click it answers to the updated mask.
+"""
+
+# Import the necessary modules
+import time
+from collections import deque
+
+import numpy as np
+
+import blendersam_profiling
+import blendersam_runtime
+
+# Define some constants for the refinement loop
+DEBOUNCE_SECONDS = 0.03
+REGION_MARGIN = 1
+LATENCY_HISTORY = 200
+
+
+def changed_window(low_res, previous, cutoff, image_size, margin=REGION_MARGIN):
+    # Find the part of the full resolution mask that a new set of low resolution logits can change
+    # Input: float32 numpy arrays of shape (256, 256) holding the new and the previous low resolution
+    # logits (previous may be None), the logit cutoff, the (H, W) size of the image, and the number of low
+    # resolution pixels to grow the window by so that it covers the support of the bilinear upsampling
+    # Output: a (top, bottom, left, right) tuple in full resolution pixels, or None when nothing changed
+    changed = low_res > cutoff
+    if previous is not None:
+        changed ^= previous > cutoff
+    rows = np.flatnonzero(changed.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = np.flatnonzero(changed.any(axis=0))
+
+    # The low resolution logits cover the padded encoder frame, so the scale is the same on both axes
+    height, width = image_size
+    scale = blendersam_runtime.LOW_RES_SIZE / max(height, width)
+    top = max(0, int((rows[0] - margin) / scale))
+    bottom = min(height, int(np.ceil((rows[-1] + 1 + margin) / scale)))
+    left = max(0, int((columns[0] - margin) / scale))
+    right = min(width, int(np.ceil((columns[-1] + 1 + margin) / scale)))
+    if top >= bottom or left >= right:
+        return None
+    return top, bottom, left, right
+
+
+def decode_size(image_size):
+    # Get the image size to pass to the decoder when only its low resolution logits are used, so that the
+    # decoder does not spend time on full resolution masks
+    # Input: the (H, W) size of the image
+    # Output: the (h, w) size of the image inside the 256 x 256 low resolution logits
+    scale = blendersam_runtime.LOW_RES_SIZE / max(image_size)
+    return max(1, round(image_size[0] * scale)), max(1, round(image_size[1] * scale))
+
+
+def _sample_axis(start, stop, scale):
+    # Get the two low resolution neighbours and the blend weight of every full resolution pixel on one axis
+    positions = (np.arange(start, stop, dtype=np.float32) + 0.5) * scale - 0.5
+    lower = np.floor(positions)
+    weights = (positions - lower).astype(np.float32)
+    lower = lower.astype(np.int64)
+    last = blendersam_runtime.LOW_RES_SIZE - 1
+    return np.clip(lower, 0, last), np.clip(lower + 1, 0, last), weights
+
+
+def upsample_region(low_res, image_size, window):
+    # Bilinearly upsample one window of the low resolution logits to full resolution
+    # Input: a float32 numpy array of shape (256, 256) holding the low resolution logits, the (H, W) size of
+    # the image, and a (top, bottom, left, right) window in full resolution pixels
+    # Output: a float32 numpy array of shape (bottom - top, right - left) holding the logits of the window
+    # Every pixel is computed from its own coordinates, so windows upsampled separately never show seams
+    top, bottom, left, right = window
+    scale = blendersam_runtime.LOW_RES_SIZE / max(image_size)
+    row_lower, row_upper, row_weights = _sample_axis(top, bottom, scale)
+    column_lower, column_upper, column_weights = _sample_axis(left, right, scale)
+
+    # Blend along the rows first and then along the columns of the few rows that were gathered
+    rows = low_res[row_lower] * (1.0 - row_weights[:, None]) + low_res[row_upper] * row_weights[:, None]
+    return rows[:, column_lower] * (1.0 - column_weights) + rows[:, column_upper] * column_weights
+
+
+def _union(window, other):
+    # Get the smallest window holding two (top, bottom, left, right) windows, either of which may be None
+    if window is None or other is None:
+        return window or other
+    return (min(window[0], other[0]), max(window[1], other[1]), min(window[2], other[2]),
+            max(window[3], other[3]))
+
+
+class RefinementSession:
+    # The prompt points, last logits and full resolution mask of one interactive refinement session
+
+    def __init__(self, image_array, encoder_path, decoder_path, threshold=0.5, debounce=DEBOUNCE_SECONDS,
+                 cache=blendersam_runtime.embedding_cache):
+        self.image_size = image_array.shape[:2]
+        self.decoder_path = decoder_path
+        self.cutoff = blendersam_runtime.logit_threshold(threshold)
+        self.debounce = debounce
+        self.embedding = blendersam_runtime.encode_image(image_array, encoder_path, cache)
+
+        self.points = []
+        self.low_res = None
+        self.mask = np.zeros(self.image_size, dtype=bool)
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+        self._first_click = None
+        self._last_click = None
+
+        # The decoder only has to produce masks at the low resolution, the window upsampling does the rest
+        self._decode_size = decode_size(self.image_size)
+
+    def _click(self):
+        now = time.perf_counter()
+        if self._first_click is None:
+            self._first_click = now
+        self._last_click = now
+
+    def add_point(self, x, y, positive=True):
+        # Add a foreground or background point in image pixels, with the top row first
+        self.points.append((float(x), float(y), 1.0 if positive else 0.0))
+        self._click()
+
+    def remove_last_point(self):
+        # Remove the most recent point; the logits it shaped would pull the next mask back, so drop them too
+        if not self.points:
+            return False
+        self.points.pop()
+        self.low_res = None
+        self._click()
+        return True
+
+    @property
+    def pending(self):
+        return self._first_click is not None
+
+    def poll(self):
+        # Refine once the clicks have settled for the debounce interval
+        # Input: None
+        # Output: the changed (top, bottom, left, right) window, or None when nothing was refined or changed
+        if self._first_click is None or time.perf_counter() - self._last_click < self.debounce:
+            return None
+        return self.refine()
+
+    def refine(self):
+        # Decode the current points against the kept embedding and update the changed part of the mask
+        # Input: None
+        # Output: the changed (top, bottom, left, right) window in full resolution pixels, or None
+        start = self._first_click if self._first_click is not None else time.perf_counter()
+        self._first_click = None
+
+        with blendersam_profiling.span("refine", points=len(self.points)) as info:
+            if self.points:
+                points = np.asarray(self.points, dtype=np.float32)
+                point_coords, point_labels = blendersam_runtime.points_to_tensors(
+                    points[:, :2], points[:, 2], self.image_size)
+                _, _, _, low_res = next(blendersam_runtime.iter_decode(
+                    self.embedding, self.decoder_path, point_coords, point_labels, self._decode_size,
+                    mask_input=self.low_res))
+                low_res = np.ascontiguousarray(low_res[:1], dtype=np.float32)
+                previous = None if self.low_res is None else self.low_res[0, 0]
+                window = changed_window(low_res[0, 0], previous, self.cutoff, self.image_size)
+                if previous is None:
+                    # Fresh logits have nothing to diff against, so the old mask has to be cleared as well
+                    window = _union(window, self._mask_window())
+                if window is not None:
+                    top, bottom, left, right = window
+                    self.mask[top:bottom, left:right] = upsample_region(
+                        low_res[0, 0], self.image_size, window) > self.cutoff
+            else:
+                # Without points the mask is empty, which only changes where it used to be set
+                low_res = None
+                window = self._mask_window()
+                if window is not None:
+                    top, bottom, left, right = window
+                    self.mask[top:bottom, left:right] = False
+            self.low_res = low_res
+            info["window"] = None if window is None else str(window)
+
+        self.latencies.append((time.perf_counter() - start) * 1000.0)
+        return window
+
+    def _mask_window(self):
+        # Get the bounding window of the current mask
+        rows = np.flatnonzero(self.mask.any(axis=1))
+        if len(rows) == 0:
+            return None
+        columns = np.flatnonzero(self.mask.any(axis=0))
+        return int(rows[0]), int(rows[-1]) + 1, int(columns[0]), int(columns[-1]) + 1
+
+    def latency_stats(self):
+        # Summarize the per-click latencies of the session
+        # Input: None
+        # Output: a dictionary with the last, median and 95th percentile latencies in milliseconds and the count
+        if not self.latencies:
+            return {"count": 0, "last_ms": None, "median_ms": None, "p95_ms": None}
+        latencies = np.asarray(self.latencies)
+        return {
+            "count": len(latencies),
+            "last_ms": float(latencies[-1]),
+            "median_ms": float(np.median(latencies)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        }
@@ -0,0 +1,160 @@
+# BlenderSAM background jobs
+# Author: AmusedDiffuser
+
+"""
+Runs the heavy part of the BlenderSAM operators off Blender's main thread. A job carries the data an
+operator read from bpy.data, a compute function that runs inference and numpy post-processing on a
+worker thread, and an apply function that writes the results back to bpy.data on the main thread.
+Jobs wait in a bounded queue, report their progress, can be cancelled, and are applied in the order
+they were submitted.
+"""
+
+# Import the necessary modules
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import blendersam_profiling
+
+# Define some constants for the job queue
+MAX_WORKERS = 1
+MAX_PENDING = 8
+
+
+class JobCancelled(Exception):
+    # Raised inside a compute function when its job was cancelled
+    pass
+
+
+class Job:
+    # A unit of work made of a background compute stage and a main-thread apply stage
+
+    def __init__(self, name, compute=None, apply=None, data=None, profile=None):
+        self.name = name
+        self.compute = compute
+        self.apply = apply
+        self.data = data
+        self.profile = profile
+        self.result = None
+        self.error = None
+        self.progress = 0.0
+        self.stage = "Queued"
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    def report(self, fraction, stage=""):
+        # Record the progress of the job and stop it if it was cancelled
+        # Input: a float in [0, 1] representing the finished fraction and a string naming the current stage
+        # Output: None; raises JobCancelled if the job was cancelled
+        self.progress = fraction
+        if stage:
+            self.stage = stage
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.name)
+
+    def cancel(self):
+        # Ask the job to stop at its next progress report
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self.future is None or self.future.done()
+
+
+class JobQueue:
+    # A bounded queue of jobs computed on a small thread pool and handed back in submission order
+
+    def __init__(self, max_workers=MAX_WORKERS, max_pending=MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._jobs = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        # Queue a job for background computation
+        # Input: a Job with compute and apply functions
+        # Output: None; raises queue.Full if max_pending jobs are already waiting
+        with self._lock:
+            if len(self._jobs) >= self.max_pending:
+                raise queue.Full(f"{len(self._jobs)} jobs are already queued")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="BlenderSAM")
+            job.future = self._executor.submit(self._run, job)
+            self._jobs.append(job)
+
+    @staticmethod
+    def _run(job):
+        if job.cancelled:
+            return
+        try:
+            job.report(0.0, "Running")
+            with blendersam_profiling.stage(job.profile, "compute"):
+                job.result = job.compute(job.data, job)
+            job.report(1.0, "Done")
+        except JobCancelled:
+            job.stage = "Cancelled"
+        except Exception as e:
+            job.error = e
+            job.stage = "Failed"
+
+    def pop_finished(self):
+        # Take the finished jobs from the front of the queue so that results are applied in order
+        # Input: None
+        # Output: a list of finished jobs, oldest first
+        finished = []
+        with self._lock:
+            while self._jobs and self._jobs[0].done:
+                finished.append(self._jobs.popleft())
+        return finished
+
+    def progress(self):
+        # Get the combined progress of every job still in the queue
+        # Input: None
+        # Output: a float in [0, 1] and a string describing the job at the front of the queue
+        with self._lock:
+            jobs = list(self._jobs)
+        if not jobs:
+            return 1.0, ""
+        fraction = sum(job.progress for job in jobs) / len(jobs)
+        return fraction, f"{jobs[0].name}: {jobs[0].stage} ({len(jobs)} queued)"
+
+    def cancel_all(self):
+        # Cancel every job in the queue; running jobs stop at their next progress report
+        with self._lock:
+            for job in self._jobs:
+                job.cancel()
+
+    def shutdown(self):
+        # Cancel every job and stop the worker threads without waiting for them
+        self.cancel_all()
+        with self._lock:
+            self._jobs.clear()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+
+# The queue shared by every operator of the addon
+job_queue = JobQueue()
+
+
+def detach(data):
+    # Copy the numpy views in a job's data so that later main-thread reads cannot overwrite them
+    # Input: a dictionary of values read by an operator's prepare stage
+    # Output: a dictionary with every numpy array replaced by an owned copy
+    return {key: np.array(value) if isinstance(value, np.ndarray) and value.base is not None else value
+            for key, value in data.items()}
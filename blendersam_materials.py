@@ -0,0 +1,188 @@
+# BlenderSAM shared mask materials
+# Author: AmusedDiffuser
+
+"""
+Shades any number of masks with one material instead of one material and one full-size mask image per
+mask. A single node group turns a mask index into a color by looking it up in a small palette image, and
+the mask index comes either from the per-face label attribute written by the mesh helpers or from one
+label atlas image holding the index of every pixel, so that memory and shader compile time stay flat as
+the number of masks grows.
+"""
+
+# Import the necessary modules
+import numpy as np
+
+import blendersam_image_io
+import blendersam_mesh
+
+# Define some constants for the shared materials
+NODE_GROUP_NAME = "BlenderSAM Mask Shader"
+PALETTE_IMAGE_NAME = "_sam_palette"
+ATLAS_IMAGE_NAME = "_sam_label_atlas"
+FACE_MATERIAL_NAME = "_sam_masks_faces"
+ATLAS_MATERIAL_NAME = "_sam_masks_atlas"
+BACKGROUND_COLOR = (0.8, 0.8, 0.8, 1.0)
+ATLAS_SIZE = 4096
+
+
+def palette_pixels(colors, background=BACKGROUND_COLOR):
+    # Lay the mask colors out as one row of palette pixels, with the background color first
+    # Input: a numpy array of shape (N, 4) holding the RGBA color of every mask and the background color
+    # Output: a float32 numpy array of shape (N + 1, 4)
+    pixels = np.empty((len(colors) + 1, 4), dtype=np.float32)
+    pixels[0] = background
+    pixels[1:] = colors
+    return pixels
+
+
+def ensure_palette_image(colors):
+    # Write the mask colors into the palette image, resizing it when the number of masks changed
+    # Input: a numpy array of shape (N, 4) holding the RGBA color of every mask
+    # Output: a blender image of size (N + 1) x 1
+    import bpy
+
+    pixels = palette_pixels(colors)
+    image = bpy.data.images.get(PALETTE_IMAGE_NAME)
+    if image is None or tuple(image.size) != (len(pixels), 1):
+        if image is not None:
+            bpy.data.images.remove(image)
+        image = bpy.data.images.new(PALETTE_IMAGE_NAME, width=len(pixels), height=1, alpha=True, float_buffer=True)
+        image.colorspace_settings.name = "Non-Color"
+    image.pixels.foreach_set(pixels.reshape(-1))
+    image.update()
+    return image
+
+
+def ensure_atlas_image(label_map, max_size=ATLAS_SIZE):
+    # Write a label map into the label atlas image, one float per pixel holding 0 for background and k + 1 for mask k
+    # Input: an integer numpy array (or memmap) of shape (H, W) with the top row first and the largest atlas side
+    # Output: a blender image of at most max_size pixels along each side
+    import bpy
+
+    # Pick every step-th pixel so that the labels stay exact instead of blending at mask borders
+    step = max(1, -(-max(label_map.shape) // max_size))
+    label_map = np.asarray(label_map[::step, ::step])
+    height, width = label_map.shape
+    image = bpy.data.images.get(ATLAS_IMAGE_NAME)
+    if image is None or tuple(image.size) != (width, height):
+        if image is not None:
+            bpy.data.images.remove(image)
+        image = bpy.data.images.new(ATLAS_IMAGE_NAME, width=width, height=height, alpha=False, float_buffer=True)
+        image.colorspace_settings.name = "Non-Color"
+    blendersam_image_io.write_mask(image, label_map, "atlas")
+    return image
+
+
+def _add_group_socket(group, in_out, socket_type, name):
+    # Add an input or output socket to a node group on both the old and the new node group API
+    if hasattr(group, "interface"):
+        return group.interface.new_socket(name, in_out=in_out, socket_type=socket_type)
+    sockets = group.inputs if in_out == "INPUT" else group.outputs
+    return sockets.new(socket_type, name)
+
+
+def ensure_mask_node_group(palette_image):
+    # Create the shared node group once and point it at the current palette
+    # Input: the blender image returned by ensure_palette_image
+    # Output: a blender shader node group with a "Mask Index" input (-1 for background) and a "Shader" output
+    import bpy
+
+    group = bpy.data.node_groups.get(NODE_GROUP_NAME)
+    if group is None:
+        group = bpy.data.node_groups.new(NODE_GROUP_NAME, "ShaderNodeTree")
+        _add_group_socket(group, "INPUT", "NodeSocketFloat", "Mask Index")
+        _add_group_socket(group, "OUTPUT", "NodeSocketShader", "Shader")
+        nodes = group.nodes
+        links = group.links
+        input_node = nodes.new("NodeGroupInput")
+        output_node = nodes.new("NodeGroupOutput")
+
+        # Turn the mask index into the center of its palette pixel: u = (index + 1.5) / palette width
+        offset_node = nodes.new("ShaderNodeMath")
+        offset_node.operation = "ADD"
+        offset_node.inputs[1].default_value = 1.5
+        scale_node = nodes.new("ShaderNodeMath")
+        scale_node.name = "Palette Width"
+        scale_node.operation = "DIVIDE"
+        vector_node = nodes.new("ShaderNodeCombineXYZ")
+        vector_node.inputs["Y"].default_value = 0.5
+
+        # Look the color up without filtering so that neighboring palette entries never blend
+        palette_node = nodes.new("ShaderNodeTexImage")
+        palette_node.name = "Palette"
+        palette_node.interpolation = "Closest"
+        palette_node.extension = "EXTEND"
+        principled_node = nodes.new("ShaderNodeBsdfPrincipled")
+
+        links.new(input_node.outputs["Mask Index"], offset_node.inputs[0])
+        links.new(offset_node.outputs["Value"], scale_node.inputs[0])
+        links.new(scale_node.outputs["Value"], vector_node.inputs["X"])
+        links.new(vector_node.outputs["Vector"], palette_node.inputs["Vector"])
+        links.new(palette_node.outputs["Color"], principled_node.inputs["Base Color"])
+        links.new(principled_node.outputs["BSDF"], output_node.inputs["Shader"])
+
+    # Only the palette and its width change between runs, so the shader itself is compiled once
+    group.nodes["Palette"].image = palette_image
+    group.nodes["Palette Width"].inputs[1].default_value = float(palette_image.size[0])
+    return group
+
+
+def _new_group_material(name, group):
+    # Create a material that shades through the shared node group
+    import bpy
+
+    material = bpy.data.materials.new(name)
+    material.use_nodes = True
+    nodes = material.node_tree.nodes
+    for node in list(nodes):
+        if node.type != "OUTPUT_MATERIAL":
+            nodes.remove(node)
+    group_node = nodes.new("ShaderNodeGroup")
+    group_node.name = "Mask Shader"
+    group_node.node_tree = group
+    material.node_tree.links.new(group_node.outputs["Shader"], nodes.get("Material Output").inputs["Surface"])
+    return material
+
+
+def face_material(colors):
+    # Get the shared material that reads the mask index of every face from the label attribute
+    # Input: a numpy array of shape (N, 4) holding the RGBA color of every mask
+    # Output: a blender material
+    import bpy
+
+    group = ensure_mask_node_group(ensure_palette_image(colors))
+    material = bpy.data.materials.get(FACE_MATERIAL_NAME)
+    if material is None:
+        material = _new_group_material(FACE_MATERIAL_NAME, group)
+        nodes = material.node_tree.nodes
+        attribute_node = nodes.new("ShaderNodeAttribute")
+        attribute_node.attribute_type = "GEOMETRY"
+        attribute_node.attribute_name = blendersam_mesh.LABEL_ATTRIBUTE
+        material.node_tree.links.new(attribute_node.outputs["Fac"], nodes["Mask Shader"].inputs["Mask Index"])
+    return material
+
+
+def atlas_material(label_map, colors):
+    # Get the shared material that reads the mask index of every pixel from the label atlas through the UVs
+    # Input: an integer numpy array (or memmap) of shape (H, W) holding 0 for background and k + 1 for mask k,
+    # and a numpy array of shape (N, 4) holding the RGBA color of every mask
+    # Output: a blender material
+    import bpy
+
+    group = ensure_mask_node_group(ensure_palette_image(colors))
+    atlas_image = ensure_atlas_image(label_map)
+    material = bpy.data.materials.get(ATLAS_MATERIAL_NAME)
+    if material is None:
+        material = _new_group_material(ATLAS_MATERIAL_NAME, group)
+        nodes = material.node_tree.nodes
+        links = material.node_tree.links
+        atlas_node = nodes.new("ShaderNodeTexImage")
+        atlas_node.name = "Label Atlas"
+        atlas_node.interpolation = "Closest"
+        index_node = nodes.new("ShaderNodeMath")
+        index_node.operation = "SUBTRACT"
+        index_node.inputs[1].default_value = 1.0
+        links.new(atlas_node.outputs["Color"], index_node.inputs[0])
+        links.new(index_node.outputs["Value"], nodes["Mask Shader"].inputs["Mask Index"])
+    material.node_tree.nodes["Label Atlas"].image = atlas_image
+    return material
@@ -0,0 +1,265 @@
+# BlenderSAM mesh building helpers
+# Author: AmusedDiffuser
+
+"""
+Builds meshes from segmentation masks with numpy instead of Blender operators. Every mask is turned into
+an extruded heightfield of covered cells, all masks are triangulated in one vectorized pass, and the
+result is written into a single Blender mesh with foreach_set, with one material index per mask.
+"""
+
+# Import the necessary modules
+import numpy as np
+
+import blendersam_mesh_index
+
+# Define some constants for the mesh builder
+CELL_SIZE = 4
+EXTRUDE_DEPTH = 10.0
+DOWNSAMPLE_CHUNK = 16
+
+# Corner offsets (row, column) of the top quad and of the boundary walls of a cell, ordered so that the
+# faces point up and outwards when the image top is +Y in world space
+_TOP_CORNERS = np.array([(0, 0), (1, 0), (1, 1), (0, 1)])
+_WALL_EDGES = {
+    # direction: (neighbor offset, first corner, second corner)
+    "left": ((0, -1), (0, 0), (1, 0)),
+    "right": ((0, 1), (1, 1), (0, 1)),
+    "top": ((-1, 0), (0, 1), (0, 0)),
+    "bottom": ((1, 0), (1, 0), (1, 1)),
+}
+
+
+def downsample_masks(masks, cell_size=CELL_SIZE, threshold=0.5):
+    # Reduce masks to a coarse grid of covered cells
+    # Input: a numpy array of shape (N, H, W) holding the masks, an integer representing the cell size in
+    # pixels, and the fraction of a cell that has to be covered for the cell to count
+    # Output: a boolean numpy array of shape (N, ceil(H / cell_size), ceil(W / cell_size))
+    masks = np.asarray(masks)
+    if cell_size <= 1:
+        return masks > threshold if masks.dtype != bool else masks
+
+    # Pad the masks to a multiple of the cell size and average every cell with a reshape, a few masks at a
+    # time so that the padded copy stays small
+    count, height, width = masks.shape
+    rows, columns = -(-height // cell_size), -(-width // cell_size)
+    cells = np.empty((count, rows, columns), dtype=bool)
+    padded = np.zeros((min(count, DOWNSAMPLE_CHUNK), rows * cell_size, columns * cell_size), dtype=np.float32)
+    for start in range(0, count, DOWNSAMPLE_CHUNK):
+        stop = min(start + DOWNSAMPLE_CHUNK, count)
+        chunk = padded[:stop - start]
+        chunk[:, :height, :width] = masks[start:stop]
+        coverage = chunk.reshape(stop - start, rows, cell_size, columns, cell_size).mean(axis=(2, 4))
+        cells[start:stop] = coverage > threshold
+    return cells
+
+
+def build_mask_geometry(cells, depth=EXTRUDE_DEPTH, cell_size=CELL_SIZE, triangulate=False):
+    # Triangulate the extruded heightfields of all masks in one pass
+    # Input: a boolean numpy array of shape (N, rows, columns) holding the covered cells of every mask,
+    # the extrusion depth, the cell size in pixels, and whether quads should be split into triangles
+    # Output: a float32 numpy array of shape (V, 3) holding the vertex coordinates, an int32 numpy array of
+    # shape (F, 3) or (F, 4) holding the face corners, and an int32 numpy array of shape (F,) holding the
+    # index of the mask every face belongs to
+    count, rows, columns = cells.shape
+    grid_size = (rows + 1) * (columns + 1)
+
+    def corner_ids(mask_ids, ys, xs, level):
+        # Number every grid corner of every mask on the bottom (0) and top (1) level uniquely
+        return (level * count + mask_ids) * grid_size + ys * (columns + 1) + xs
+
+    # Top faces for every covered cell of every mask
+    mask_ids, ys, xs = np.nonzero(cells)
+    top_faces = np.stack([corner_ids(mask_ids, ys + dy, xs + dx, 1) for dy, dx in _TOP_CORNERS], axis=1)
+    faces = [top_faces]
+    face_masks = [mask_ids]
+
+    # Wall faces wherever a covered cell borders an uncovered cell or the image border
+    padded = np.pad(cells, ((0, 0), (1, 1), (1, 1)))
+    for (dy, dx), (ay, ax), (by, bx) in _WALL_EDGES.values():
+        neighbor = padded[:, 1 + dy:1 + dy + rows, 1 + dx:1 + dx + columns]
+        wall_masks, wall_ys, wall_xs = np.nonzero(cells & ~neighbor)
+        a_top = corner_ids(wall_masks, wall_ys + ay, wall_xs + ax, 1)
+        a_bottom = corner_ids(wall_masks, wall_ys + ay, wall_xs + ax, 0)
+        b_top = corner_ids(wall_masks, wall_ys + by, wall_xs + bx, 1)
+        b_bottom = corner_ids(wall_masks, wall_ys + by, wall_xs + bx, 0)
+        faces.append(np.stack([a_top, a_bottom, b_bottom, b_top], axis=1))
+        face_masks.append(wall_masks)
+
+    faces = np.concatenate(faces)
+    face_masks = np.concatenate(face_masks).astype(np.int32)
+
+    # Keep only the corners that are used and renumber the faces to the compact vertex list
+    used_ids, faces = np.unique(faces, return_inverse=True)
+    faces = faces.reshape(-1, 4).astype(np.int32)
+    levels, rest = np.divmod(used_ids, count * grid_size)
+    grid_ids = rest % grid_size
+    corner_ys, corner_xs = np.divmod(grid_ids, columns + 1)
+
+    # Center the model on the origin with the image top pointing to +Y
+    vertices = np.empty((len(used_ids), 3), dtype=np.float32)
+    vertices[:, 0] = (corner_xs - columns / 2) * cell_size
+    vertices[:, 1] = (rows / 2 - corner_ys) * cell_size
+    vertices[:, 2] = levels * depth
+
+    if triangulate:
+        faces = np.concatenate([faces[:, [0, 1, 2]], faces[:, [0, 2, 3]]])
+        face_masks = np.concatenate([face_masks, face_masks])
+
+    return vertices, faces, face_masks
+
+
+def fill_mesh(mesh, vertices, faces, material_indices=None, smooth=False):
+    # Write vertices and equally sized faces into an empty Blender mesh in bulk
+    # Input: a blender mesh without geometry, a numpy array of shape (V, 3) holding the vertex coordinates,
+    # a numpy array of shape (F, K) holding the face corners, an optional numpy array of shape (F,) holding
+    # the material index of every face, and whether the faces should be shaded smooth
+    # Output: None
+    face_count, corners = faces.shape
+    mesh.vertices.add(len(vertices))
+    mesh.loops.add(face_count * corners)
+    mesh.polygons.add(face_count)
+
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1))
+    mesh.loops.foreach_set("vertex_index", np.ascontiguousarray(faces, dtype=np.int32).reshape(-1))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, face_count * corners, corners, dtype=np.int32))
+    try:
+        mesh.polygons.foreach_set("loop_total", np.full(face_count, corners, dtype=np.int32))
+    except (AttributeError, TypeError):
+        # Newer Blender versions derive the loop totals from the loop starts
+        pass
+
+    if material_indices is not None:
+        mesh.polygons.foreach_set("material_index", np.ascontiguousarray(material_indices, dtype=np.int32))
+    if smooth:
+        mesh.polygons.foreach_set("use_smooth", np.ones(face_count, dtype=bool))
+
+    mesh.update(calc_edges=True)
+    mesh.validate()
+
+
+def create_mask_model(name, masks, materials=(), depth=EXTRUDE_DEPTH, cell_size=CELL_SIZE, triangulate=False):
+    # Create one model object holding the extruded heightfields of all masks
+    # Input: a string representing the name of the object, a numpy array of shape (N, H, W) holding the masks,
+    # a list of blender materials with one material per mask, the extrusion depth, the cell size in pixels,
+    # and whether quads should be split into triangles
+    # Output: a blender object linked to the scene collection
+    cells = downsample_masks(masks, cell_size)
+    vertices, faces, face_masks = build_mask_geometry(cells, depth, cell_size, triangulate)
+    return link_mask_model(name, vertices, faces, face_masks, materials)
+
+
+def link_mask_model(name, vertices, faces, face_masks, materials=()):
+    # Create a model object from geometry returned by build_mask_geometry
+    # Input: a string representing the name of the object, the vertices, faces and face mask indices returned
+    # by build_mask_geometry, and a list of blender materials with one material per mask
+    # Output: a blender object linked to the scene collection
+    import bpy
+
+    mesh = bpy.data.meshes.new(f"{name}_mesh")
+    for material in materials:
+        mesh.materials.append(material)
+    fill_mesh(mesh, vertices, faces, face_masks if len(materials) else None, smooth=True)
+
+    model_object = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(model_object)
+    return model_object
+
+
+# Define some constants for assigning masks to faces
+LABEL_ATTRIBUTE = "sam_label"
+MATERIAL_ATTRIBUTE = "sam_material"
+
+
+def resolve_face_labels(face_masks, scores=None):
+    # Resolve overlapping per-face masks into a single label per face
+    # Input: a boolean numpy array of shape (N, F) telling which faces every mask covers, and an optional
+    # numpy array of shape (N,) holding the mask scores; without scores later masks win like before
+    # Output: an int32 numpy array of shape (F,) holding the index of the winning mask or -1 for no mask
+    face_masks = np.asarray(face_masks, dtype=bool)
+    labels = np.full(face_masks.shape[1], -1, dtype=np.int32)
+
+    # Paint the masks from the lowest to the highest score so that the best mask covering a face wins
+    order = np.arange(len(face_masks)) if scores is None else np.argsort(scores, kind="stable")
+    for i in order:
+        labels[face_masks[i]] = i
+    return labels
+
+
+def read_face_labels(mesh):
+    # Read the labels stored on a mesh by the last call to write_face_labels
+    # Input: a blender mesh
+    # Output: an int32 numpy array of shape (F,), or None if the mesh has no labels yet
+    return read_face_attribute(mesh, LABEL_ATTRIBUTE)
+
+
+def ensure_material_slots(mesh, materials):
+    # Make sure that every material has a slot on the mesh, reusing existing slots
+    # Input: a blender mesh and a list of blender materials
+    # Output: an int32 numpy array holding the slot index of every material
+    slots = np.empty(len(materials), dtype=np.int32)
+    for i, material in enumerate(materials):
+        slot = mesh.materials.find(material.name)
+        if slot < 0:
+            mesh.materials.append(material)
+            slot = len(mesh.materials) - 1
+        slots[i] = slot
+    return slots
+
+
+def read_face_attribute(mesh, name):
+    # Read an integer face attribute of a mesh
+    # Input: a blender mesh and a string representing the attribute name
+    # Output: an int32 numpy array of shape (F,), or None if the mesh has no such face attribute
+    attribute = mesh.attributes.get(name)
+    if attribute is None or attribute.domain != "FACE" or len(attribute.data) != len(mesh.polygons):
+        return None
+    values = np.empty(len(mesh.polygons), dtype=np.int32)
+    attribute.data.foreach_get("value", values)
+    return values
+
+
+def write_face_attribute(mesh, name, values):
+    # Write an integer face attribute of a mesh, creating it or replacing a stale one first
+    # Input: a blender mesh, a string representing the attribute name and an int32 numpy array of shape (F,)
+    # Output: None
+    attribute = mesh.attributes.get(name)
+    if attribute is not None and (attribute.domain != "FACE" or len(attribute.data) != len(mesh.polygons)):
+        mesh.attributes.remove(attribute)
+        attribute = None
+    if attribute is None:
+        attribute = mesh.attributes.new(name, "INT", "FACE")
+    attribute.data.foreach_set("value", np.ascontiguousarray(values, dtype=np.int32))
+
+
+def write_face_labels(mesh, labels, slots):
+    # Assign material indices from per-face labels, writing the mesh only when a material or label changes
+    # Input: a blender mesh, an int32 numpy array of shape (F,) holding the label of every face or -1, and
+    # an int32 numpy array holding the material slot of every label, which may be empty when no face is labeled
+    # Output: an integer representing the number of faces whose material index changed
+    current = np.empty(len(labels), dtype=np.int32)
+    mesh.polygons.foreach_get("material_index", current)
+
+    # Remember the materials the faces had before their first segmentation, so that faces no mask covers keep
+    # or get back their own material
+    original = read_face_attribute(mesh, MATERIAL_ATTRIBUTE)
+    if original is None:
+        original = current.copy()
+        write_face_attribute(mesh, MATERIAL_ATTRIBUTE, original)
+
+    labeled = labels >= 0
+    material_indices = original.copy()
+    material_indices[labeled] = slots[labels[labeled]]
+    changed = np.flatnonzero(material_indices != current)
+    if len(changed):
+        mesh.polygons.foreach_set("material_index", material_indices)
+
+    previous = read_face_labels(mesh)
+    if previous is None or not np.array_equal(previous, labels):
+        write_face_attribute(mesh, LABEL_ATTRIBUTE, labels)
+    elif len(changed) == 0:
+        return 0
+
+    # Materials and labels leave the geometry and UVs alone, so the cached mesh index stays valid
+    blendersam_mesh_index.expect_update(mesh)
+    mesh.update()
+    return len(changed)
@@ -0,0 +1,333 @@
+# BlenderSAM mesh acceleration layer
+# Author: AmusedDiffuser
+
+"""
+Keeps the per-mesh structures that prompt-driven mesh segmentation needs, so that they are built once per
+mesh instead of once per segmentation. The geometry is read with bulk foreach_get calls, prompt points are
+mapped to the faces with the nearest UV centers in one matrix product, and faces that share an edge are
+stored as a compact CSR graph that flood fill and region growing walk one vectorized frontier at a time.
+Indexes are cached by mesh and only rebuilt when the geometry or UVs of the mesh actually changed, not when
+the addon itself writes face materials or labels.
+"""
+
+# Import the necessary modules
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Define some constants for the mesh index cache
+MAX_INDEXES = 4
+UV_QUERY_BLOCK = 16
+
+_indexes = OrderedDict()
+_dirty = set()
+_expected = set()
+_indexes_lock = threading.Lock()
+
+
+def read_mesh_arrays(mesh):
+    # Read the geometry of a mesh with bulk foreach_get calls
+    # Input: a blender mesh
+    # Output: a dictionary with the vertex coordinates (V, 3), the vertex index of every loop (L,), the loop
+    # start and loop count of every face (F,), and the UV center of every face (F, 2) or None without a UV map
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+    loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_starts)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+
+    face_uvs = None
+    if mesh.uv_layers.active is not None and len(loop_starts):
+        loop_uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+        mesh.uv_layers.active.data.foreach_get("uv", loop_uvs)
+        face_uvs = np.add.reduceat(loop_uvs.reshape(-1, 2), loop_starts) / loop_totals[:, None]
+
+    return {
+        "vertices": vertices.reshape(-1, 3),
+        "loop_vertices": loop_vertices,
+        "loop_starts": loop_starts,
+        "loop_totals": loop_totals,
+        "face_uvs": face_uvs,
+    }
+
+
+def mesh_fingerprint(arrays):
+    # Identify the geometry and UVs of a mesh
+    # Input: a dictionary returned by read_mesh_arrays
+    # Output: a hex string that changes whenever the vertices, faces or face UV centers change
+    digest = hashlib.blake2b(digest_size=16)
+    for name in ("vertices", "loop_vertices", "loop_starts", "face_uvs"):
+        if arrays[name] is not None:
+            digest.update(memoryview(np.ascontiguousarray(arrays[name])).cast("B"))
+    return digest.hexdigest()
+
+
+def next_loops(loop_starts, loop_totals):
+    # Get the index of the next loop around the face of every loop
+    # Input: the loop starts and loop totals returned by read_mesh_arrays
+    # Output: an int64 numpy array of shape (L,)
+    following = np.arange(1, int(loop_totals.sum()) + 1)
+    following[loop_starts + loop_totals - 1] = loop_starts
+    return following
+
+
+class FaceGraph:
+    # The faces that share an edge with every face, stored in compressed sparse row form: the neighbours of
+    # face f are indices[indptr[f]:indptr[f + 1]]
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbors(self, face):
+        return self.indices[self.indptr[face]:self.indptr[face + 1]]
+
+    def expand(self, faces):
+        # Gather the neighbours of many faces at once
+        # Input: an integer numpy array of face indices
+        # Output: an int32 numpy array of the neighbours and an int64 numpy array holding, for every neighbour,
+        # the position in faces it was reached from
+        starts = self.indptr[faces]
+        counts = self.indptr[faces + 1] - starts
+        sources = np.repeat(np.arange(len(faces)), counts)
+        offsets = np.arange(len(sources)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.indices[starts[sources] + offsets], sources
+
+
+def build_face_graph(loop_vertices, loop_starts, loop_totals):
+    # Connect the faces that share an edge
+    # Input: the loop vertex indices, loop starts and loop totals returned by read_mesh_arrays
+    # Output: a FaceGraph; the faces around a non-manifold edge are chained so that they stay connected
+    face_count = len(loop_starts)
+    if face_count == 0:
+        return FaceGraph(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32))
+
+    # Turn every loop into the edge to the next loop of its face, keyed by its two sorted vertex indices
+    faces = np.repeat(np.arange(face_count, dtype=np.int64), loop_totals)
+    first = loop_vertices.astype(np.int64)
+    second = loop_vertices[next_loops(loop_starts, loop_totals)].astype(np.int64)
+    vertex_count = int(loop_vertices.max()) + 1
+    keys = np.minimum(first, second) * vertex_count + np.maximum(first, second)
+
+    # Sorting the edges puts the faces sharing an edge next to each other
+    order = np.argsort(keys, kind="stable")
+    keys, faces = keys[order], faces[order]
+    shared = np.flatnonzero(keys[1:] == keys[:-1])
+    first, second = faces[shared], faces[shared + 1]
+    distinct = first != second
+    first, second = first[distinct], second[distinct]
+
+    # Store every pair in both directions once, even when two faces share several edges
+    pairs = np.unique(np.concatenate([first * face_count + second, second * face_count + first]))
+    sources = pairs // face_count
+    indptr = np.zeros(face_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=face_count), out=indptr[1:])
+    return FaceGraph(indptr, (pairs % face_count).astype(np.int32))
+
+
+def flood_fill(graph, seeds, allowed=None, max_steps=None):
+    # Collect the faces connected to some seed faces
+    # Input: a FaceGraph, an array-like of seed face indices, an optional boolean numpy array of shape (F,)
+    # holding the faces the fill may enter, and an optional maximum number of rings to grow
+    # Output: a boolean numpy array of shape (F,) holding the filled region
+    region = np.zeros(len(graph), dtype=bool)
+    frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+    if allowed is not None:
+        frontier = frontier[allowed[frontier]]
+    region[frontier] = True
+
+    steps = 0
+    while len(frontier) and (max_steps is None or steps < max_steps):
+        neighbors, _ = graph.expand(frontier)
+        neighbors = neighbors[~region[neighbors]]
+        if allowed is not None:
+            neighbors = neighbors[allowed[neighbors]]
+        frontier = np.unique(neighbors)
+        region[frontier] = True
+        steps += 1
+    return region
+
+
+def grow_regions(graph, labels, allowed=None, max_steps=None):
+    # Grow labeled regions into the unlabeled faces around them, all regions one ring per step
+    # Input: a FaceGraph, an int32 numpy array of shape (F,) holding the label of every face or -1, an
+    # optional boolean numpy array of shape (F,) holding the faces the regions may grow into, and an optional
+    # maximum number of rings to grow
+    # Output: a new int32 numpy array of shape (F,); a face reached by several regions in the same step
+    # joins the region of its neighbour with the lowest face index
+    labels = np.array(labels, dtype=np.int32)
+    frontier = np.flatnonzero(labels >= 0)
+
+    steps = 0
+    while len(frontier) and (max_steps is None or steps < max_steps):
+        neighbors, sources = graph.expand(frontier)
+        free = labels[neighbors] < 0
+        if allowed is not None:
+            free &= allowed[neighbors]
+        neighbors, sources = neighbors[free], sources[free]
+        neighbors, first = np.unique(neighbors, return_index=True)
+        labels[neighbors] = labels[frontier[sources[first]]]
+        frontier = neighbors
+        steps += 1
+    return labels
+
+
+class MeshIndex:
+    # The arrays, face graph, face geometry and UV lookup of one mesh; everything past the arrays is built
+    # on first use
+
+    def __init__(self, arrays, fingerprint=None):
+        self.vertices = arrays["vertices"]
+        self.loop_vertices = arrays["loop_vertices"]
+        self.loop_starts = arrays["loop_starts"]
+        self.loop_totals = arrays["loop_totals"]
+        self.face_uvs = arrays["face_uvs"]
+        self.counts = (len(self.vertices), len(self.loop_vertices), len(self.loop_starts))
+        self.fingerprint = fingerprint or mesh_fingerprint(arrays)
+        self._graph = None
+        self._face_geometry = None
+        self._triangles = None
+        self._uv_norms = None
+        self._lock = threading.Lock()
+
+    @property
+    def graph(self):
+        with self._lock:
+            if self._graph is None:
+                self._graph = build_face_graph(self.loop_vertices, self.loop_starts, self.loop_totals)
+            return self._graph
+
+    def face_geometry(self):
+        # Get the center, unit normal and bounding radius of every face in object space
+        # Input: None
+        # Output: float32 numpy arrays of shape (F, 3), (F, 3) and (F,)
+        with self._lock:
+            if self._face_geometry is None:
+                corners = self.vertices[self.loop_vertices]
+                centers = np.add.reduceat(corners, self.loop_starts) / self.loop_totals[:, None]
+
+                # Newell's method sums the cross products of the edges, which also works for non-planar faces
+                following = corners[next_loops(self.loop_starts, self.loop_totals)]
+                normals = np.add.reduceat(np.cross(corners, following), self.loop_starts)
+                normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+
+                offsets = np.linalg.norm(corners - np.repeat(centers, self.loop_totals, axis=0), axis=1)
+                radii = np.maximum.reduceat(offsets, self.loop_starts)
+                self._face_geometry = (centers.astype(np.float32), normals.astype(np.float32),
+                                       radii.astype(np.float32))
+            return self._face_geometry
+
+    def triangles(self):
+        # Split every face into a fan of triangles around its first corner
+        # Input: None
+        # Output: an int32 numpy array of shape (T, 3) holding the vertex indices of the triangles
+        with self._lock:
+            if self._triangles is None:
+                counts = np.maximum(self.loop_totals - 2, 0)
+                faces = np.repeat(np.arange(len(counts)), counts)
+                steps = np.arange(len(faces)) - np.repeat(np.cumsum(counts) - counts, counts)
+                starts = self.loop_starts[faces]
+                loops = np.stack([starts, starts + steps + 1, starts + steps + 2], axis=1)
+                self._triangles = self.loop_vertices[loops]
+            return self._triangles
+
+    def faces(self):
+        # Get the vertex indices of every face, as one (F, K) array when all faces have K corners
+        if len(self.loop_totals) and np.all(self.loop_totals == self.loop_totals[0]):
+            return self.loop_vertices.reshape(-1, int(self.loop_totals[0]))
+        return np.split(self.loop_vertices, self.loop_starts[1:])
+
+    def faces_at_uvs(self, uvs):
+        # Map UV coordinates to the faces whose UV centers are nearest
+        # Input: an array-like of shape (N, 2) holding UV coordinates
+        # Output: an int64 numpy array of shape (N,) holding face indices; raises RuntimeError without a UV map
+        if self.face_uvs is None:
+            raise RuntimeError("The mesh has no UV map")
+        uvs = np.asarray(uvs, dtype=np.float32).reshape(-1, 2)
+        with self._lock:
+            if self._uv_norms is None:
+                self._uv_norms = np.einsum("ij,ij->i", self.face_uvs, self.face_uvs)
+        norms = self._uv_norms
+
+        # There are only a handful of prompts, so one pass over all face centers per block of prompts costs about
+        # as much as reading the UVs and needs no tree to be built first; |f - p|^2 - |p|^2 = |f|^2 - 2 f.p
+        faces = np.empty(len(uvs), dtype=np.int64)
+        for start in range(0, len(uvs), UV_QUERY_BLOCK):
+            block = uvs[start:start + UV_QUERY_BLOCK]
+            faces[start:start + len(block)] = np.argmin(norms[:, None] - 2.0 * (self.face_uvs @ block.T), axis=0)
+        return faces
+
+
+def _mesh_key(mesh):
+    return getattr(mesh, "name_full", mesh.name)
+
+
+def get_index(mesh):
+    # Get the index of a mesh, reusing the cached one unless the geometry or UVs of the mesh changed
+    # Input: a blender mesh
+    # Output: a MeshIndex
+    key = _mesh_key(mesh)
+    counts = (len(mesh.vertices), len(mesh.loops), len(mesh.polygons))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        dirty = key in _dirty
+        _dirty.discard(key)
+        if index is not None and index.counts == counts and not dirty:
+            _indexes.move_to_end(key)
+            return index
+
+    # A mesh marked as changed keeps its index when only its materials or attributes were edited
+    arrays = read_mesh_arrays(mesh)
+    fingerprint = mesh_fingerprint(arrays)
+    if index is None or index.fingerprint != fingerprint:
+        index = MeshIndex(arrays, fingerprint)
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def expect_update(mesh):
+    # Let the next geometry update of a mesh pass without marking its index, for writes of the addon that leave
+    # the vertices, faces and UVs alone, such as face materials and labels
+    # Input: a blender mesh
+    # Output: None
+    key = _mesh_key(mesh)
+    with _indexes_lock:
+        if key in _indexes and key not in _dirty:
+            _expected.add(key)
+
+
+def mark_changed(depsgraph):
+    # Mark the cached meshes whose geometry a depsgraph update touched, for a depsgraph_update_post handler
+    # Input: the depsgraph passed to the handler
+    # Output: None
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry:
+            continue
+        data = getattr(update.id, "original", update.id)
+        data = getattr(data, "data", data)
+        key = getattr(data, "name_full", None)
+        with _indexes_lock:
+            if key in _expected:
+                _expected.discard(key)
+            elif key in _indexes:
+                _dirty.add(key)
+
+
+def release_indexes():
+    # Drop every cached index
+    with _indexes_lock:
+        _indexes.clear()
+        _dirty.clear()
+        _expected.clear()
@@ -0,0 +1,399 @@
+# BlenderSAM multi-view segmentation
+# Author: AmusedDiffuser
+
+"""
+Segments a mesh in 3D by rendering it from several viewpoints, segmenting every view and voting the
+masks back onto the faces. The views are rendered with a fast engine at a small fixed resolution, all
+of them go through the image encoder in batches, and every view is decoded and projected on its own
+worker thread. Every view rasterizes the front-facing triangles of the mesh into a per-pixel depth buffer
+with numpy and tests the center and corners of every face against it, so hidden faces never vote. Each
+prompt is a face of the mesh that is projected into every view that sees it, and every face takes the
+prompt whose masks covered it in most of the views that saw it, weighted by mask score and by how squarely
+the face was seen. Votes are only kept for the faces a view saw, so they grow with the views, not the mesh.
+"""
+
+# Import the necessary modules
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import blendersam_mesh_index
+import blendersam_profiling
+import blendersam_runtime
+
+# Define some constants for multi-view segmentation
+VIEW_COUNT = 8
+VIEW_RESOLUTION = 512
+VIEW_FOV = math.radians(40.0)
+VIEW_MARGIN = 1.1
+VIEW_WORKERS = 4
+FACING_MIN = 0.1
+DEPTH_TOLERANCE = 1.0
+DEPTH_EPSILON = 1e-4
+CORNER_INSET = 0.2
+RASTER_CHUNK = 2 ** 22
+VOTE_THRESHOLD = 0.5
+RENDER_ENGINES = {
+    "WORKBENCH": ("BLENDER_WORKBENCH",),
+    "EEVEE": ("BLENDER_EEVEE_NEXT", "BLENDER_EEVEE"),
+}
+
+
+def view_cameras(center, radius, count=VIEW_COUNT, fov=VIEW_FOV, margin=VIEW_MARGIN):
+    # Place cameras evenly on a sphere around an object, all looking at its center
+    # Input: the (3,) world space center and the radius of the bounding sphere of the object, the number of
+    # cameras, the field of view in radians, and the factor to keep between the object and the frame edge
+    # Output: a float64 numpy array of shape (N, 4, 4) holding the camera to world matrices, looking down -Z
+    # with +Y up like Blender cameras
+    center = np.asarray(center, dtype=np.float64)
+    distance = max(radius, 1e-6) * margin / math.sin(fov / 2.0)
+
+    # Spread the directions over the sphere along a golden angle spiral
+    steps = np.arange(count) + 0.5
+    heights = 1.0 - 2.0 * steps / count
+    rings = np.sqrt(1.0 - heights ** 2)
+    angles = steps * math.pi * (3.0 - math.sqrt(5.0))
+    directions = np.stack([rings * np.cos(angles), rings * np.sin(angles), heights], axis=1)
+
+    cameras = np.zeros((count, 4, 4))
+    for camera, back in zip(cameras, directions):
+        up = np.array([0.0, 0.0, 1.0]) if abs(back[2]) < 0.999 else np.array([0.0, 1.0, 0.0])
+        right = np.cross(up, back)
+        right /= np.linalg.norm(right)
+        camera[:3, 0] = right
+        camera[:3, 1] = np.cross(back, right)
+        camera[:3, 2] = back
+        camera[:3, 3] = center + back * distance
+        camera[3, 3] = 1.0
+    return cameras
+
+
+def focal_length(resolution, fov=VIEW_FOV):
+    # Get the focal length in pixels of a square view
+    return resolution / 2.0 / math.tan(fov / 2.0)
+
+
+def project_points(points, camera, resolution, fov=VIEW_FOV):
+    # Project world space points into a square view
+    # Input: a float32 numpy array of shape (P, 3), a (4, 4) camera to world matrix, the width and height of
+    # the view in pixels, and the field of view in radians
+    # Output: float32 numpy arrays of shape (P,) holding the columns, the rows with the top row first, and the
+    # depths in front of the camera, which are not positive for points behind it
+    local = (points - camera[:3, 3].astype(np.float32)) @ camera[:3, :3].astype(np.float32)
+    depth = -local[:, 2]
+    safe_depth = np.where(depth > 1e-6, depth, 1e-6)
+    focal = focal_length(resolution, fov)
+    columns = resolution / 2.0 + focal * local[:, 0] / safe_depth
+    rows = resolution / 2.0 - focal * local[:, 1] / safe_depth
+    return columns, rows, depth
+
+
+def rasterize_depth(columns, rows, depth, triangles, resolution):
+    # Rasterize triangles into a per-pixel depth buffer
+    # Input: the projected vertices returned by project_points, an int32 numpy array of shape (T, 3) holding
+    # the vertex indices of the triangles, and the width and height of the view in pixels
+    # Output: a float32 numpy array of shape (R * R,) holding the nearest depth at every pixel center, or inf
+    zbuffer = np.full(resolution * resolution, np.inf, dtype=np.float32)
+
+    # Work on one array per triangle corner, which keeps every per-triangle step a flat vectorized pass
+    a, b, c = triangles.T
+    in_front = (depth[a] > 0) & (depth[b] > 0) & (depth[c] > 0)
+    a, b, c = a[in_front], b[in_front], c[in_front]
+    x0, x1, x2 = columns[a], columns[b], columns[c]
+    y0, y1, y2 = rows[a], rows[b], rows[c]
+
+    # Find the pixel centers inside the bounding box of every triangle, dropping triangles that cover none
+    left = np.maximum(np.ceil(np.minimum(np.minimum(x0, x1), x2) - 0.5), 0).astype(np.int64)
+    right = np.minimum(np.floor(np.maximum(np.maximum(x0, x1), x2) - 0.5), resolution - 1).astype(np.int64)
+    top = np.maximum(np.ceil(np.minimum(np.minimum(y0, y1), y2) - 0.5), 0).astype(np.int64)
+    bottom = np.minimum(np.floor(np.maximum(np.maximum(y0, y1), y2) - 0.5), resolution - 1).astype(np.int64)
+    area = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+    keep = np.flatnonzero((right >= left) & (bottom >= top) & (np.abs(area) > 1e-12))
+    x = np.stack([x0[keep], x1[keep], x2[keep]], axis=1)
+    y = np.stack([y0[keep], y1[keep], y2[keep]], axis=1)
+    inverse_depth = 1.0 / np.stack([depth[a[keep]], depth[b[keep]], depth[c[keep]]], axis=1)
+    area, left, top = area[keep], left[keep], top[keep]
+    widths = right[keep] - left + 1
+    counts = widths * (bottom[keep] - top + 1)
+
+    # Walk the triangles in chunks of a bounded number of candidate pixels
+    ends = np.cumsum(counts)
+    total = int(ends[-1]) if len(ends) else 0
+    splits = np.searchsorted(ends, np.arange(RASTER_CHUNK, total, RASTER_CHUNK), side="right")
+    boundaries = np.concatenate([[0], splits, [len(counts)]])
+    for first, last in zip(boundaries[:-1], boundaries[1:]):
+        if last <= first:
+            continue
+        chunk_counts = counts[first:last]
+        chunk = np.repeat(np.arange(first, last), chunk_counts)
+        offsets = np.arange(len(chunk)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+        pixel_columns = left[chunk] + offsets % widths[chunk]
+        pixel_rows = top[chunk] + offsets // widths[chunk]
+
+        # Barycentric weights of the pixel centers; 1 / depth is linear in screen space
+        px = pixel_columns + 0.5
+        py = pixel_rows + 0.5
+        tx, ty = x[chunk], y[chunk]
+        w0 = ((tx[:, 1] - px) * (ty[:, 2] - py) - (tx[:, 2] - px) * (ty[:, 1] - py)) / area[chunk]
+        w1 = ((tx[:, 2] - px) * (ty[:, 0] - py) - (tx[:, 0] - px) * (ty[:, 2] - py)) / area[chunk]
+        w2 = 1.0 - w0 - w1
+        inside = (w0 >= -1e-6) & (w1 >= -1e-6) & (w2 >= -1e-6)
+        weights = np.stack([w0, w1, w2], axis=1)[inside]
+        pixel_depth = 1.0 / np.einsum("ij,ij->i", weights, inverse_depth[chunk[inside]])
+        np.minimum.at(zbuffer, pixel_rows[inside] * resolution + pixel_columns[inside], pixel_depth)
+    return zbuffer
+
+
+def visible_faces(faces, camera, facing, resolution, fov=VIEW_FOV):
+    # Find the faces a view sees by testing their centers and corners against a depth buffer of the mesh
+    # Input: the world space face geometry returned by world_face_geometry, the (4, 4) camera to world matrix,
+    # a float32 numpy array of shape (F,) holding the cosine between every face normal and the direction to
+    # the camera, the width and height of the view in pixels, and the field of view in radians
+    # Output: an int64 numpy array holding the indices of the visible faces
+    # Back faces of the closed surfaces the views are rendered with always lie behind front faces, so only the
+    # front-facing triangles are rasterized; the render culls back faces to match
+    columns, rows, depth = project_points(faces["vertices"], camera, resolution, fov)
+    triangles = faces["triangles"][facing[faces["triangle_faces"]] > 0]
+    zbuffer = rasterize_depth(columns, rows, depth, triangles, resolution)
+
+    # A face is visible when any of its test points is not behind the depth buffer; only the test points of
+    # faces turned toward the camera are projected
+    front = facing > FACING_MIN
+    front_faces = np.flatnonzero(front)
+    front_corners = np.flatnonzero(front[faces["corner_faces"]])
+    points = np.concatenate([faces["centers"][front_faces], faces["corners"][front_corners]])
+    point_faces = np.concatenate([front_faces, faces["corner_faces"][front_corners]])
+    columns, rows, depth = project_points(points, camera, resolution, fov)
+    tested = np.flatnonzero((depth > 0) & (columns >= 0) & (columns < resolution) & (rows >= 0) & (rows < resolution))
+    depth = depth[tested]
+    pixels = rows[tested].astype(np.int64) * resolution + columns[tested].astype(np.int64)
+
+    # The depth buffer holds the depth at the pixel center, which differs from the depth of a point elsewhere
+    # in the pixel by the slope of its face, so the tolerance grows with the tangent of the viewing angle
+    cosine = facing[point_faces[tested]]
+    slope = np.sqrt(1.0 - np.minimum(cosine, 1.0) ** 2) / cosine
+    tolerance = DEPTH_TOLERANCE * depth / focal_length(resolution, fov) * slope + DEPTH_EPSILON * depth
+    return np.unique(point_faces[tested[depth <= zbuffer[pixels] + tolerance]])
+
+
+def world_face_geometry(mesh_index, matrix_world):
+    # Get the geometry of a mesh in world space that the views are projected with
+    # Input: a MeshIndex and the (4, 4) world matrix of the object
+    # Output: a dictionary with the vertices (V, 3), the triangles (T, 3) returned by MeshIndex.triangles and
+    # the face of every triangle (T,), the face centers and unit normals (F, 3), the face corners moved slightly
+    # toward their centers (L, 3), and the face of every corner (L,)
+    centers, normals, _ = mesh_index.face_geometry()
+    matrix = np.asarray(matrix_world, dtype=np.float32)
+    linear = matrix[:3, :3]
+    vertices = mesh_index.vertices @ linear.T + matrix[:3, 3]
+    centers = centers @ linear.T + matrix[:3, 3]
+
+    # Normals follow the inverse transpose so that non-uniform scale keeps them perpendicular to the faces
+    normals = normals @ np.linalg.inv(linear)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+
+    # Corners on the edge of a face would be tested against the depth of the faces next to it
+    corner_faces = np.repeat(np.arange(len(centers)), mesh_index.loop_totals)
+    corners = vertices[mesh_index.loop_vertices]
+    corners += CORNER_INSET * (centers[corner_faces] - corners)
+    return {
+        "vertices": vertices,
+        "triangles": mesh_index.triangles(),
+        "triangle_faces": np.repeat(np.arange(len(centers)), np.maximum(mesh_index.loop_totals - 2, 0)),
+        "centers": centers,
+        "normals": normals,
+        "corners": corners,
+        "corner_faces": corner_faces,
+    }
+
+
+def selection_prompts(mesh_index, selected):
+    # Turn a face selection into prompts, one per connected island of selected faces
+    # Input: a MeshIndex and a boolean numpy array of shape (F,) holding the selected faces
+    # Output: an int64 numpy array holding, for every island, the face closest to the center of the island
+    centers = mesh_index.face_geometry()[0]
+    graph = mesh_index.graph
+    remaining = selected.copy()
+    prompts = []
+    while remaining.any():
+        island = np.flatnonzero(blendersam_mesh_index.flood_fill(graph, [np.argmax(remaining)], allowed=selected))
+        island_centers = centers[island]
+        middle = island_centers.mean(axis=0)
+        prompts.append(island[np.argmin(np.sum((island_centers - middle) ** 2, axis=1))])
+        remaining[island] = False
+    return np.asarray(prompts, dtype=np.int64)
+
+
+def vote_view(embedding, decoder_path, camera, faces, prompt_faces, resolution, cutoff, fov=VIEW_FOV):
+    # Segment one view for the prompts it sees and find which visible faces every mask covers
+    # Input: the image embedding of the view, a string representing the path to the decoder checkpoint, the
+    # (4, 4) camera to world matrix, the world space face geometry returned by world_face_geometry, an int64
+    # numpy array holding the prompt faces, the width and height of the view in pixels, the logit cutoff,
+    # and the field of view in radians
+    # Output: an int64 numpy array holding the visible faces, a float32 numpy array holding how squarely
+    # each was seen, an int64 numpy array holding the prompts the view sees, a boolean numpy array of shape
+    # (prompts, visible faces) telling which faces every mask covers, and a float32 numpy array of mask scores
+    centers = faces["centers"]
+    columns, rows, _ = project_points(centers, camera, resolution, fov)
+    to_camera = camera[:3, 3].astype(np.float32) - centers
+    facing = np.einsum("ij,ij->i", faces["normals"], to_camera) / np.maximum(np.linalg.norm(to_camera, axis=1),
+                                                                             1e-12)
+    visible = visible_faces(faces, camera, facing, resolution, fov)
+
+    is_visible = np.zeros(len(centers), dtype=bool)
+    is_visible[visible] = True
+    prompt_ids = np.flatnonzero(is_visible[prompt_faces])
+    if len(prompt_ids) == 0:
+        return visible, facing[visible], prompt_ids, np.zeros((0, len(visible)), dtype=bool), np.zeros(0, np.float32)
+
+    # Prompt the decoder with the projected centers of the prompt faces and read the masks under the faces
+    seeds = prompt_faces[prompt_ids]
+    image_size = (resolution, resolution)
+    point_coords, point_labels = blendersam_runtime.prompts_to_tensors(
+        np.stack([columns[seeds], rows[seeds]], axis=1), "point", image_size)
+    logits, scores, _ = blendersam_runtime.decode_prompts(embedding, decoder_path, point_coords, point_labels,
+                                                          image_size)
+    pixel_rows = np.clip(rows[visible].astype(np.int64), 0, resolution - 1)
+    pixel_columns = np.clip(columns[visible].astype(np.int64), 0, resolution - 1)
+    hits = logits[:, pixel_rows, pixel_columns] > cutoff
+    return visible, facing[visible], prompt_ids, hits, scores
+
+
+def segment_views(images, cameras, faces, prompt_faces, encoder_path, decoder_path, threshold=0.5,
+                  fov=VIEW_FOV, workers=VIEW_WORKERS, graph=None, job=None, cache=None):
+    # Segment a mesh from rendered views by voting the masks of every view onto the faces
+    # Input: a list of numpy arrays of shape (R, R, C) holding the views with the top row first, a numpy
+    # array of shape (N, 4, 4) holding their camera to world matrices, the world space face geometry
+    # returned by world_face_geometry, an int64 numpy array holding the prompt faces, strings representing
+    # the paths to the encoder and decoder checkpoints, the threshold value for binarizing the masks, the
+    # field of view in radians, the number of views to decode at once, an optional FaceGraph that spreads the
+    # labels onto faces no view saw, an optional Job to report progress to, and an optional EmbeddingCache,
+    # which is left out by default since every rendered view is encoded once
+    # Output: an int32 numpy array of shape (F,) holding the prompt index of every face or -1, and a float32
+    # numpy array of shape (F,) holding the weighted share of the views that agreed on it
+    resolution = images[0].shape[0]
+    cutoff = blendersam_runtime.logit_threshold(threshold)
+    face_count = len(faces["centers"])
+
+    if job is not None:
+        job.report(0.05, "Encoding views")
+    with blendersam_profiling.span("encode_views", views=len(images)):
+        embeddings = blendersam_runtime.encode_images(images, encoder_path, cache)
+
+    # Every prompt keeps the weight of the views in which it covered a face and of all views it saw the face in,
+    # stored as one entry per prompt and visible face of every view
+    keys, seen_weights, vote_weights = [], [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(vote_view, embedding, decoder_path, camera, faces, prompt_faces, resolution, cutoff,
+                               fov)
+                   for embedding, camera in zip(embeddings, cameras)]
+
+        # Merge the views in order so that the result does not depend on which thread finished first
+        for view, future in enumerate(futures):
+            visible, weights, prompt_ids, hits, scores = future.result()
+            for prompt, hit, score in zip(prompt_ids, hits, scores):
+                keys.append(prompt * face_count + visible)
+                seen_weights.append(weights * score)
+                vote_weights.append(np.where(hit, weights * score, 0.0))
+            if job is not None:
+                job.report(0.1 + 0.8 * (view + 1) / len(futures), "Projecting views")
+
+    # Add up the entries of every prompt and face pair
+    face_labels = np.full(face_count, -1, dtype=np.int32)
+    agreement = np.zeros(face_count, dtype=np.float32)
+    seen_faces = np.zeros(face_count, dtype=bool)
+    if keys:
+        pairs, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        seen = np.bincount(inverse, weights=np.concatenate(seen_weights))
+        votes = np.bincount(inverse, weights=np.concatenate(vote_weights))
+        prompts, pair_faces = pairs // face_count, pairs % face_count
+        support = (votes / np.maximum(seen, 1e-12)).astype(np.float32)
+        seen_faces[pair_faces[seen > 0]] = True
+
+        # Every face takes the prompt with the largest share of agreeing views, the first prompt on a tie, if
+        # that share is large enough
+        order = np.lexsort((prompts, -support, pair_faces))
+        best = order[np.concatenate([[True], np.diff(pair_faces[order]) != 0])]
+        agreement[pair_faces[best]] = support[best]
+        agreed = best[support[best] >= VOTE_THRESHOLD]
+        face_labels[pair_faces[agreed]] = prompts[agreed]
+
+    # Faces hidden from every view take the labels of the faces around them
+    if graph is not None:
+        face_labels = blendersam_mesh_index.grow_regions(graph, face_labels, allowed=~seen_faces)
+    return face_labels, agreement
+
+
+def _set_engine(render, engine):
+    # Choose a render engine by its name in RENDER_ENGINES, whose identifiers differ between Blender versions
+    for identifier in RENDER_ENGINES[engine]:
+        try:
+            render.engine = identifier
+            return
+        except TypeError:
+            continue
+    raise RuntimeError(f"This Blender has no {engine} render engine")
+
+
+def render_views(scene, target, cameras, resolution, output_dir, engine="WORKBENCH", fov=VIEW_FOV, clip_end=1000.0):
+    # Render an object alone from every camera and save the views as PNG files
+    # Input: a blender scene, the blender object to render, a numpy array of shape (N, 4, 4) holding the camera
+    # to world matrices, the width and height of the views in pixels, a string representing the folder to
+    # write the views to, the name of the engine in RENDER_ENGINES, the field of view in radians, and the far
+    # clipping distance
+    # Output: a list of strings representing the paths to the rendered views
+    import bpy
+    from mathutils import Matrix
+
+    render = scene.render
+    saved = {name: getattr(render, name) for name in ("engine", "resolution_x", "resolution_y",
+                                                      "resolution_percentage", "filepath", "film_transparent")}
+    saved_format = (render.image_settings.file_format, render.image_settings.color_mode)
+    saved_camera = scene.camera
+    saved_color_type = scene.display.shading.color_type
+    saved_culling = scene.display.shading.show_backface_culling
+
+    # Hide the other geometry so that the views match the visibility test, which only knows the target
+    hidden = [obj for obj in scene.objects
+              if obj is not target and obj.type not in {"CAMERA", "LIGHT", "LIGHT_PROBE"} and not obj.hide_render]
+    camera_data = bpy.data.cameras.new("_blendersam_view")
+    camera_data.angle = fov
+    camera_data.clip_end = clip_end
+    camera_object = bpy.data.objects.new("_blendersam_view", camera_data)
+    scene.collection.objects.link(camera_object)
+
+    paths = []
+    try:
+        for obj in hidden:
+            obj.hide_render = True
+        scene.camera = camera_object
+        _set_engine(render, engine)
+        scene.display.shading.color_type = "TEXTURE"
+        scene.display.shading.show_backface_culling = True
+        render.resolution_x = resolution
+        render.resolution_y = resolution
+        render.resolution_percentage = 100
+        render.film_transparent = False
+        render.image_settings.file_format = "PNG"
+        render.image_settings.color_mode = "RGB"
+
+        for view, camera in enumerate(cameras):
+            camera_object.matrix_world = Matrix(camera.tolist())
+            render.filepath = os.path.join(output_dir, f"view_{view:03d}.png")
+            with blendersam_profiling.span("render_view", view=view):
+                bpy.ops.render.render(write_still=True)
+            paths.append(render.filepath)
+    finally:
+        for obj in hidden:
+            obj.hide_render = False
+        for name, value in saved.items():
+            setattr(render, name, value)
+        render.image_settings.file_format, render.image_settings.color_mode = saved_format
+        scene.camera = saved_camera
+        scene.display.shading.color_type = saved_color_type
+        scene.display.shading.show_backface_culling = saved_culling
+        bpy.data.objects.remove(camera_object)
+        bpy.data.cameras.remove(camera_data)
+    return paths
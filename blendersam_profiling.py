@@ -0,0 +1,233 @@
+# BlenderSAM instrumentation
+# Author: AmusedDiffuser
+
+"""
+Records where the time of a segmentation run goes. Instrumentation is off by default and costs a flag
+check when it is off. When it is on, every operator run collects spans for its stages and the hot paths
+inside them with wall time, CPU time, resident memory growth and the sizes of the tensors involved, and
+the last runs can be exported as Chrome trace files (chrome://tracing, Perfetto) or plain JSON.
+"""
+
+# Import the necessary modules
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Define some constants for the instrumentation
+MAX_RUNS = 10
+
+_enabled = False
+_runs = deque(maxlen=MAX_RUNS)
+_runs_lock = threading.Lock()
+_local = threading.local()
+
+
+def set_enabled(enabled):
+    # Turn the instrumentation on or off
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+def current_rss_mb():
+    # Get the resident memory of this process right now
+    # Input: None
+    # Output: a float in megabytes, or None where the platform does not report it
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm", "rb") as f:
+                pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return None
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        # PROCESS_MEMORY_COUNTERS from psapi.h
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.WorkingSetSize / 2 ** 20
+    return None
+
+
+def peak_rss_mb():
+    # Get the peak resident memory of this process over its whole lifetime
+    # Input: None
+    # Output: a float in megabytes, or None where the platform does not report it
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def describe(value):
+    # Turn a span argument into something JSON can store, reducing arrays to their shape, dtype and size
+    if isinstance(value, np.ndarray):
+        return {"shape": list(value.shape), "dtype": value.dtype.str, "mb": round(value.nbytes / 2 ** 20, 3)}
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+class Run:
+    # The spans recorded for one operator run, possibly on several threads
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self):
+        # Add up the spans of the run by name, in the order they first started
+        # Input: None
+        # Output: a list of dictionaries with the name, count, wall and CPU milliseconds, the largest growth of
+        # resident memory over one span, and the peak resident memory of the whole process at the end of the spans
+        rows = {}
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event["start_ns"])
+        for event in events:
+            row = rows.setdefault(event["name"], {"name": event["name"], "depth": event["depth"], "count": 0,
+                                                  "wall_ms": 0.0, "cpu_ms": 0.0, "rss_delta_mb": None,
+                                                  "process_peak_rss_mb": None})
+            row["count"] += 1
+            row["wall_ms"] += event["wall_ns"] / 1e6
+            row["cpu_ms"] += event["cpu_ns"] / 1e6
+            if event["rss_delta_mb"] is not None:
+                row["rss_delta_mb"] = max(row["rss_delta_mb"] if row["rss_delta_mb"] is not None else -np.inf,
+                                          event["rss_delta_mb"])
+            if event["process_peak_rss_mb"] is not None:
+                row["process_peak_rss_mb"] = max(row["process_peak_rss_mb"] or 0.0, event["process_peak_rss_mb"])
+        return list(rows.values())
+
+
+def start_run(name):
+    # Start recording an operator run
+    # Input: a string naming the run
+    # Output: a Run, or None when instrumentation is off
+    if not _enabled:
+        return None
+    run = Run(name)
+    with _runs_lock:
+        _runs.append(run)
+    return run
+
+
+def last_run():
+    # Get the most recent run
+    with _runs_lock:
+        return _runs[-1] if _runs else None
+
+
+@contextmanager
+def span(name, **args):
+    # Record one span into the run of the current stage
+    # Input: a string naming the span and keyword arguments to store with it; arrays are stored by size
+    # Output: yields a dictionary the body can add more arguments to, for example output tensors
+    run = getattr(_local, "run", None)
+    info = dict(args)
+    if run is None or not _enabled:
+        yield info
+        return
+
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    start_rss = current_rss_mb()
+    start_ns = time.perf_counter_ns()
+    start_cpu_ns = time.thread_time_ns()
+    try:
+        yield info
+    finally:
+        _local.depth = depth
+        end_rss = current_rss_mb()
+        run.add({
+            "name": name,
+            "depth": depth,
+            "thread": threading.get_ident(),
+            "start_ns": start_ns,
+            "wall_ns": time.perf_counter_ns() - start_ns,
+            "cpu_ns": time.thread_time_ns() - start_cpu_ns,
+            "rss_delta_mb": None if start_rss is None or end_rss is None else end_rss - start_rss,
+            "process_peak_rss_mb": peak_rss_mb(),
+            "args": {key: describe(value) for key, value in info.items()},
+        })
+
+
+@contextmanager
+def stage(run, name, **args):
+    # Record one operator stage and make its run the target of the spans recorded inside it on this thread
+    # Input: a Run returned by start_run (or None), a string naming the stage, and arguments to store with it
+    # Output: yields the span's argument dictionary
+    if run is None:
+        yield dict(args)
+        return
+    previous = getattr(_local, "run", None)
+    _local.run = run
+    try:
+        with span(name, **args) as info:
+            yield info
+    finally:
+        _local.run = previous
+
+
+def export_chrome_trace(run, path):
+    # Write a run as a Chrome trace file
+    # Input: a Run and a string representing the output path
+    # Output: None
+    events = []
+    with run._lock:
+        for event in run.events:
+            args = dict(event["args"])
+            args["cpu_ms"] = event["cpu_ns"] / 1e6
+            args["rss_delta_mb"] = event["rss_delta_mb"]
+            args["process_peak_rss_mb"] = event["process_peak_rss_mb"]
+            events.append({
+                "name": event["name"],
+                "cat": run.name,
+                "ph": "X",
+                "ts": event["start_ns"] / 1e3,
+                "dur": event["wall_ns"] / 1e3,
+                "pid": os.getpid(),
+                "tid": event["thread"],
+                "args": args,
+            })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def export_json(run, path, extra=None):
+    # Write a run with its summary as plain JSON
+    # Input: a Run, a string representing the output path, and an optional dictionary of extra statistics
+    # Output: None
+    with run._lock:
+        events = list(run.events)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"name": run.name, "started": run.started, "summary": run.summary(), "events": events,
+                   **(extra or {})}, f, indent=2)
@@ -0,0 +1,200 @@
+# BlenderSAM model quantization and runtime comparison
+# Author: AmusedDiffuser
+
+"""
+Produces smaller variants of the encoder and decoder checkpoints and measures what they cost. Dynamic
+int8 quantization and fp16 conversion write new checkpoints next to the fp32 ones, and the comparison
+mode runs every variant under a runtime profile in a fresh process, reporting latency, peak memory and
+the mask IoU against the fp32 baseline so that a profile can be chosen per machine.
+
+Run it without Blender, for example:
+    python blendersam_quantize.py quantize --encoder sam_encoder.onnx --decoder sam_decoder.onnx
+    python blendersam_quantize.py compare --encoder sam_encoder.onnx --decoder sam_decoder.onnx --image test.png
+"""
+
+# Import the necessary modules
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Define some constants for the comparison
+COMPARE_POINTS_PER_SIDE = 8
+COMPARE_REPEATS = 3
+
+
+def quantize_int8(model_path, output_path=None):
+    # Quantize the weights of a checkpoint to int8, computing activation ranges at run time
+    # Input: a string representing the path to the fp32 checkpoint and an optional output path
+    # Output: a string representing the path to the int8 checkpoint
+    import blendersam_runtime
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_path = output_path or blendersam_runtime.variant_path(model_path, "int8")
+    quantize_dynamic(model_path, output_path, per_channel=False, reduce_range=False, weight_type=QuantType.QUInt8)
+    return output_path
+
+
+def convert_fp16(model_path, output_path=None):
+    # Convert the weights and activations of a checkpoint to fp16, keeping fp32 inputs and outputs
+    # Input: a string representing the path to the fp32 checkpoint and an optional output path
+    # Output: a string representing the path to the fp16 checkpoint; raises RuntimeError without the onnx and
+    # onnxconverter-common packages
+    import blendersam_runtime
+
+    try:
+        import onnx
+        from onnxconverter_common import float16
+    except ImportError as e:
+        raise RuntimeError("fp16 conversion needs the onnx and onnxconverter-common packages") from e
+
+    output_path = output_path or blendersam_runtime.variant_path(model_path, "fp16")
+    model = float16.convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+    onnx.save(model, output_path)
+    return output_path
+
+
+def quantize_models(encoder_path, decoder_path, precisions=("int8", "fp16")):
+    # Write the requested variants of both checkpoints
+    # Input: strings representing the paths to the fp32 encoder and decoder and the precisions to produce
+    # Output: a dictionary mapping every precision to its (encoder path, decoder path)
+    converters = {"int8": quantize_int8, "fp16": convert_fp16}
+    variants = {}
+    for precision in precisions:
+        variants[precision] = (converters[precision](encoder_path), converters[precision](decoder_path))
+        print(f"Wrote {precision} variants: {variants[precision][0]}, {variants[precision][1]}")
+    return variants
+
+
+def measure_variant(image_path, encoder_path, decoder_path, profile, threshold=0.5,
+                    points_per_side=COMPARE_POINTS_PER_SIDE, repeats=COMPARE_REPEATS):
+    # Time one model variant on an image; meant to run in its own process so that peak memory is its own
+    # Input: strings representing the paths to the image and the checkpoints, the runtime profile name, the
+    # threshold value for binarizing the masks, the grid density, and the number of timed runs
+    # Output: a dictionary with the median encoder and decoder latencies in milliseconds, the peak memory in
+    # megabytes, and the run-length encoded masks of the point grid
+    import blendersam_automask
+    import blendersam_batch
+    import blendersam_profiling
+    import blendersam_runtime
+
+    blendersam_runtime.set_runtime_profile(profile)
+    image = blendersam_batch.read_image(image_path)
+    image_size = image.shape[:2]
+    points = blendersam_runtime.point_grid(points_per_side, image_size)
+    point_coords, point_labels = blendersam_runtime.prompts_to_tensors(points, "point", image_size)
+
+    # The first run creates the sessions and is left out of the timings
+    encode_times, decode_times = [], []
+    for run in range(repeats + 1):
+        start = time.perf_counter()
+        embedding = blendersam_runtime.encode_image(image, encoder_path, cache=None)
+        encoded = time.perf_counter()
+        logits, _, _ = blendersam_runtime.decode_prompts(embedding, decoder_path, point_coords, point_labels,
+                                                         image_size)
+        decoded = time.perf_counter()
+        if run > 0:
+            encode_times.append((encoded - start) * 1000.0)
+            decode_times.append((decoded - encoded) * 1000.0)
+
+    cutoff = blendersam_runtime.logit_threshold(threshold)
+    return {
+        "encoder_ms": float(np.median(encode_times)),
+        "decoder_ms": float(np.median(decode_times)),
+        "peak_memory_mb": blendersam_profiling.peak_rss_mb(),
+        "rles": [blendersam_automask.rle_encode(mask) for mask in logits > cutoff],
+    }
+
+
+def mean_iou(rles, baseline_rles):
+    # Compare the masks of a variant with the masks of the baseline prompt by prompt
+    # Input: two lists of run-length encoded masks for the same prompts
+    # Output: a float representing the mean IoU; prompts where both masks are empty count as a perfect match
+    import blendersam_automask
+
+    ious = []
+    for rle, baseline in zip(rles, baseline_rles):
+        intersection = blendersam_automask.rle_intersection(rle, baseline)
+        union = blendersam_automask.rle_area(rle) + blendersam_automask.rle_area(baseline) - intersection
+        ious.append(intersection / union if union else 1.0)
+    return float(np.mean(ious)) if ious else 1.0
+
+
+def compare_variants(image_path, encoder_path, decoder_path, precisions=("fp32", "int8", "fp16"),
+                     profiles=("default",), threshold=0.5):
+    # Measure every available variant under every runtime profile against the fp32 baseline
+    # Input: strings representing the paths to the image and the fp32 checkpoints, the precisions and
+    # runtime profiles to compare, and the threshold value for binarizing the masks
+    # Output: a list of dictionaries, one per measured (precision, profile) pair
+    import blendersam_runtime
+
+    # Every measurement gets a fresh process so that sessions and peak memory never carry over
+    context = multiprocessing.get_context("spawn")
+    results = []
+    baselines = {}
+    for profile in profiles:
+        for precision in ("fp32",) + tuple(p for p in precisions if p != "fp32"):
+            encoder = blendersam_runtime.variant_path(encoder_path, precision)
+            decoder = blendersam_runtime.variant_path(decoder_path, precision)
+            if not (os.path.isfile(encoder) and os.path.isfile(decoder)):
+                print(f"Skipping {precision}: run the quantize command first")
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                measured = pool.submit(measure_variant, image_path, encoder, decoder, profile, threshold).result()
+
+            rles = measured.pop("rles")
+            if precision == "fp32":
+                baselines[profile] = rles
+            measured["mask_iou"] = mean_iou(rles, baselines[profile]) if profile in baselines else None
+            results.append({"precision": precision, "profile": profile, **measured})
+    return results
+
+
+def print_comparison(results):
+    # Print comparison results as a table
+    print(f"{'precision':<10}{'profile':<16}{'encoder ms':>12}{'decoder ms':>12}{'peak MB':>10}{'mask IoU':>10}")
+    for result in results:
+        peak = "n/a" if result["peak_memory_mb"] is None else f"{result['peak_memory_mb']:.0f}"
+        iou = "n/a" if result["mask_iou"] is None else f"{result['mask_iou']:.4f}"
+        print(f"{result['precision']:<10}{result['profile']:<16}{result['encoder_ms']:>12.1f}"
+              f"{result['decoder_ms']:>12.1f}{peak:>10}{iou:>10}")
+
+
+def main():
+    import blendersam_runtime
+
+    parser = argparse.ArgumentParser(description="Quantize BlenderSAM checkpoints and compare runtime profiles")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    quantize_parser = commands.add_parser("quantize", help="Write int8 and fp16 variants of the checkpoints")
+    quantize_parser.add_argument("--encoder", required=True, help="The fp32 image encoder checkpoint")
+    quantize_parser.add_argument("--decoder", required=True, help="The fp32 mask decoder checkpoint")
+    quantize_parser.add_argument("--precisions", nargs="+", default=["int8", "fp16"], choices=["int8", "fp16"])
+
+    compare_parser = commands.add_parser("compare", help="Measure latency, peak memory and mask IoU per variant")
+    compare_parser.add_argument("--encoder", required=True, help="The fp32 image encoder checkpoint")
+    compare_parser.add_argument("--decoder", required=True, help="The fp32 mask decoder checkpoint")
+    compare_parser.add_argument("--image", required=True, help="The image to segment")
+    compare_parser.add_argument("--precisions", nargs="+", default=list(blendersam_runtime.MODEL_PRECISIONS),
+                                choices=blendersam_runtime.MODEL_PRECISIONS)
+    compare_parser.add_argument("--profiles", nargs="+", default=["default"],
+                                choices=sorted(blendersam_runtime.RUNTIME_PROFILES))
+    compare_parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        quantize_models(args.encoder, args.decoder, args.precisions)
+    else:
+        results = compare_variants(args.image, args.encoder, args.decoder, args.precisions, args.profiles)
+        print_comparison(results)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,568 @@
+# BlenderSAM runtime helpers
+# Author: AmusedDiffuser
+
+"""
+Long-lived model state for the BlenderSAM addon. ONNX Runtime sessions are created once per model
+checkpoint and kept alive for the lifetime of the addon, and image embeddings produced by the image
+encoder are cached by image content and model so that re-running segmentation on a known image skips
+the encoder completely. Embeddings are kept in RAM with least-recently-used eviction and backed by
+memory-mapped .npy files on disk. Sessions are created with the active runtime profile, which sets the
+thread counts, graph optimization level, memory arena and execution providers.
+"""
+
+# Import the necessary modules
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import blendersam_image_io
+import blendersam_profiling
+
+_logger = logging.getLogger(__name__)
+
+# Define some constants for the runtime
+ENCODER_SIZE = 1024
+ENCODER_BATCH = 4
+PIXEL_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+PIXEL_STD = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "blendersam_cache")
+CACHE_SIZE = 8
+DISK_CACHE_MB = 1024
+
+# Define the runtime profiles; a thread count of 0 lets ONNX Runtime use every core
+RUNTIME_PROFILES = {
+    "default": {},
+    "cpu_throughput": {"intra_op_threads": 0, "inter_op_threads": 1, "optimization": "all", "memory_arena": True,
+                       "providers": ["CPUExecutionProvider"]},
+    "cpu_low_memory": {"intra_op_threads": 2, "inter_op_threads": 1, "optimization": "extended",
+                       "memory_arena": False, "providers": ["CPUExecutionProvider"]},
+    "gpu": {"optimization": "all", "providers": ["CUDAExecutionProvider", "DmlExecutionProvider",
+                                                  "CoreMLExecutionProvider", "CPUExecutionProvider"]},
+}
+OPTIMIZATION_LEVELS = {
+    "disabled": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+MODEL_PRECISIONS = ("fp32", "int8", "fp16")
+
+# Sessions are keyed by absolute model path and runtime profile and remember the file's modification time;
+# every key also gets a lock that is held while its session loads
+_sessions = {}
+_loading = {}
+_sessions_lock = threading.Lock()
+_profile = {"name": "default", "settings": {}}
+
+
+def set_runtime_profile(name="default", **overrides):
+    # Choose the runtime profile used for every session created from now on
+    # Input: the name of a profile in RUNTIME_PROFILES and optional settings that override it
+    # (intra_op_threads, inter_op_threads, optimization, memory_arena, providers)
+    # Output: None; raises ValueError for an unknown profile or optimization level
+    if name not in RUNTIME_PROFILES:
+        raise ValueError(f"Unknown runtime profile: {name}")
+    settings = dict(RUNTIME_PROFILES[name])
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    if settings.get("optimization", "all") not in OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown optimization level: {settings['optimization']}")
+    with _sessions_lock:
+        _profile["name"] = name
+        _profile["settings"] = settings
+
+
+def session_options(settings):
+    # Turn runtime profile settings into ONNX Runtime session options and execution providers
+    # Input: a dictionary of profile settings
+    # Output: an onnxruntime.SessionOptions and a list of the requested providers that are available
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if "intra_op_threads" in settings:
+        options.intra_op_num_threads = settings["intra_op_threads"]
+    if "inter_op_threads" in settings:
+        options.inter_op_num_threads = settings["inter_op_threads"]
+    if "optimization" in settings:
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel,
+                                                   OPTIMIZATION_LEVELS[settings["optimization"]])
+    if "memory_arena" in settings:
+        options.enable_cpu_mem_arena = settings["memory_arena"]
+        options.enable_mem_pattern = settings["memory_arena"]
+
+    # Skip the providers this build of ONNX Runtime does not have, falling back to the CPU
+    available = ort.get_available_providers()
+    providers = [provider for provider in settings.get("providers", available) if provider in available]
+    return options, providers or ["CPUExecutionProvider"]
+
+
+def variant_path(model_path, precision):
+    # Get the path of a quantized variant of a model checkpoint
+    # Input: a string representing the path to the fp32 checkpoint and a precision in MODEL_PRECISIONS
+    # Output: a string representing the path to the variant, e.g. encoder.int8.onnx next to encoder.onnx
+    if precision == "fp32":
+        return model_path
+    root, extension = os.path.splitext(model_path)
+    return f"{root}.{precision}{extension or '.onnx'}"
+
+
+def get_session(model_path):
+    # Get the ONNX Runtime session for a model checkpoint, creating it on first use
+    # Input: a string representing the path to the model checkpoint
+    # Output: an onnxruntime.InferenceSession shared by every caller using the same checkpoint and profile
+    import onnxruntime as ort
+
+    # Check if the model path is valid and exists
+    model_path = os.path.abspath(model_path)
+    if not os.path.isfile(model_path):
+        raise FileNotFoundError("Model checkpoint not found")
+
+    # Reuse the existing session unless the checkpoint was replaced on disk
+    mtime = os.path.getmtime(model_path)
+    with _sessions_lock:
+        settings = _profile["settings"]
+        key = (model_path, repr(sorted(settings.items())))
+        entry = _sessions.get(key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        loading = _loading.setdefault(key, threading.Lock())
+
+    # Load the model outside the shared lock, which can take seconds, so that other threads keep finding the
+    # sessions of other models; the lock of the key keeps two threads from loading the same checkpoint
+    with loading:
+        with _sessions_lock:
+            entry = _sessions.get(key)
+        if entry is None or entry[0] != mtime:
+            options, providers = session_options(settings)
+            session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+            with _sessions_lock:
+                entry = _sessions.get(key)
+                if entry is None or entry[0] != mtime:
+                    entry = (mtime, session)
+                    _sessions[key] = entry
+        return entry[1]
+
+
+def warm_up(model_paths):
+    # Import the inference dependencies and create the sessions of some checkpoints on a background thread,
+    # so that the first segmentation does not pay for them
+    # Input: a list of strings representing the paths to the checkpoints; missing paths are skipped
+    # Output: the started daemon threading.Thread
+    def run():
+        try:
+            import cv2  # noqa: F401
+            for model_path in model_paths:
+                if model_path and os.path.isfile(model_path):
+                    get_session(model_path)
+        except Exception:
+            # ONNX Runtime errors share no common base class; the first real use reports the same error
+            pass
+
+    thread = threading.Thread(target=run, name="blendersam-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def release_sessions():
+    # Drop every cached session so that ONNX Runtime can free the model weights
+    # Input: None
+    # Output: None
+    with _sessions_lock:
+        _sessions.clear()
+
+
+def model_fingerprint(model_path):
+    # Identify a model checkpoint by its path, size and modification time
+    # Input: a string representing the path to the model checkpoint
+    # Output: a short hex string that changes whenever the checkpoint changes
+    stat = os.stat(model_path)
+    token = f"{os.path.abspath(model_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def image_fingerprint(image_array):
+    # Identify an image by its pixel content
+    # Input: a numpy array holding the image pixels
+    # Output: a hex string that only depends on the shape, dtype and values of the pixels
+    # Hash row-flipped views in storage order so that hashing never copies the pixels
+    if image_array.strides[0] < 0:
+        image_array = image_array[::-1]
+    image_array = np.ascontiguousarray(image_array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((image_array.shape, image_array.dtype.str)).encode("utf-8"))
+    digest.update(memoryview(image_array).cast("B"))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    # A two-level cache of image embeddings keyed by image content hash plus model fingerprint
+    # RAM holds the most recently used embeddings, disk holds the embeddings used last as .npy files that are
+    # memory-mapped back in on a RAM miss, up to a size bound past which the least recently used files go
+
+    def __init__(self, cache_dir=CACHE_DIR, max_items=CACHE_SIZE, max_disk_mb=DISK_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_disk_mb = max_disk_mb
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, image_array, model_path):
+        # Build the cache key for an image and model pair
+        # Input: a numpy array holding the image pixels and a string representing the model path
+        # Output: a string usable as a dictionary key and a file name
+        return f"{model_fingerprint(model_path)}_{image_fingerprint(image_array)}"
+
+    def _file_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key):
+        # Look up an embedding in RAM first and on disk second
+        # Input: a string returned by EmbeddingCache.key
+        # Output: a numpy array holding the embedding, or None if it is not cached
+        with self._lock:
+            embedding = self._items.get(key)
+            if embedding is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return embedding
+
+        file_path = self._file_path(key)
+        if os.path.isfile(file_path):
+            try:
+                # Memory-map the file so that only the pages the decoder touches are read, and mark it as used
+                embedding = np.load(file_path, mmap_mode="r")
+                os.utime(file_path)
+            except (OSError, ValueError) as e:
+                _logger.warning("Cannot load cached embedding %s: %s", file_path, e)
+            else:
+                self._remember(key, embedding)
+                with self._lock:
+                    self.hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, embedding):
+        # Store an embedding in RAM and write it to disk
+        # Input: a string returned by EmbeddingCache.key and a numpy array holding the embedding
+        # Output: None
+        self._remember(key, embedding)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so that a crash never leaves a truncated .npy behind
+            file_path = self._file_path(key)
+            temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(embedding))
+            os.replace(temp_path, file_path)
+            self._prune()
+        except OSError as e:
+            _logger.warning("Cannot save cached embedding %s: %s", key, e)
+
+    def _prune(self):
+        # Delete the least recently used embedding files until the disk tier fits in its size bound
+        # Label maps and temporary files that share the folder are left alone
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy") and not entry.name.startswith("labels_"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        budget = self.max_disk_mb * 2 ** 20
+        for _, size, file_path in sorted(files):
+            if total <= budget:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                # A file that is still memory-mapped cannot be deleted on every platform
+                continue
+            total -= size
+
+    def _remember(self, key, embedding):
+        with self._lock:
+            self._items[key] = embedding
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self, remove_files=False):
+        # Empty the RAM cache and optionally delete the files on disk
+        # Input: a boolean telling whether the .npy files should be deleted as well
+        # Output: None
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+        if remove_files and os.path.isdir(self.cache_dir):
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(".npy") and not file_name.startswith("labels_"):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+
+# The cache shared by every operator of the addon
+embedding_cache = EmbeddingCache()
+
+
+def preprocess_image(image_array):
+    # Convert an image to the input layout of the image encoder
+    # Input: a numpy array of shape (H, W, 3) or (H, W, 4), either uint8 or float with values in [0, 1]
+    # Output: a float32 numpy array of shape (1, 3, ENCODER_SIZE, ENCODER_SIZE) that is reused by the next
+    # call on the same thread
+    import cv2
+
+    # Resize the longest side to the encoder size in storage order, keeping the aspect ratio
+    source, flipped = blendersam_image_io.storage_order(image_array)
+    height, width = source.shape[:2]
+    scale = ENCODER_SIZE / max(height, width)
+    new_width, new_height = int(width * scale + 0.5), int(height * scale + 0.5)
+    resized = cv2.resize(source, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    if flipped:
+        resized = resized[::-1]
+
+    # Fold the [0, 1] to [0, 255] conversion into the normalization constants
+    value_scale = 1.0 if resized.dtype == np.uint8 else 255.0
+    mean = (PIXEL_MEAN / value_scale)[:, None, None]
+    std = (PIXEL_STD / value_scale)[:, None, None]
+
+    # Normalize straight into the reused input tensor and zero the padding on the bottom and right sides
+    tensor = blendersam_image_io.get_buffer("encoder", (1, 3, ENCODER_SIZE, ENCODER_SIZE))
+    target = tensor[0, :, :new_height, :new_width]
+    np.subtract(resized[..., :3].transpose(2, 0, 1), mean, out=target)
+    np.divide(target, std, out=target)
+    tensor[0, :, new_height:, :] = 0.0
+    tensor[0, :, :new_height, new_width:] = 0.0
+    return tensor
+
+
+def encode_image(image_array, model_path, cache=embedding_cache):
+    # Get the image embedding for an image, running the image encoder only on a cache miss
+    # Input: a numpy array holding the image pixels, a string representing the path to the encoder
+    # checkpoint, and an EmbeddingCache (or None to always run the encoder)
+    # Output: a numpy array holding the image embedding
+    key = None
+    if cache is not None:
+        key = cache.key(image_array, model_path)
+        embedding = cache.get(key)
+        if embedding is not None:
+            return embedding
+
+    session = get_session(model_path)
+    input_name = session.get_inputs()[0].name
+    with blendersam_profiling.span("preprocess_image", image=image_array):
+        tensor = preprocess_image(image_array)
+    with blendersam_profiling.span("encoder", input=tensor) as info:
+        embedding = session.run(None, {input_name: tensor})[0]
+        info["output"] = embedding
+
+    if cache is not None:
+        cache.put(key, embedding)
+    return embedding
+
+
+def encode_images(image_arrays, model_path, cache=embedding_cache, batch_size=ENCODER_BATCH):
+    # Get the image embeddings for several images, running the image encoder on batches of the cache misses
+    # Input: a sequence of numpy arrays holding the image pixels, a string representing the path to the
+    # encoder checkpoint, an EmbeddingCache (or None to always run the encoder), and the number of images
+    # to send through the encoder per call
+    # Output: a list holding the image embedding of every image, each with a batch dimension of one
+    embeddings = [None] * len(image_arrays)
+    keys = [None] * len(image_arrays)
+    missing = []
+    for i, image_array in enumerate(image_arrays):
+        if cache is not None:
+            keys[i] = cache.key(image_array, model_path)
+            embeddings[i] = cache.get(keys[i])
+        if embeddings[i] is None:
+            missing.append(i)
+    if not missing:
+        return embeddings
+
+    # Checkpoints exported with a fixed batch size are run with that many images at a time
+    session = get_session(model_path)
+    model_input = session.get_inputs()[0]
+    if isinstance(model_input.shape[0], int):
+        batch_size = min(batch_size, model_input.shape[0])
+
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        tensor = np.empty((len(batch), 3, ENCODER_SIZE, ENCODER_SIZE), dtype=np.float32)
+        with blendersam_profiling.span("preprocess_image", images=len(batch)):
+            for row, i in enumerate(batch):
+                # preprocess_image reuses its output buffer, so copy every image out of it
+                tensor[row] = preprocess_image(image_arrays[i])[0]
+        with blendersam_profiling.span("encoder", input=tensor) as info:
+            output = session.run(None, {model_input.name: tensor})[0]
+            info["output"] = output
+
+        for row, i in enumerate(batch):
+            embeddings[i] = output[row:row + 1]
+            if cache is not None:
+                cache.put(keys[i], embeddings[i])
+    return embeddings
+
+
+# Define some constants for the mask decoder
+DECODER_BATCH = 64
+LOW_RES_SIZE = 256
+
+
+def logit_threshold(threshold):
+    # Convert a probability threshold into the equivalent threshold on mask logits
+    # Input: a float in [0, 1] representing the threshold value for binarizing the masks
+    # Output: a float that can be compared directly with the decoder's mask logits
+    threshold = min(max(threshold, 1e-6), 1.0 - 1e-6)
+    return float(np.log(threshold / (1.0 - threshold)))
+
+
+def prompts_to_tensors(points_or_boxes, model_type, image_size):
+    # Convert points or boxes in image pixels into the prompt tensors of the mask decoder
+    # Input: an array-like of shape (N, 2) holding points or (N, 4) holding boxes as (x, y) pixels,
+    # a string representing the prompt type ("point" or "box"), and the (H, W) size of the image
+    # Output: a float32 numpy array of shape (N, 2, 2) holding the prompt coordinates in encoder space,
+    # and a float32 numpy array of shape (N, 2) holding the matching point labels
+    prompts = np.asarray(points_or_boxes, dtype=np.float32)
+    prompts = prompts.reshape(len(prompts), -1)
+    count = len(prompts)
+
+    coords = np.zeros((count, 2, 2), dtype=np.float32)
+    labels = np.empty((count, 2), dtype=np.float32)
+    if model_type == "box":
+        # A box is encoded as its top-left and bottom-right corners with labels 2 and 3
+        coords[:] = prompts[:, :4].reshape(count, 2, 2)
+        labels[:] = (2.0, 3.0)
+    else:
+        # A point is a foreground click followed by the padding point the decoder expects without a box
+        coords[:, 0] = prompts[:, :2]
+        labels[:] = (1.0, -1.0)
+
+    coords *= ENCODER_SIZE / max(image_size)
+    return coords, labels
+
+
+def points_to_tensors(points, labels, image_size, box=None):
+    # Convert the points of one multi-point prompt into the prompt tensors of the mask decoder
+    # Input: an array-like of shape (P, 2) holding (x, y) pixels, an array-like of shape (P,) holding 1 for
+    # foreground and 0 for background points, the (H, W) size of the image, and an optional (x0, y0, x1, y1) box
+    # Output: a float32 numpy array of shape (1, K, 2) holding the coordinates in encoder space and a float32
+    # numpy array of shape (1, K) holding the matching point labels
+    coords = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    point_labels = np.asarray(labels, dtype=np.float32).reshape(-1)
+    if box is not None:
+        # A box adds its top-left and bottom-right corners with labels 2 and 3
+        coords = np.concatenate([coords, np.asarray(box, dtype=np.float32).reshape(2, 2)])
+        point_labels = np.concatenate([point_labels, [2.0, 3.0]])
+    else:
+        # Without a box the decoder expects a padding point
+        coords = np.concatenate([coords, np.zeros((1, 2), dtype=np.float32)])
+        point_labels = np.concatenate([point_labels, [-1.0]])
+    coords = coords * (ENCODER_SIZE / max(image_size))
+    return coords[None].astype(np.float32), point_labels[None].astype(np.float32)
+
+
+def point_grid(points_per_side, image_size):
+    # Place an evenly spaced grid of points over an image
+    # Input: an integer representing the number of points along each side and the (H, W) size of the image
+    # Output: a float32 numpy array of shape (points_per_side ** 2, 2) holding (x, y) pixel coordinates
+    height, width = image_size
+    offsets = (np.arange(points_per_side, dtype=np.float32) + 0.5) / points_per_side
+    xs, ys = np.meshgrid(offsets * width, offsets * height)
+    return np.stack([xs.ravel(), ys.ravel()], axis=1)
+
+
+def iter_decode(image_embedding, decoder_path, point_coords, point_labels, image_size,
+                mask_input=None, batch_size=DECODER_BATCH):
+    # Run the light mask decoder for many prompts against one image embedding, one batch at a time
+    # Input: a numpy array holding the image embedding, a string representing the path to the decoder
+    # checkpoint, the prompt tensors returned by prompts_to_tensors, the (H, W) size of the image,
+    # an optional float32 numpy array of shape (N, 1, 256, 256) holding previous low resolution mask logits,
+    # and the number of prompts to send through the decoder per call
+    # Output: yields the index of the first prompt in the batch, a float32 numpy array of shape (B, H, W)
+    # holding the mask logits, a float32 numpy array of shape (B,) holding the predicted IoU scores, and a
+    # float32 numpy array of shape (B, 1, 256, 256) holding the low resolution mask logits
+    session = get_session(decoder_path)
+    height, width = image_size
+    feeds = {
+        "image_embeddings": np.asarray(image_embedding, dtype=np.float32),
+        "has_mask_input": np.array([0.0 if mask_input is None else 1.0], dtype=np.float32),
+        "orig_im_size": np.array([height, width], dtype=np.float32),
+    }
+
+    for start in range(0, len(point_coords), batch_size):
+        stop = min(start + batch_size, len(point_coords))
+        feeds["point_coords"] = point_coords[start:stop]
+        feeds["point_labels"] = point_labels[start:stop]
+        if mask_input is None:
+            feeds["mask_input"] = np.zeros((stop - start, 1, LOW_RES_SIZE, LOW_RES_SIZE), dtype=np.float32)
+        else:
+            feeds["mask_input"] = np.asarray(mask_input[start:stop], dtype=np.float32)
+
+        with blendersam_profiling.span("decoder", prompts=feeds["point_coords"]) as info:
+            batch_masks, batch_scores, batch_low_res = session.run(None, feeds)
+            info["masks"] = batch_masks
+        yield start, batch_masks[:, 0], batch_scores[:, 0], batch_low_res[:, :1]
+
+
+def decode_prompts(image_embedding, decoder_path, point_coords, point_labels, image_size,
+                   mask_input=None, batch_size=DECODER_BATCH):
+    # Run the light mask decoder for many prompts against one image embedding
+    # Input: the same arguments as iter_decode
+    # Output: a float32 numpy array of shape (N, H, W) holding the mask logits, a float32 numpy array of
+    # shape (N,) holding the predicted IoU scores, and a float32 numpy array of shape (N, 1, 256, 256)
+    # holding the low resolution mask logits
+    count = len(point_coords)
+    height, width = image_size
+
+    # Preallocate the outputs so that every batch writes into place
+    masks = np.empty((count, height, width), dtype=np.float32)
+    scores = np.empty(count, dtype=np.float32)
+    low_res_masks = np.empty((count, 1, LOW_RES_SIZE, LOW_RES_SIZE), dtype=np.float32)
+
+    # Send all prompts through the decoder as a few batched tensor calls
+    for start, batch_masks, batch_scores, batch_low_res in iter_decode(
+            image_embedding, decoder_path, point_coords, point_labels, image_size, mask_input, batch_size):
+        stop = start + len(batch_scores)
+        masks[start:stop] = batch_masks
+        scores[start:stop] = batch_scores
+        low_res_masks[start:stop] = batch_low_res
+
+    return masks, scores, low_res_masks
+
+
+def segment_prompts(image_array, encoder_path, decoder_path, points_or_boxes, model_type,
+                    threshold=0.5, confidence=0.0, cache=embedding_cache):
+    # Segment an image for a set of prompts with one encoder pass and one batched decoder pass
+    # Input: a numpy array of shape (H, W, C) holding the image pixels with the top row first, strings
+    # representing the paths to the encoder and decoder checkpoints, an array-like of points or boxes,
+    # a string representing the prompt type, the threshold value for binarizing the masks, the confidence
+    # value for filtering out low-confidence masks, and the EmbeddingCache to use
+    # Output: a boolean numpy array of shape (N, H, W) holding the kept masks and a float32 numpy array of
+    # shape (N,) holding their scores
+    image_size = image_array.shape[:2]
+    image_embedding = encode_image(image_array, encoder_path, cache)
+    point_coords, point_labels = prompts_to_tensors(points_or_boxes, model_type, image_size)
+    logits, scores, _ = decode_prompts(image_embedding, decoder_path, point_coords, point_labels, image_size)
+
+    # Filter out low-confidence masks and binarize the rest
+    keep = scores >= confidence
+    return logits[keep] > logit_threshold(threshold), scores[keep]
+
+
+def label_colors(count):
+    # Generate a distinct RGBA color for each label
+    # Input: an integer representing the number of labels
+    # Output: a float32 numpy array of shape (count, 4) with values in [0, 1]
+    import colorsys
+
+    hues = (np.arange(count) * 0.618033988749895) % 1.0
+    colors = np.ones((count, 4), dtype=np.float32)
+    colors[:, :3] = [colorsys.hsv_to_rgb(hue, 0.65, 0.95) for hue in hues]
+    return colors
@@ -0,0 +1,478 @@
+# BlenderSAM image sequence segmentation
+# Author: AmusedDiffuser
+
+"""
+Segments the frames of a shot in order, for example a rotoscoping plate with thousands of frames. Frames
+are streamed from a directory of images or a movie file through a bounded prefetch queue, the instances
+found in the first frame keep their ids for the whole shot because every frame's masks become the box,
+point and mask prompts of the next frame, and a cheap thumbnail difference decides whether a frame needs
+the image encoder, can reuse the last embedding, or can reuse the last label map outright. Every frame is
+written as a label map, so the cost of a shot follows how much its content changes rather than its length.
+
+Run it without Blender, for example:
+    python blendersam_sequence.py --input plates/shot_010 --output masks/shot_010 --encoder sam_encoder.onnx --decoder sam_decoder.onnx
+    python blendersam_sequence.py --input shot_010.mov --output masks/shot_010 --encoder sam_encoder.onnx --decoder sam_decoder.onnx --format png
+"""
+
+# Import the necessary modules
+import os
+import re
+import time
+import queue
+import shutil
+import argparse
+import threading
+
+import numpy as np
+
+import blendersam_archive
+import blendersam_automask
+import blendersam_batch
+import blendersam_interactive
+import blendersam_profiling
+import blendersam_runtime
+
+# Define some constants for sequence segmentation
+PREFETCH_FRAMES = 4
+THUMBNAIL_SIZE = 64
+REUSE_THRESHOLD = 0.02
+SKIP_THRESHOLD = 0.002
+TRACK_CONFIDENCE = 0.5
+REDETECT_INTERVAL = 0
+NEW_INSTANCE_OVERLAP = 0.5
+MIN_INSTANCE_AREA = 16
+PROMPT_SIZE = 1024
+OUTPUT_FORMATS = ("archive", "png")
+
+
+def _natural_key(path):
+    # Sort frame files by the numbers in their names, so that frame_9 comes before frame_10
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", os.path.basename(path))]
+
+
+def list_frames(input_dir):
+    # List the image files of a frame directory in frame order
+    # Input: a string representing the path to the directory
+    # Output: a list of absolute image paths
+    paths = [os.path.join(input_dir, file_name) for file_name in os.listdir(input_dir)
+             if file_name.lower().endswith(blendersam_batch.IMAGE_EXTENSIONS)]
+    return sorted((os.path.abspath(path) for path in paths), key=_natural_key)
+
+
+def iter_frames(source, frame_start=0, frame_count=None):
+    # Read the frames of a directory of images or a movie file in order
+    # Input: a string representing the path to the directory or movie file, the index of the first frame,
+    # and the number of frames to read (None reads to the end)
+    # Output: yields the name of every frame and a numpy array of shape (H, W, 3) holding its pixels
+    stop = None if frame_count is None else frame_start + frame_count
+    if os.path.isdir(source):
+        for path in list_frames(source)[frame_start:stop]:
+            yield os.path.splitext(os.path.basename(path))[0], blendersam_batch.read_image(path)
+        return
+
+    import cv2
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise RuntimeError(f"Cannot open movie file: {source}")
+    try:
+        if frame_start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_start)
+        base = os.path.splitext(os.path.basename(source))[0]
+        index = frame_start
+        while stop is None or index < stop:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield f"{base}_{index:06d}", cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+    finally:
+        capture.release()
+
+
+def prefetch(frames, size=PREFETCH_FRAMES):
+    # Read frames on a background thread so that reading overlaps with segmentation, keeping at most size
+    # frames waiting in memory
+    # Input: an iterator of frames and the size of the prefetch queue
+    # Output: yields the frames of the iterator in order; errors raised while reading are raised here
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item):
+        # Wait for room in the queue, giving up when the consumer stopped
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for frame in frames:
+                if not put(frame):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(finished)
+
+    thread = threading.Thread(target=read, name="blendersam-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def thumbnail(image_array, size=THUMBNAIL_SIZE):
+    # Shrink a frame to a small grayscale image for frame comparisons
+    # Input: a numpy array of shape (H, W, C), uint8 or float in [0, 1], and the longest side of the thumbnail
+    # Output: a float32 numpy array with values in [0, 1]
+    step = max(1, -(-max(image_array.shape[:2]) // size))
+    small = image_array[::step, ::step, :3].astype(np.float32)
+    if image_array.dtype == np.uint8:
+        small /= 255.0
+    return small.mean(axis=2)
+
+
+def frame_difference(a, b):
+    # Measure how different two thumbnails are
+    # Input: two thumbnails returned by thumbnail, either of which may be None
+    # Output: a float representing the mean absolute difference, infinite if they cannot be compared
+    if a is None or b is None or a.shape != b.shape:
+        return float("inf")
+    return float(np.mean(np.abs(a - b)))
+
+
+def instance_prompts(label_map, ids):
+    # Turn the instances of a label map into prompts for the next frame: the bounding box of every instance
+    # plus a foreground point at its center, or a padding point where the center falls outside the instance
+    # Input: an integer numpy array of shape (H, W) holding 0 for background and instance ids, and an int32
+    # numpy array of the ids to prompt
+    # Output: float32 numpy arrays of shapes (N, 3, 2) and (N, 3) holding the prompt tensors in the layout of
+    # points_to_tensors with a box, and a boolean numpy array of shape (len(ids),) telling which ids still
+    # have pixels; N is the number of those ids
+    height, width = label_map.shape
+
+    # Measure the instances on a strided copy, which is precise enough for prompts
+    step = max(1, -(-max(height, width) // PROMPT_SIZE))
+    small = label_map[::step, ::step]
+    rows, columns = np.nonzero(small)
+    lookup = np.full(max(int(ids.max(initial=0)), int(small.max(initial=0))) + 1, -1, dtype=np.int64)
+    lookup[ids] = np.arange(len(ids))
+    index = lookup[small[rows, columns]]
+    inside = index >= 0
+    rows, columns, index = rows[inside], columns[inside], index[inside]
+
+    count = len(ids)
+    areas = np.bincount(index, minlength=count)
+    present = areas > 0
+    top = np.full(count, small.shape[0], dtype=np.int64)
+    left = np.full(count, small.shape[1], dtype=np.int64)
+    bottom = np.zeros(count, dtype=np.int64)
+    right = np.zeros(count, dtype=np.int64)
+    np.minimum.at(top, index, rows)
+    np.minimum.at(left, index, columns)
+    np.maximum.at(bottom, index, rows)
+    np.maximum.at(right, index, columns)
+    safe_areas = np.maximum(areas, 1)
+    center_rows = (np.bincount(index, weights=rows, minlength=count) / safe_areas).astype(np.int64)
+    center_columns = (np.bincount(index, weights=columns, minlength=count) / safe_areas).astype(np.int64)
+
+    # Keep the ids with pixels and convert everything to full resolution pixel coordinates
+    ids, top, left, bottom, right = ids[present], top[present], left[present], bottom[present], right[present]
+    center_rows, center_columns = center_rows[present], center_columns[present]
+    point_labels = np.where(small[center_rows, center_columns] == ids, 1.0, -1.0)
+    coords = np.empty((len(ids), 3, 2), dtype=np.float32)
+    coords[:, 0] = np.stack([(center_columns + 0.5) * step, (center_rows + 0.5) * step], axis=1)
+    coords[:, 1] = np.stack([left * step, top * step], axis=1)
+    coords[:, 2] = np.stack([np.minimum((right + 1) * step, width), np.minimum((bottom + 1) * step, height)], axis=1)
+    coords *= blendersam_runtime.ENCODER_SIZE / max(height, width)
+    labels = np.empty((len(ids), 3), dtype=np.float32)
+    labels[:, 0] = point_labels
+    labels[:, 1] = 2.0
+    labels[:, 2] = 3.0
+    return coords, labels, present
+
+
+class SequenceSegmenter:
+    # The instance ids, last embedding and last logits carried from one frame of a shot to the next
+
+    def __init__(self, encoder_path, decoder_path, threshold=0.5, confidence=blendersam_automask.PRED_IOU_THRESHOLD,
+                 track_confidence=TRACK_CONFIDENCE, points_per_side=blendersam_automask.POINTS_PER_SIDE,
+                 max_instances=None, reuse_threshold=REUSE_THRESHOLD, skip_threshold=SKIP_THRESHOLD,
+                 redetect_interval=REDETECT_INTERVAL):
+        self.encoder_path = encoder_path
+        self.decoder_path = decoder_path
+        self.threshold = threshold
+        self.cutoff = blendersam_runtime.logit_threshold(threshold)
+        self.confidence = confidence
+        self.track_confidence = track_confidence
+        self.points_per_side = points_per_side
+        self.max_instances = max_instances
+        self.reuse_threshold = reuse_threshold
+        self.skip_threshold = skip_threshold
+        self.redetect_interval = redetect_interval
+
+        self.label_map = None
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.scores = []
+        self.counts = {"encoded": 0, "reused": 0, "skipped": 0}
+        self._low_res = {}
+        self._embedding = None
+        self._key_thumbnail = None
+        self._processed_thumbnail = None
+        self._frames_since_detection = 0
+
+    def segment(self, image_array):
+        # Segment the next frame of the shot
+        # Input: a numpy array of shape (H, W, C) holding the frame pixels with the top row first
+        # Output: an int32 numpy array of shape (H, W) holding 0 for background and instance ids that stay the
+        # same across frames, and a string telling whether the frame was "encoded", "reused" the last
+        # embedding, or "skipped" because it matched the last segmented frame
+        frame_thumbnail = thumbnail(image_array)
+        if self.label_map is not None and \
+                frame_difference(frame_thumbnail, self._processed_thumbnail) < self.skip_threshold:
+            self.counts["skipped"] += 1
+            return self.label_map, "skipped"
+
+        # Compare with the frame the embedding was computed from, so that slow drifts still re-encode
+        if self._embedding is not None and \
+                frame_difference(frame_thumbnail, self._key_thumbnail) < self.reuse_threshold:
+            status = "reused"
+        else:
+            # Frames are seen once, so they skip the embedding cache instead of filling it
+            self._embedding = blendersam_runtime.encode_image(image_array, self.encoder_path, cache=None)
+            self._key_thumbnail = frame_thumbnail
+            status = "encoded"
+        self._processed_thumbnail = frame_thumbnail
+
+        image_size = image_array.shape[:2]
+        label_map = np.zeros(image_size, dtype=np.int32)
+        if len(self.ids) and self.label_map.shape == image_size:
+            with blendersam_profiling.span("propagate", instances=len(self.ids)):
+                self._propagate(label_map)
+        else:
+            self.ids = np.zeros(0, dtype=np.int32)
+            self._low_res = {}
+
+        # Look for instances when none are left to track, and for new ones every few frames if asked to
+        self._frames_since_detection += 1
+        if len(self.ids) == 0 or (self.redetect_interval and self._frames_since_detection >= self.redetect_interval):
+            with blendersam_profiling.span("detect"):
+                self._detect(image_array, label_map)
+            self._frames_since_detection = 0
+
+        self.label_map = label_map
+        self.counts[status] += 1
+        return label_map, status
+
+    def _propagate(self, label_map):
+        # Decode the instances of the last frame against the current embedding and paint them into label_map
+        image_size = label_map.shape
+        point_coords, point_labels, present = instance_prompts(self.label_map, self.ids)
+        ids = self.ids[present]
+        logits = np.empty((len(ids), blendersam_runtime.LOW_RES_SIZE, blendersam_runtime.LOW_RES_SIZE),
+                          dtype=np.float32)
+        scores = np.empty(len(ids), dtype=np.float32)
+
+        # Instances decoded before carry their logits as mask input, new ones are decoded from prompts alone
+        has_prior = np.array([int(i) in self._low_res for i in ids], dtype=bool)
+        for with_prior in (True, False):
+            group = np.flatnonzero(has_prior == with_prior)
+            if len(group) == 0:
+                continue
+            mask_input = np.stack([self._low_res[int(i)] for i in ids[group]]) if with_prior else None
+            for start, _, batch_scores, batch_low_res in blendersam_runtime.iter_decode(
+                    self._embedding, self.decoder_path, point_coords[group], point_labels[group],
+                    blendersam_interactive.decode_size(image_size), mask_input=mask_input):
+                batch = group[start:start + len(batch_scores)]
+                scores[batch] = batch_scores
+                logits[batch] = batch_low_res[:, 0]
+
+        # Upsample every instance inside its own window only, painting the best instances last so that they
+        # claim the pixels instances compete for
+        self._low_res = {}
+        for k in np.argsort(scores):
+            if scores[k] < self.track_confidence:
+                continue
+            window = blendersam_interactive.changed_window(logits[k], None, self.cutoff, image_size)
+            if window is None:
+                continue
+            top, bottom, left, right = window
+            mask = blendersam_interactive.upsample_region(logits[k], image_size, window) > self.cutoff
+            label_map[top:bottom, left:right][mask] = ids[k]
+            self._low_res[int(ids[k])] = logits[k][None].copy()
+            self.scores[ids[k] - 1] = float(scores[k])
+
+        # Retire the instances that lost their pixels and clear the few pixels they kept
+        areas = np.bincount(label_map.ravel(), minlength=len(self.scores) + 1)
+        kept = areas[ids] >= MIN_INSTANCE_AREA
+        retired = ids[~kept]
+        if len(retired) and areas[retired].any():
+            lookup = np.arange(len(self.scores) + 1, dtype=np.int32)
+            lookup[retired] = 0
+            label_map[...] = lookup[label_map]
+        for i in retired:
+            self._low_res.pop(int(i), None)
+        self.ids = ids[kept]
+
+    def _detect(self, image_array, label_map):
+        # Find instances with automatic mask generation and add the ones that are not tracked yet
+        masks, scores = blendersam_automask.generate_masks(image_array,
+                                                           self.encoder_path,
+                                                           self.decoder_path,
+                                                           threshold=self.threshold,
+                                                           points_per_side=self.points_per_side,
+                                                           pred_iou_threshold=self.confidence,
+                                                           max_masks=self.max_instances,
+                                                           embedding=self._embedding)
+        new_ids = []
+        for i in range(len(masks)):
+            if self.max_instances is not None and len(self.ids) + len(new_ids) >= self.max_instances:
+                break
+
+            # Masks come best first; skip the ones that mostly cover instances that are already tracked
+            mask = masks[i]
+            free = mask & (label_map == 0)
+            free_area = np.count_nonzero(free)
+            if free_area < MIN_INSTANCE_AREA or free_area < (1.0 - NEW_INSTANCE_OVERLAP) * np.count_nonzero(mask):
+                continue
+            self.scores.append(float(scores[i]))
+            label_map[free] = len(self.scores)
+            new_ids.append(len(self.scores))
+        self.ids = np.concatenate([self.ids, np.asarray(new_ids, dtype=np.int32)])
+
+
+def frame_path(output_dir, name, output_format="archive"):
+    # Build the output path of a frame from its name directly, since frame names may contain dots
+    if output_format == "png":
+        return os.path.join(output_dir, f"{name}_labels.png")
+    return os.path.join(output_dir, name + blendersam_archive.ARCHIVE_SUFFIX)
+
+
+def write_frame(output_dir, name, label_map, scores, output_format="archive"):
+    # Write the label map of one frame
+    # Input: a string representing the output directory, the frame name, an int32 numpy array of shape (H, W)
+    # holding the label map, a list of the scores of every instance id, and a format in OUTPUT_FORMATS
+    # Output: a string representing the path to the written file
+    if output_format == "png":
+        import cv2
+
+        # A 16-bit PNG per frame keeps the instance ids for compositing applications
+        path = frame_path(output_dir, name, output_format)
+        if not cv2.imwrite(path, np.minimum(label_map, 65535).astype(np.uint16)):
+            raise RuntimeError(f"Cannot write label map: {path}")
+        return path
+
+    path = frame_path(output_dir, name, output_format)
+    colors = blendersam_runtime.label_colors(len(scores))
+    blendersam_archive.write_archive(path, label_map.shape, np.asarray(scores, dtype=np.float32), colors,
+                                     label_map=label_map)
+    return path
+
+
+def segment_sequence(source, output_dir, encoder_path, decoder_path, threshold=0.5,
+                     confidence=blendersam_automask.PRED_IOU_THRESHOLD, track_confidence=TRACK_CONFIDENCE,
+                     points_per_side=blendersam_automask.POINTS_PER_SIDE, max_instances=None,
+                     reuse_threshold=REUSE_THRESHOLD, skip_threshold=SKIP_THRESHOLD,
+                     redetect_interval=REDETECT_INTERVAL, prefetch_frames=PREFETCH_FRAMES, output_format="archive",
+                     frame_start=0, frame_count=None, job=None):
+    # Segment every frame of a shot and write one label map per frame
+    # Input: a string representing the path to a directory of frames or a movie file, the output directory,
+    # strings representing the paths to the encoder and decoder checkpoints, the threshold value for
+    # binarizing the masks, the minimum predicted IoU of new instances and of tracked instances, the grid
+    # density and maximum number of instances of detection, the thumbnail differences below which the last
+    # embedding or the last label map is reused, the number of frames between detections of new instances
+    # (0 only detects when nothing is tracked), the size of the prefetch queue, the output format, the range
+    # of frames to segment, and an optional Job for progress
+    # Output: a dictionary with the number of frames, how many were encoded, reused and skipped, the number
+    # of instances, the throughput, and the written paths
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    os.makedirs(output_dir, exist_ok=True)
+    segmenter = SequenceSegmenter(encoder_path, decoder_path, threshold=threshold, confidence=confidence,
+                                  track_confidence=track_confidence, points_per_side=points_per_side,
+                                  max_instances=max_instances, reuse_threshold=reuse_threshold,
+                                  skip_threshold=skip_threshold, redetect_interval=redetect_interval)
+    total = frame_count
+    if total is None and os.path.isdir(source):
+        total = max(0, len(list_frames(source)) - frame_start)
+
+    outputs = []
+    start = time.perf_counter()
+    frames = prefetch(iter_frames(source, frame_start, frame_count), prefetch_frames)
+    try:
+        for name, image in frames:
+            if job is not None:
+                job.report(len(outputs) / total if total else 0.0,
+                           f"Segmenting frame {len(outputs) + 1}" + (f"/{total}" if total else ""))
+            frame_start_time = time.perf_counter()
+            label_map, status = segmenter.segment(image)
+
+            # A skipped frame has the label map of the last frame, so its file is copied instead of encoded
+            if status == "skipped" and outputs:
+                path = frame_path(output_dir, name, output_format)
+                shutil.copyfile(outputs[-1], path)
+            else:
+                path = write_frame(output_dir, name, label_map, segmenter.scores, output_format)
+            outputs.append(path)
+            print(f"[{len(outputs)}{f'/{total}' if total else ''}] {name}: {status}, {len(segmenter.ids)} instances "
+                  f"in {time.perf_counter() - frame_start_time:.2f}s")
+    finally:
+        frames.close()
+
+    elapsed = time.perf_counter() - start
+    throughput = len(outputs) / elapsed if elapsed > 0 else 0.0
+    print(f"BlenderSAM sequence: {len(outputs)} frames, {segmenter.counts['encoded']} encoded, "
+          f"{segmenter.counts['reused']} reused, {segmenter.counts['skipped']} skipped, "
+          f"{len(segmenter.scores)} instances in {elapsed:.1f}s ({throughput:.2f} frames/s)")
+    return {"frames": len(outputs), **segmenter.counts, "instances": len(segmenter.scores),
+            "seconds": elapsed, "frames_per_second": throughput, "outputs": outputs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment an image sequence or movie file with temporal mask propagation")
+    parser.add_argument("--input", required=True, help="A directory of frames or a movie file")
+    parser.add_argument("--output", required=True, help="The directory for the per-frame label maps")
+    parser.add_argument("--encoder", required=True, help="The fp32 image encoder checkpoint")
+    parser.add_argument("--decoder", required=True, help="The fp32 mask decoder checkpoint")
+    parser.add_argument("--precision", default="fp32", choices=blendersam_runtime.MODEL_PRECISIONS)
+    parser.add_argument("--profile", default="default", choices=sorted(blendersam_runtime.RUNTIME_PROFILES))
+    parser.add_argument("--threads", type=int, default=None, help="The number of ONNX Runtime threads")
+    parser.add_argument("--threshold", type=float, default=0.5, help="The threshold value for binarizing the masks")
+    parser.add_argument("--confidence", type=float, default=blendersam_automask.PRED_IOU_THRESHOLD, help="The minimum predicted IoU of new instances")
+    parser.add_argument("--track-confidence", type=float, default=TRACK_CONFIDENCE, help="The minimum predicted IoU of tracked instances")
+    parser.add_argument("--points-per-side", type=int, default=blendersam_automask.POINTS_PER_SIDE, help="The grid density of instance detection")
+    parser.add_argument("--max-instances", type=int, default=None, help="The maximum number of instances to track")
+    parser.add_argument("--reuse-threshold", type=float, default=REUSE_THRESHOLD, help="Reuse the last embedding below this frame difference")
+    parser.add_argument("--skip-threshold", type=float, default=SKIP_THRESHOLD, help="Reuse the last label map below this frame difference")
+    parser.add_argument("--redetect-every", type=int, default=REDETECT_INTERVAL, help="Look for new instances every this many frames, 0 only when nothing is tracked")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_FRAMES, help="The number of frames read ahead")
+    parser.add_argument("--format", default="archive", choices=OUTPUT_FORMATS, help="Write mask archives or 16-bit label PNGs")
+    parser.add_argument("--start", type=int, default=0, help="The index of the first frame")
+    parser.add_argument("--count", type=int, default=None, help="The number of frames to segment")
+    args = parser.parse_args()
+
+    blendersam_runtime.set_runtime_profile(args.profile, intra_op_threads=args.threads)
+    segment_sequence(args.input, args.output,
+                     blendersam_runtime.variant_path(args.encoder, args.precision),
+                     blendersam_runtime.variant_path(args.decoder, args.precision),
+                     threshold=args.threshold, confidence=args.confidence, track_confidence=args.track_confidence,
+                     points_per_side=args.points_per_side, max_instances=args.max_instances,
+                     reuse_threshold=args.reuse_threshold, skip_threshold=args.skip_threshold,
+                     redetect_interval=args.redetect_every, prefetch_frames=args.prefetch, output_format=args.format,
+                     frame_start=args.start, frame_count=args.count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# BlenderSAM tiled segmentation
+# Author: AmusedDiffuser
+
+"""
+Segments images that are too large for one pass of the image encoder. The image is split into
+overlapping tiles that are encoded and decoded one after another, tile masks are stitched across the
+seams into one global label map, and the tile size and decoder batch are chosen to stay inside a peak
+memory budget. Large label maps live in a memory-mapped file so that memory stays flat no matter how
+big the image is.
+"""
+
+# Import the necessary modules
+import os
+import tempfile
+
+import numpy as np
+
+import blendersam_runtime
+
+# Define some constants for tiled segmentation
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+MIN_TILE_SIZE = 256
+POINTS_PER_SIDE = 16
+MEMORY_BUDGET_MB = 2048
+MERGE_THRESHOLD = 0.5
+TEXTURE_SIZE = 4096
+RELABEL_ROWS = 1024
+
+
+def plan_tiles(height, width, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    # Cover an image with overlapping tiles
+    # Input: the height and width of the image, the tile size and the overlap between tiles in pixels
+    # Output: a list of (top, bottom, left, right) pixel bounds, one per tile, in row-major order
+    stride = max(tile_size - overlap, 1)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+    return [(top, min(top + tile_size, height), left, min(left + tile_size, width))
+            for top in starts(height) for left in starts(width)]
+
+
+def estimate_tile_memory(tile_size, batch_size, mask_count=POINTS_PER_SIDE ** 2):
+    # Estimate the peak memory used while one tile is segmented
+    # Input: the tile size in pixels, the number of prompts decoded per call and the number of masks per tile
+    # Output: an integer representing the estimate in bytes
+    pixels = tile_size * tile_size
+    encoder_input = 3 * blendersam_runtime.ENCODER_SIZE ** 2 * 4
+    embedding = 256 * 64 * 64 * 4
+    tile_copy = pixels * 4 * 4
+    decoded = pixels * batch_size * (4 + 1)
+    packed_masks = -(-pixels // 8) * mask_count
+    return encoder_input + embedding + tile_copy + decoded + packed_masks
+
+
+def fit_memory_budget(memory_budget_mb, tile_size=TILE_SIZE, batch_size=blendersam_runtime.DECODER_BATCH,
+                      mask_count=POINTS_PER_SIDE ** 2):
+    # Shrink the decoder batch first and the tile size second until a tile fits in the memory budget
+    # Input: the memory budget in megabytes, the preferred tile size and decoder batch size, and the number of
+    # masks decoded per tile
+    # Output: the tile size and decoder batch size to use
+    budget = memory_budget_mb * 2 ** 20
+    while estimate_tile_memory(tile_size, batch_size, mask_count) > budget and batch_size > 1:
+        batch_size //= 2
+    while estimate_tile_memory(tile_size, batch_size, mask_count) > budget and tile_size > MIN_TILE_SIZE:
+        tile_size //= 2
+    return tile_size, batch_size
+
+
+def new_label_map(shape, memory_budget_mb, label_path=None):
+    # Create the global label map in RAM or, when it would not fit next to the tiles, in a memory-mapped file
+    # Input: the (H, W) shape of the image, the memory budget in megabytes, and an optional .npy file path
+    # Output: a zero-filled int32 numpy array or numpy memmap of the given shape
+    if label_path is None and shape[0] * shape[1] * 4 <= memory_budget_mb * 2 ** 20 // 4:
+        return np.zeros(shape, dtype=np.int32)
+    if label_path is None:
+        os.makedirs(blendersam_runtime.CACHE_DIR, exist_ok=True)
+        handle, label_path = tempfile.mkstemp(suffix=".npy", prefix="labels_", dir=blendersam_runtime.CACHE_DIR)
+        os.close(handle)
+    return np.lib.format.open_memmap(label_path, mode="w+", dtype=np.int32, shape=tuple(shape))
+
+
+def seen_pixels(tiles, t):
+    # Find the pixels of a tile that earlier tiles already covered
+    # Input: a list of tile bounds returned by plan_tiles and the index of the tile
+    # Output: a boolean numpy array of the tile's shape
+    top, bottom, left, right = tiles[t]
+    seen = np.zeros((bottom - top, right - left), dtype=bool)
+    for other_top, other_bottom, other_left, other_right in tiles[:t]:
+        rows = slice(max(other_top, top) - top, min(other_bottom, bottom) - top)
+        columns = slice(max(other_left, left) - left, min(other_right, right) - left)
+        if rows.start < rows.stop and columns.start < columns.stop:
+            seen[rows, columns] = True
+    return seen
+
+
+def stitch_mask(region, mask, areas, scores, score, merge_threshold=MERGE_THRESHOLD, seen=None, first_label=0):
+    # Add one tile mask to the global label map
+    # Input: the view of the global label map covered by the tile, a boolean numpy array of the same shape
+    # holding the mask, the lists of instance areas and scores indexed by label, the mask score, the IoU
+    # above which the mask is merged into the instance it overlaps, a boolean numpy array of the tile's shape
+    # holding the pixels earlier tiles covered (None for all of them), and the first label of the current tile
+    # Output: None; region, areas and scores are updated in place
+    claimed = region[mask]
+    claimed = claimed[claimed > 0]
+    target = 0
+
+    # Merge the mask into the instance it overlaps most if they agree on the pixels both tiles have seen; an
+    # instance of an earlier tile is only compared inside the overlap with the earlier tiles, since the rest of
+    # the object lies outside the tile
+    if len(claimed):
+        ids, counts = np.unique(claimed, return_counts=True)
+        best = int(ids[np.argmax(counts)])
+        compared = mask
+        instance = region == best
+        if seen is not None and best < first_label:
+            compared = mask & seen
+            instance &= seen
+        overlap = np.count_nonzero(compared & instance)
+        union = np.count_nonzero(compared | instance)
+        if union and overlap / union >= merge_threshold:
+            target = best
+
+    if target == 0:
+        target = len(areas)
+        areas.append(0)
+        scores.append(score)
+    else:
+        scores[target] = max(scores[target], score)
+
+    # Only label the pixels that no earlier, higher scoring mask claimed
+    free = mask & (region == 0)
+    region[free] = target
+    areas[target] += int(np.count_nonzero(free))
+
+
+def segment_tiled(image_array, encoder_path, decoder_path, threshold=0.5, confidence=0.0, tile_size=TILE_SIZE,
+                  overlap=TILE_OVERLAP, points_per_side=POINTS_PER_SIDE, memory_budget_mb=MEMORY_BUDGET_MB,
+                  merge_threshold=MERGE_THRESHOLD, label_path=None, job=None):
+    # Segment every object in an image of any size, one overlapping tile at a time
+    # Input: a numpy array of shape (H, W, C) holding the image pixels with the top row first, strings
+    # representing the paths to the encoder and decoder checkpoints, the threshold value for binarizing the
+    # masks, the confidence value for filtering out low-confidence masks, the tile size and overlap in pixels,
+    # the number of grid points along each side of a tile, the peak memory budget in megabytes, the IoU above
+    # which masks are merged across seams, an optional .npy path for the label map, and an optional Job
+    # Output: an int32 numpy array (or memmap) of shape (H, W) holding 0 for background and k + 1 for instance
+    # k, and a float32 numpy array holding the score of every instance
+    height, width = image_array.shape[:2]
+    tile_size, batch_size = fit_memory_budget(memory_budget_mb, min(tile_size, max(height, width)),
+                                              mask_count=points_per_side ** 2)
+    overlap = min(overlap, tile_size // 2)
+    cutoff = blendersam_runtime.logit_threshold(threshold)
+
+    label_map = new_label_map((height, width), memory_budget_mb, label_path)
+    areas = [0]
+    scores = [0.0]
+
+    tiles = plan_tiles(height, width, tile_size, overlap)
+    for t, (top, bottom, left, right) in enumerate(tiles):
+        if job is not None:
+            job.report(0.9 * t / len(tiles), f"Segmenting tile {t + 1}/{len(tiles)}")
+
+        # Encode the tile and decode a grid of point prompts in memory-bounded batches
+        tile = image_array[top:bottom, left:right]
+        tile_shape = tile.shape[:2]
+        embedding = blendersam_runtime.encode_image(tile, encoder_path, cache=None)
+        points = blendersam_runtime.point_grid(points_per_side, tile_shape)
+        point_coords, point_labels = blendersam_runtime.prompts_to_tensors(points, "point", tile_shape)
+        region = label_map[top:bottom, left:right]
+        seen = seen_pixels(tiles, t)
+        first_label = len(areas)
+
+        # Keep the confident masks of the whole tile bit-packed, since they must be ranked before any is stitched
+        packed_masks = []
+        mask_scores = []
+        for _, logits, batch_scores, _ in blendersam_runtime.iter_decode(
+                embedding, decoder_path, point_coords, point_labels, tile_shape, batch_size=batch_size):
+            for i in np.flatnonzero(batch_scores >= confidence):
+                mask = logits[i] > cutoff
+                if mask.any():
+                    packed_masks.append(np.packbits(mask, axis=None))
+                    mask_scores.append(float(batch_scores[i]))
+
+        # Stitch the best masks of the tile first so that they claim the contested pixels
+        pixel_count = tile_shape[0] * tile_shape[1]
+        for i in np.argsort(-np.asarray(mask_scores), kind="stable"):
+            mask = np.unpackbits(packed_masks[i], count=pixel_count).view(bool).reshape(tile_shape)
+            stitch_mask(region, mask, areas, scores, mask_scores[i], merge_threshold, seen, first_label)
+
+    # Renumber the instances that kept pixels to 1..N, a block of rows at a time
+    if job is not None:
+        job.report(0.95, "Stitching tiles")
+    kept = np.flatnonzero(np.asarray(areas) > 0)
+    kept = kept[kept > 0]
+    lookup = np.zeros(len(areas), dtype=np.int32)
+    lookup[kept] = np.arange(1, len(kept) + 1, dtype=np.int32)
+    for row in range(0, height, RELABEL_ROWS):
+        label_map[row:row + RELABEL_ROWS] = lookup[label_map[row:row + RELABEL_ROWS]]
+
+    return label_map, np.asarray(scores, dtype=np.float32)[kept]
+
+
+class LabelMasks:
+    # A read-only sequence of binary masks backed by one label map, optionally reduced to a texture size,
+    # so that instance masks are only materialized one at a time
+
+    def __init__(self, label_map, count, max_size=TEXTURE_SIZE):
+        step = 1 if max_size is None else max(1, -(-max(label_map.shape) // max_size))
+        self.label_map = np.array(label_map[::step, ::step])
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.label_map == i + 1